@@ -0,0 +1,156 @@
+"""
+转发熔断
+
+按目标主机统计最近 CIRCUIT_WINDOW_SECONDS 秒内的转发结果，失败（连接错误、超时、5xx、429）
+与慢调用（超过 CIRCUIT_SLOW_CALL_SECONDS）占比达到 CIRCUIT_FAILURE_RATE 时熔断：
+
+    closed -> open：窗口内请求数不少于 CIRCUIT_MIN_REQUESTS 且失败率超限
+    open -> half_open：熔断 CIRCUIT_OPEN_SECONDS 秒后放行少量探测请求
+    half_open -> closed / open：探测成功恢复，失败重新熔断
+
+熔断期间转发直接返回失败（不发请求），outbox 记录按熔断剩余时间延后，不消耗重试次数。
+"""
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from app.settings import settings
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def is_failure(status_code: Optional[int]) -> bool:
+    """目标不可用的信号：无响应、5xx、429（其他 4xx 说明目标在线，不计入）"""
+    return status_code is None or status_code >= 500 or status_code == 429
+
+
+class CircuitBreaker:
+    """单个目标主机的熔断器（只在事件循环线程内使用）"""
+
+    def __init__(self, host: str, clock: Callable[[], float] = time.monotonic):
+        self.host = host
+        self.state = CLOSED
+        self._clock = clock
+        self._window: Deque[Tuple[float, bool, float]] = deque()
+        self._opened_at: Optional[float] = None
+        self._probes = 0
+
+    def _trim(self, now: float):
+        horizon = now - settings.CIRCUIT_WINDOW_SECONDS
+        while self._window and self._window[0][0] < horizon:
+            self._window.popleft()
+
+    def allow(self) -> bool:
+        """是否放行本次请求（half_open 时占用一个探测名额，需随后调用 record）"""
+        if self.state == OPEN:
+            if self._clock() - self._opened_at < settings.CIRCUIT_OPEN_SECONDS:
+                return False
+            self.state = HALF_OPEN
+            self._probes = 0
+        if self.state == HALF_OPEN:
+            if self._probes >= settings.CIRCUIT_HALF_OPEN_PROBES:
+                return False
+            self._probes += 1
+        return True
+
+    def record(self, failed: bool, elapsed: float, probe: bool = False):
+        """
+        记录一次转发结果
+
+        慢调用（elapsed 超过 CIRCUIT_SLOW_CALL_SECONDS）同样计为失败；
+        probe 表示该请求是 half_open 时放行的探测；熔断前发出、之后才完成的请求不影响状态。
+        """
+        now = self._clock()
+        failed = failed or elapsed >= settings.CIRCUIT_SLOW_CALL_SECONDS
+        if self.state == HALF_OPEN:
+            if not probe:
+                return
+            self._probes = max(0, self._probes - 1)
+            if failed:
+                self._open(now)
+            else:
+                self.state = CLOSED
+                self._window.clear()
+            return
+        if self.state == OPEN or probe:
+            return
+
+        self._window.append((now, failed, elapsed))
+        self._trim(now)
+        requests, failures = len(self._window), sum(1 for _, f, _ in self._window if f)
+        if requests >= settings.CIRCUIT_MIN_REQUESTS and failures / requests >= settings.CIRCUIT_FAILURE_RATE:
+            self._open(now)
+
+    def cancel(self, probe: bool):
+        """放行后未完成的请求：归还探测名额"""
+        if probe and self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self._opened_at = now
+        self._probes = 0
+        self._window.clear()
+
+    def retry_after(self) -> float:
+        """被拒绝的请求建议延后的秒数"""
+        if self.state == OPEN:
+            return max(1.0, settings.CIRCUIT_OPEN_SECONDS - (self._clock() - self._opened_at))
+        return 1.0
+
+    def snapshot(self) -> Dict:
+        now = self._clock()
+        self._trim(now)
+        requests = len(self._window)
+        failures = sum(1 for _, failed, _ in self._window if failed)
+        latency = sum(elapsed for _, _, elapsed in self._window) / requests if requests else 0.0
+        retry_at = None
+        if self.state == OPEN:
+            retry_at = datetime.utcnow() + timedelta(seconds=self.retry_after())
+        return {
+            "host": self.host,
+            "state": self.state,
+            "requests": requests,
+            "failure_rate": round(failures / requests, 4) if requests else 0.0,
+            "avg_latency": round(latency, 4),
+            "retry_at": retry_at,
+        }
+
+
+class CircuitBreakerRegistry:
+    """按目标主机维护熔断器"""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, url: str) -> Optional[CircuitBreaker]:
+        """未启用熔断时返回 None"""
+        if not settings.CIRCUIT_ENABLED:
+            return None
+        key = host_key(url)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(key, self._clock)
+            self._breakers[key] = breaker
+        return breaker
+
+    def snapshot(self) -> List[Dict]:
+        return [breaker.snapshot() for breaker in self._breakers.values()]
+
+    def reset(self):
+        self._breakers.clear()
+
+
+# 应用级单例
+circuit_breakers = CircuitBreakerRegistry()
@@ -0,0 +1,149 @@
+"""
+payload / headers 压缩编解码
+
+不依赖 ORM 模型，models 中的 Event 写入钩子与读取属性直接调用。
+zstd 可使用按事件源训练的字典（compression_dicts 表），字典在本进程内缓存。
+"""
+import logging
+import threading
+import zlib
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from app.settings import settings
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_dicts_by_id: Dict[int, bytes] = {}
+_active_dicts: Optional[Dict[str, int]] = None
+_warned_zstd_missing = False
+
+_DICTIONARY_QUERY = text("SELECT id, source, data, active FROM compression_dicts")
+
+
+def configured_codec() -> Optional[str]:
+    """当前配置的压缩格式（zstd 不可用时退回 zlib）"""
+    global _warned_zstd_missing
+    codec = (settings.STORAGE_COMPRESSION or "none").lower()
+    if codec == "none":
+        return None
+    if codec == "zstd" and zstandard is None:
+        if not _warned_zstd_missing:
+            logger.warning("STORAGE_COMPRESSION=zstd requires the 'zstandard' package, using zlib")
+            _warned_zstd_missing = True
+        return "zlib"
+    return codec
+
+
+def load_dictionaries(bind):
+    """加载全部压缩字典到内存（字典表很小）；bind 为 Connection 或 Engine"""
+    global _active_dicts
+    if isinstance(bind, Engine):
+        with bind.connect() as connection:
+            rows = connection.execute(_DICTIONARY_QUERY).all()
+    else:
+        rows = bind.execute(_DICTIONARY_QUERY).all()
+
+    active: Dict[str, int] = {}
+    for dict_id, source, data, is_active in rows:
+        _dicts_by_id[dict_id] = data
+        if is_active and (source not in active or dict_id > active[source]):
+            active[source] = dict_id
+    _active_dicts = active
+
+
+def reload_dictionaries(bind):
+    """字典训练后调用，使新字典在本进程生效"""
+    _dicts_by_id.clear()
+    if hasattr(_local, "compressors"):
+        _local.compressors.clear()
+        _local.decompressors.clear()
+    load_dictionaries(bind)
+
+
+def _thread_cache() -> Tuple[Dict, Dict]:
+    """线程内复用的 zstd 压缩器 / 解压器（zstd 对象不可跨线程共享）"""
+    if not hasattr(_local, "compressors"):
+        _local.compressors = {}
+        _local.decompressors = {}
+    return _local.compressors, _local.decompressors
+
+
+def _dictionary(dict_id: int, bind=None) -> "zstandard.ZstdCompressionDict":
+    if dict_id not in _dicts_by_id:
+        if bind is None:
+            raise RuntimeError(f"Compression dictionary {dict_id} is not loaded")
+        load_dictionaries(bind)
+    return zstandard.ZstdCompressionDict(_dicts_by_id[dict_id])
+
+
+def _compressor(dict_id: Optional[int]):
+    compressors, _ = _thread_cache()
+    compressor = compressors.get(dict_id)
+    if compressor is None:
+        kwargs = {"level": settings.STORAGE_COMPRESSION_LEVEL}
+        if dict_id is not None:
+            kwargs["dict_data"] = _dictionary(dict_id)
+        compressor = zstandard.ZstdCompressor(**kwargs)
+        compressors[dict_id] = compressor
+    return compressor
+
+
+def _decompressor(dict_id: Optional[int], bind=None):
+    _, decompressors = _thread_cache()
+    decompressor = decompressors.get(dict_id)
+    if decompressor is None:
+        kwargs = {}
+        if dict_id is not None:
+            kwargs["dict_data"] = _dictionary(dict_id, bind)
+        decompressor = zstandard.ZstdDecompressor(**kwargs)
+        decompressors[dict_id] = decompressor
+    return decompressor
+
+
+def compress(codec: str, data: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.compress(data, settings.STORAGE_COMPRESSION_LEVEL)
+    if codec.startswith("zstd"):
+        dict_id = int(codec.split(":", 1)[1]) if ":" in codec else None
+        return _compressor(dict_id).compress(data)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def decompress(codec: str, data: bytes, bind=None) -> bytes:
+    """解压；使用本进程未加载的字典时通过 bind 读取字典表"""
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec.startswith("zstd"):
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed events require the 'zstandard' package")
+        dict_id = int(codec.split(":", 1)[1]) if ":" in codec else None
+        return _decompressor(dict_id, bind).decompress(data)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def decode_text(codec: Optional[str], blob: Optional[bytes], text_value: Optional[str], bind=None) -> Optional[str]:
+    """按存储格式还原文本"""
+    if codec is None or blob is None:
+        return text_value
+    return decompress(codec, blob, bind).decode("utf-8")
+
+
+def choose_codec(source: Optional[str], bind) -> Optional[str]:
+    """为事件源选择压缩格式（zstd 且有该源字典时带上字典 ID）"""
+    codec = configured_codec()
+    if codec != "zstd":
+        return codec
+    if _active_dicts is None:
+        load_dictionaries(bind)
+    dict_id = _active_dicts.get(source)
+    return f"zstd:{dict_id}" if dict_id is not None else "zstd"
@@ -0,0 +1,57 @@
+"""
+投递去重
+
+服务商重试时会带着相同的投递 ID（Stripe 事件 id、X-GitHub-Delivery、自定义头）。
+events 表上 (source, delivery_id) 唯一索引保证不重复入库，
+最近见过的投递 ID 缓存在内存中，重试风暴时无需访问数据库即可确认重复。
+"""
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from app.settings import settings
+
+
+class RecentDeliveryCache:
+    """有界 LRU：(source, delivery_id) -> event_id"""
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size or settings.DEDUP_CACHE_SIZE
+        self._entries: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self.hits = 0
+
+    def get(self, source: str, delivery_id: Optional[str]) -> Optional[int]:
+        if not delivery_id:
+            return None
+        key = (source, delivery_id)
+        event_id = self._entries.get(key)
+        if event_id is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return event_id
+
+    def remember(self, source: str, delivery_id: Optional[str], event_id: int):
+        if not delivery_id:
+            return
+        key = (source, delivery_id)
+        self._entries[key] = event_id
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def normalize_delivery_id(value) -> Optional[str]:
+    """投递 ID 统一为不超过 255 字符的字符串，空值返回 None"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value[:255] or None
+
+
+# 应用级单例
+delivery_cache = RecentDeliveryCache()
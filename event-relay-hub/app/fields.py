@@ -0,0 +1,166 @@
+"""
+payload 字段索引
+
+按 FIELD_EXTRACTORS 配置的点分路径（如 data.object.customer、repository.full_name），
+入库时从 payload 提取一次写入 event_fields 表，/api/events?field.<名称>=<值> 通过
+(field, value, event_id) 索引定位事件，无需扫描 payload 文本。
+
+修改配置后为存量事件补建索引：
+    python -m app.fields backfill
+"""
+import argparse
+import json
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Query, Session, undefer_group
+
+from app.models import Event, EventField, SessionLocal, init_db
+from app.settings import settings
+
+
+MAX_VALUE_LENGTH = 255
+
+
+class FieldExtractor:
+    """按事件源编译好的字段路径"""
+
+    def __init__(self, config: Optional[Dict[str, Dict[str, str]]] = None):
+        config = settings.FIELD_EXTRACTORS if config is None else config
+        self._paths: Dict[str, List[Tuple[str, List[str]]]] = {
+            source: [(name, path.split(".")) for name, path in fields.items()]
+            for source, fields in config.items()
+        }
+        self.names: Set[str] = {name for fields in config.values() for name in fields}
+
+    def paths_for(self, source: str) -> List[Tuple[str, List[str]]]:
+        return self._paths.get(source, []) + self._paths.get("*", [])
+
+    def extract(self, source: str, payload: str) -> List[Tuple[str, str]]:
+        """提取字段值；列表中的标量各自成为一个值，非 JSON payload 返回空"""
+        paths = self.paths_for(source)
+        if not paths or not payload:
+            return []
+        try:
+            document = json.loads(payload)
+        except (TypeError, ValueError):
+            return []
+
+        pairs: List[Tuple[str, str]] = []
+        for name, path in paths:
+            for value in _resolve(document, path):
+                pairs.append((name, value))
+        return pairs
+
+
+def _resolve(document: Any, path: List[str]) -> Iterable[str]:
+    node = document
+    for key in path:
+        if isinstance(node, dict):
+            node = node.get(key)
+        elif isinstance(node, list) and key.isdigit() and int(key) < len(node):
+            node = node[int(key)]
+        else:
+            return []
+    values = node if isinstance(node, list) else [node]
+    return [
+        _scalar(value)[:MAX_VALUE_LENGTH] for value in values
+        if value is not None and not isinstance(value, (dict, list))
+    ]
+
+
+def _scalar(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def record_fields(db: Session, events: List[Event], extractor: Optional["FieldExtractor"] = None):
+    """入库路径调用：在当前事务内写入字段索引（事件需已 flush）"""
+    extractor = extractor or field_extractor
+    rows = [
+        {"event_id": event.id, "field": name, "value": value}
+        for event in events
+        for name, value in extractor.extract(event.source, event.payload)
+    ]
+    if rows:
+        db.execute(insert(EventField), rows)
+
+
+def filter_fields(query: Query, filters: Dict[str, str]) -> Query:
+    """按字段值过滤事件（每个条件走 idx_field_value_event 索引）"""
+    for name, value in filters.items():
+        query = query.filter(Event.id.in_(
+            select(EventField.event_id).where(EventField.field == name, EventField.value == value)
+        ))
+    return query
+
+
+def parse_field_params(params: Iterable[Tuple[str, str]], extractor: Optional["FieldExtractor"] = None) -> Dict[str, str]:
+    """
+    从查询参数中取出 field.<名称>=<值> 条件
+
+    Raises:
+        ValueError: 名称未在 FIELD_EXTRACTORS 中配置
+    """
+    extractor = extractor or field_extractor
+    filters = {}
+    for key, value in params:
+        if not key.startswith("field."):
+            continue
+        name = key[len("field."):]
+        if name not in extractor.names:
+            raise ValueError(f"Unknown field: {name}")
+        filters[name] = value
+    return filters
+
+
+def backfill(batch_size: int = 1000, session_factory=SessionLocal) -> int:
+    """按当前配置重建全部事件的字段索引（按 id 分批提交，可中断后重跑），返回事件数"""
+    extractor = FieldExtractor()
+    total = 0
+    after_id = 0
+    while True:
+        db: Session = session_factory()
+        try:
+            events = (
+                db.query(Event)
+                .options(undefer_group("body"))
+                .filter(Event.id > after_id)
+                .order_by(Event.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not events:
+                break
+            ids = [event.id for event in events]
+            db.query(EventField).filter(EventField.event_id.in_(ids)).delete(synchronize_session=False)
+            record_fields(db, events, extractor)
+            db.commit()
+            total += len(events)
+            after_id = ids[-1]
+        finally:
+            db.close()
+    return total
+
+
+# 应用级单例
+field_extractor = FieldExtractor()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexed payload field tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = sub.add_parser("backfill", help="rebuild event_fields for existing events")
+    backfill_parser.add_argument("--batch-size", type=int, default=1000)
+
+    args = parser.parse_args()
+    init_db()
+
+    if args.command == "backfill":
+        total = backfill(batch_size=args.batch_size)
+        print(f"✓ indexed fields for {total} events")
+
+
+if __name__ == "__main__":
+    main()
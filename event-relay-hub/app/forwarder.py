@@ -3,16 +3,211 @@
 """
 import json
 import asyncio
-from typing import Optional
+import importlib.util
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
 import httpx
 
+from app.circuit import HALF_OPEN, CircuitBreakerRegistry, circuit_breakers, is_failure
+from app.metrics import forward_seconds, forwards_total
 from app.models import Event, ForwardLog, SessionLocal
+from app.routing import ForwardTarget, router
 from app.settings import settings
 
 
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ForwardResult:
+    """单次转发结果"""
+    success: bool
+    status_code: Optional[int] = None
+    error_message: Optional[str] = None
+    elapsed: float = 0.0
+    retry_after: Optional[float] = None  # 熔断拒绝时建议延后的秒数（未发出请求）
+
+
+class ForwardClientPool:
+    """
+    转发 HTTP 客户端池
+    
+    按目标主机（scheme://host:port）维护长连接客户端，应用生命周期内复用，
+    避免每次转发都重新建立 TCP/TLS 连接。
+    """
+    
+    def __init__(self):
+        self._clients: Dict[str, Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+        self._http2: Optional[bool] = None
+        self._closing: Set[asyncio.Future] = set()
+    
+    @staticmethod
+    def _host_key(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}".lower()
+    
+    def _http2_enabled(self) -> bool:
+        if self._http2 is None:
+            self._http2 = settings.FORWARD_HTTP2
+            if self._http2 and importlib.util.find_spec("h2") is None:
+                logger.warning("FORWARD_HTTP2 requires the 'h2' package, falling back to HTTP/1.1")
+                self._http2 = False
+        return self._http2
+    
+    def _create_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=settings.FORWARD_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.FORWARD_MAX_KEEPALIVE,
+            keepalive_expiry=settings.FORWARD_KEEPALIVE_EXPIRY
+        )
+        return httpx.AsyncClient(
+            timeout=settings.FORWARD_TIMEOUT,
+            limits=limits,
+            http2=self._http2_enabled()
+        )
+    
+    def get(self, url: str) -> httpx.AsyncClient:
+        """获取目标主机对应的客户端（不存在则创建）"""
+        key = self._host_key(url)
+        loop = asyncio.get_running_loop()
+        cached = self._clients.get(key)
+        if cached is not None:
+            client_loop, client = cached
+            if client_loop is loop and not client.is_closed:
+                return client
+            self._discard(client_loop, client)
+        client = self._create_client()
+        self._clients[key] = (loop, client)
+        return client
+    
+    def _discard(self, client_loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient):
+        """
+        关闭被替换的客户端（事件循环变化时，如测试或重启应用）
+
+        原循环仍在运行时交给原循环关闭；已关闭则在当前循环尽力关闭。
+        """
+        if client.is_closed:
+            return
+        if client_loop.is_running() and not client_loop.is_closed():
+            future = asyncio.run_coroutine_threadsafe(self._aclose(client), client_loop)
+        else:
+            future = asyncio.ensure_future(self._aclose(client))
+        self._closing.add(future)
+        future.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _aclose(client: httpx.AsyncClient):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.warning("failed to close stale forward client: %s", e)
+
+    async def open(self):
+        """应用启动时调用，重置 HTTP/2 探测结果"""
+        self._http2 = None
+        self._http2_enabled()
+    
+    async def close(self):
+        """应用关闭时释放全部连接"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for _, client in clients:
+            try:
+                await client.aclose()
+            except Exception:
+                logger.exception("failed to close forward client")
+    
+    def hosts(self):
+        return list(self._clients.keys())
+
+
+# 应用级单例
+client_pool = ForwardClientPool()
+
+
+class AsyncTokenBucket:
+    """协程内使用的令牌桶（限制每秒请求数）"""
+    
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """取一个令牌，不足时等待"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TargetGate:
+    """单个转发目标的并发上限与速率限制"""
+
+    def __init__(self, target: ForwardTarget):
+        self.target = target
+        self._semaphore = asyncio.Semaphore(target.max_in_flight) if target.max_in_flight > 0 else None
+        self._bucket = AsyncTokenBucket(target.rate_limit) if target.rate_limit > 0 else None
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore is not None:
+            await self._semaphore.acquire()
+        try:
+            if self._bucket is not None:
+                await self._bucket.acquire()
+            yield
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+
+class TargetGates:
+    """按目标维护的限流器（与客户端池一样绑定创建时的事件循环，进程内共享）"""
+
+    def __init__(self):
+        self._gates: Dict[str, Tuple[asyncio.AbstractEventLoop, TargetGate]] = {}
+
+    def get(self, target: ForwardTarget) -> TargetGate:
+        loop = asyncio.get_running_loop()
+        cached = self._gates.get(target.url)
+        if cached is not None and cached[0] is loop and cached[1].target == target:
+            return cached[1]
+        gate = TargetGate(target)
+        self._gates[target.url] = (loop, gate)
+        return gate
+
+
+# 应用级单例
+target_gates = TargetGates()
+
+
 class EventForwarder:
     """事件转发器"""
     
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        pool: Optional[ForwardClientPool] = None,
+        gates: Optional[TargetGates] = None,
+        breakers: Optional[CircuitBreakerRegistry] = None
+    ):
+        self.session_factory = session_factory
+        self.pool = pool or client_pool
+        self.gates = gates or target_gates
+        self.breakers = breakers or circuit_breakers
+    
     async def forward_event(self, event: Event, target_url: str) -> bool:
         """
         转发事件到目标 URL
@@ -24,48 +219,117 @@ class EventForwarder:
         Returns:
             是否成功
         """
-        db = SessionLocal()
-        log = ForwardLog(event_id=event.id, target_url=target_url)
+        result = await self.deliver(event, target_url)
+        return result.success
+    
+    async def deliver(self, event: Event, target_url: str) -> "ForwardResult":
+        """转发事件并记录 ForwardLog，返回转发结果详情"""
+        result = await self.send(event, target_url)
+        event.forwarded = result.success
+        await asyncio.to_thread(self.record, [(event.id, target_url, result)])
+        return result
+    
+    async def fan_out(self, event: Event, target_urls: List[str]) -> List["ForwardResult"]:
+        """并发转发到多个目标，每个目标记录一条 ForwardLog，返回与 target_urls 对应的结果"""
+        results = await asyncio.gather(*(self.send(event, url) for url in target_urls))
+        event.forwarded = any(result.success for result in results)
+        await asyncio.to_thread(self.record, [(event.id, url, result) for url, result in zip(target_urls, results)])
+        return list(results)
+    
+    async def send(self, event: Event, target_url: str) -> "ForwardResult":
+        """
+        仅发送请求（不写数据库），按目标配置的超时、并发上限与速率执行
+
+        目标主机熔断时不发请求，直接返回失败结果（retry_after 为建议延后秒数）。
+        """
+        target = router.target_for(target_url)
+        breaker = self.breakers.get(target_url)
+        if breaker is not None and not breaker.allow():
+            forwards_total.inc(target.name, "circuit_open")
+            return ForwardResult(success=False, error_message="Circuit open", retry_after=breaker.retry_after())
+        probe = breaker is not None and breaker.state == HALF_OPEN
         
+        result: Optional[ForwardResult] = None
         try:
-            async with httpx.AsyncClient(timeout=settings.FORWARD_TIMEOUT) as client:
-                # 准备 payload
-                headers = {
-                    "Content-Type": "application/json",
-                    "X-Forwarded-From": settings.APP_NAME,
-                    "X-Event-Source": event.source,
-                    "X-Event-Type": event.event_type or "unknown"
-                }
-                
-                # 发送请求
-                response = await client.post(
-                    target_url,
-                    content=event.payload,
-                    headers=headers
-                )
-                
-                log.status_code = response.status_code
-                log.success = response.status_code in (200, 201, 202, 204)
-                
-                if not log.success:
-                    log.error_message = f"HTTP {response.status_code}: {response.text[:500]}"
+            async with self.gates.get(target).slot():
+                result = await self._post(event, target)
+        finally:
+            if breaker is not None:
+                if result is None:
+                    breaker.cancel(probe)  # 请求被取消（如停机），不计入结果
+                else:
+                    breaker.record(is_failure(result.status_code), result.elapsed, probe)
+        return result
+    
+    async def _post(self, event: Event, target: ForwardTarget) -> "ForwardResult":
+        target_url = target.url
+        started = time.perf_counter()
+        result = ForwardResult(success=False)
+        
+        try:
+            client = self.pool.get(target_url)
+            
+            # 准备 payload
+            headers = {
+                "Content-Type": "application/json",
+                "X-Forwarded-From": settings.APP_NAME,
+                "X-Event-Source": event.source,
+                "X-Event-Type": event.event_type or "unknown"
+            }
+            
+            # 发送请求
+            response = await client.post(
+                target_url,
+                content=event.payload,
+                headers=headers,
+                timeout=target.timeout
+            )
+            
+            result.status_code = response.status_code
+            result.success = response.status_code in (200, 201, 202, 204)
+            
+            if not result.success:
+                result.error_message = f"HTTP {response.status_code}: {response.text[:500]}"
         
         except httpx.TimeoutException:
-            log.success = False
-            log.error_message = "Request timeout"
+            result.error_message = "Request timeout"
         except Exception as e:
-            log.success = False
-            log.error_message = str(e)[:500]
-        finally:
-            # 更新事件转发状态
-            event.forwarded = log.success
-            
-            # 保存日志
-            db.add(log)
+            result.error_message = str(e)[:500]
+        
+        result.elapsed = time.perf_counter() - started
+        forward_seconds.observe(result.elapsed, target.name)
+        forwards_total.inc(target.name, "success" if result.success else "failure")
+        return result
+    
+    def record(self, results: List[Tuple[int, str, "ForwardResult"]]):
+        """
+        批量写入转发日志，并标记转发成功的事件
+        
+        Args:
+            results: (事件ID, 目标URL, 转发结果) 列表
+        """
+        if not results:
+            return
+        db = self.session_factory()
+        try:
+            db.add_all([
+                ForwardLog(
+                    event_id=event_id,
+                    target_url=target_url,
+                    status_code=result.status_code,
+                    success=result.success,
+                    error_message=result.error_message
+                )
+                for event_id, target_url, result in results
+            ])
+            forwarded_ids = [event_id for event_id, _, result in results if result.success]
+            if forwarded_ids:
+                db.query(Event).filter(Event.id.in_(forwarded_ids)).update(
+                    {"forwarded": True}, synchronize_session=False
+                )
             db.commit()
+        finally:
             db.close()
-        
-        return log.success
     
     async def replay_event(self, event_id: int, target_url: Optional[str] = None) -> bool:
         """
@@ -73,22 +337,25 @@ class EventForwarder:
         
         Args:
             event_id: 事件ID
-            target_url: 目标 URL（可选，默认使用配置的转发URL）
+            target_url: 目标 URL（可选，默认按路由表转发到全部匹配目标）
             
         Returns:
-            是否成功
+            是否全部成功
         """
-        db = SessionLocal()
+        db = self.session_factory()
         try:
             event = db.query(Event).filter(Event.id == event_id).first()
             if not event:
                 return False
             
-            url = target_url or settings.FORWARD_URL
-            if not url:
-                return False
+            if target_url:
+                return await self.forward_event(event, target_url)
             
-            return await self.forward_event(event, url)
+            urls = [target.url for target in router.match(event.source, event.event_type)]
+            if not urls:
+                return False
+            results = await self.fan_out(event, urls)
+            return all(result.success for result in results)
         finally:
             db.close()
 
@@ -0,0 +1,321 @@
+"""
+事件入库
+
+direct 模式：每个请求在自己的会话里提交。
+batch 模式：请求把事件交给单个写入协程，按时间窗口或条数合并为一个事务提交
+（group commit），提交后再把事件 ID 回传给各个调用方。
+两种模式都按 (source, delivery_id) 去重，重复投递只确认、不入库也不转发。
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.dedup import delivery_cache
+from app.live import live_hub, summarize
+from app.models import Event, SessionLocal
+from app.outbox import ForwardQueue, forward_queue
+from app.routing import router
+from app.settings import settings
+from app import fields, search, stats
+from app.metrics import db_commit_seconds
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IngestResult:
+    """单个事件的入库结果"""
+    event_id: int
+    duplicate: bool = False
+    summary: Optional[Dict] = field(default=None, repr=False, compare=False)  # 实时推送用的摘要
+
+
+def _existing_deliveries(db: Session, events: List[Event]) -> Dict[Tuple[str, str], int]:
+    """查询已入库的投递 ID"""
+    keys = {(event.source, event.delivery_id) for event in events if event.delivery_id}
+    if not keys:
+        return {}
+    rows = db.query(Event.source, Event.delivery_id, Event.id).filter(
+        tuple_(Event.source, Event.delivery_id).in_(list(keys))
+    ).all()
+    return {(source, delivery_id): event_id for source, delivery_id, event_id in rows}
+
+
+def persist_events(db: Session, events: List[Event]) -> List[IngestResult]:
+    """
+    在当前事务内写入事件及其附属记录（不提交）
+    
+    已入库或同批次内重复的投递 ID 不再写入，结果中标记 duplicate。
+
+    Returns:
+        入库结果列表（与输入顺序一致）
+    """
+    existing = _existing_deliveries(db, events)
+    fresh: List[Event] = []
+    first_in_batch: Dict[Tuple[str, str], Event] = {}
+    pending: List[object] = []
+    for event in events:
+        key = (event.source, event.delivery_id) if event.delivery_id else None
+        if key in existing:
+            pending.append(IngestResult(existing[key], duplicate=True))
+        elif key in first_in_batch:
+            pending.append(first_in_batch[key])
+        else:
+            if key is not None:
+                first_in_batch[key] = event
+            fresh.append(event)
+            pending.append(event)
+
+    if fresh:
+        db.add_all(fresh)
+        db.flush()
+        stats.record_events(db, fresh)
+        fields.record_fields(db, fresh)
+        search.index_events(db, fresh)
+        if settings.FORWARD_ENABLED:
+            # 每个匹配的转发目标一条 outbox 记录，由 worker 并行投递
+            for event in fresh:
+                for target in router.match(event.source, event.event_type):
+                    ForwardQueue.enqueue(db, event, target.url)
+
+    fresh_ids = {id(event) for event in fresh}
+    results = []
+    for event, item in zip(events, pending):
+        if isinstance(item, IngestResult):
+            results.append(item)
+        else:
+            # 同批次重复的事件指向第一次出现的那条
+            is_fresh = id(event) in fresh_ids
+            summary = summarize(event) if is_fresh and len(live_hub) else None
+            results.append(IngestResult(item.id, duplicate=not is_fresh, summary=summary))
+    return results
+
+
+def _publish(results: List[object]):
+    """提交成功后把新事件推送给实时订阅者"""
+    live_hub.publish([
+        result.summary for result in results
+        if isinstance(result, IngestResult) and result.summary is not None
+    ])
+
+
+def _delivery_keys(events: List[Event]) -> List[Tuple[str, Optional[str]]]:
+    """提交前取出投递键（提交后实例已过期，会话关闭后无法再读取属性）"""
+    return [(event.source, event.delivery_id) for event in events]
+
+
+def _remember(keys: List[Tuple[str, Optional[str]]], results: List[object]):
+    """提交成功后记住投递 ID"""
+    for (source, delivery_id), result in zip(keys, results):
+        if isinstance(result, IngestResult):
+            delivery_cache.remember(source, delivery_id, result.event_id)
+
+
+class BatchWriter:
+    """合并提交写入器（单写入协程）"""
+
+    def __init__(
+        self,
+        max_events: Optional[int] = None,
+        interval_ms: Optional[int] = None,
+        session_factory=SessionLocal
+    ):
+        self.max_events = max_events or settings.INGEST_BATCH_MAX_EVENTS
+        self.interval = (interval_ms if interval_ms is not None else settings.INGEST_BATCH_INTERVAL_MS) / 1000
+        self.session_factory = session_factory
+        self.batches_committed = 0
+        self.events_committed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def accepting(self) -> bool:
+        """是否接收新事件（停止过程中不再接收）"""
+        return self.running and not self._stopping
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=settings.INGEST_QUEUE_SIZE)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            "batch writer started (max %d events / %d ms)",
+            self.max_events, int(self.interval * 1000)
+        )
+
+    async def stop(self):
+        """停止写入协程（队列中已有的事件会先写完）"""
+        if not self.running:
+            return
+        self._stopping = True
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+        # 停止期间仍在等待入队的提交，写入协程已退出，直接失败
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None and not item[1].done():
+                item[1].set_exception(RuntimeError("batch writer stopped"))
+
+    async def submit(self, event: Event) -> IngestResult:
+        """提交事件，等待所在批次提交后返回入库结果"""
+        if not self.accepting:
+            raise RuntimeError("batch writer is not accepting events")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((event, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.interval
+            while len(batch) < self.max_events:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # 排在停止标记之后的事件同样写完
+        leftover = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                leftover.append(item)
+        for start in range(0, len(leftover), self.max_events):
+            await self._flush(leftover[start:start + self.max_events])
+
+    async def _flush(self, batch: List[Tuple[Event, asyncio.Future]]):
+        """提交一批并回传结果；任何异常都只让本批调用方失败，不终止写入协程"""
+        try:
+            events = [event for event, _ in batch]
+            keys = _delivery_keys(events)
+            try:
+                results = await asyncio.to_thread(self._commit, events)
+            except Exception as e:
+                logger.exception("batch commit failed")
+                results = [e] * len(batch)
+
+            _remember(keys, results)
+            _publish(results)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            forward_queue.notify()
+        except Exception as e:
+            logger.exception("batch flush failed")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _commit(self, events: List[Event]) -> List[object]:
+        """
+        一个事务写入整批事件；失败时逐条重试，
+        以免单条坏数据拖垮同批次其他请求
+        """
+        db = self.session_factory()
+        try:
+            try:
+                with db_commit_seconds.time("batch"):
+                    results = persist_events(db, events)
+                    db.commit()
+                self.batches_committed += 1
+                self.events_committed += sum(1 for result in results if not result.duplicate)
+                return results
+            except Exception:
+                db.rollback()
+
+            results: List[object] = []
+            for event in events:
+                # 回滚后对象回到 transient，但保留了 flush 时分配的主键
+                event.id = None
+                try:
+                    result = persist_events(db, [event])[0]
+                    db.commit()
+                    self.batches_committed += 1
+                    self.events_committed += 0 if result.duplicate else 1
+                    results.append(result)
+                except Exception as e:
+                    db.rollback()
+                    results.append(e)
+            return results
+        finally:
+            db.close()
+
+
+# 应用级单例
+batch_writer = BatchWriter()
+
+
+def _persist_one(db: Session, event: Event) -> IngestResult:
+    """写入并提交单个事件（direct 模式，在 AsyncSession.run_sync 中执行）"""
+    try:
+        result = persist_events(db, [event])[0]
+        db.commit()
+    except IntegrityError:
+        # 并发请求（或其他进程）抢先写入了同一投递 ID
+        db.rollback()
+        event.id = None
+        result = persist_events(db, [event])[0]
+        db.commit()
+    return result
+
+
+async def ingest_event(db: AsyncSession, event: Event) -> IngestResult:
+    """
+    按 INGEST_MODE 写入单个事件
+
+    最近见过的投递 ID 直接判定为重复，不访问数据库。
+    batch 模式下写入协程未运行（如测试、脚本）或正在停止时退回 direct 模式。
+    """
+    cached_id = delivery_cache.get(event.source, event.delivery_id)
+    if cached_id is not None:
+        return IngestResult(cached_id, duplicate=True)
+
+    if settings.INGEST_MODE == "batch" and batch_writer.accepting:
+        return await batch_writer.submit(event)
+
+    keys = _delivery_keys([event])
+    with db_commit_seconds.time("direct"):
+        result = await db.run_sync(_persist_one, event)
+    _remember(keys, [result])
+    _publish([result])
+    if not result.duplicate:
+        forward_queue.notify()
+    return result
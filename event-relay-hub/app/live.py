@@ -0,0 +1,132 @@
+"""
+实时事件推送
+
+入库路径在提交后把新事件摘要（不含 payload）发布到进程内广播中心，
+SSE（/api/events/stream）和 WebSocket（/ws/events）订阅者各自按 source / event_type 过滤。
+每个订阅者的缓冲有上限，慢客户端只会丢弃最旧的消息并收到 dropped 通知，不会无限占用内存。
+"""
+import asyncio
+import json
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set
+
+from app.models import Event
+from app.settings import settings
+
+
+def summarize(event: Event) -> Dict:
+    """推送用的事件摘要（需在提交前调用，提交后实例已过期）"""
+    return {
+        "id": event.id,
+        "source": event.source,
+        "event_type": event.event_type,
+        "signature_valid": bool(event.signature_valid),
+        "forwarded": bool(event.forwarded),
+        "created_at": event.created_at.isoformat() if event.created_at else None,
+    }
+
+
+class Subscription:
+    """单个订阅者：过滤条件 + 有界缓冲"""
+
+    def __init__(
+        self,
+        source: Optional[str] = None,
+        event_type: Optional[str] = None,
+        buffer_size: Optional[int] = None
+    ):
+        self.source = source
+        self.event_type = event_type
+        self.dropped = 0
+        self._buffer: Deque[Dict] = deque(maxlen=buffer_size or settings.LIVE_BUFFER_SIZE)
+        self._ready = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+
+    def matches(self, item: Dict) -> bool:
+        if self.source and item["source"] != self.source:
+            return False
+        if self.event_type and item["event_type"] != self.event_type:
+            return False
+        return True
+
+    def _push(self, items: List[Dict]):
+        for item in items:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append(item)
+        self._ready.set()
+
+    def offer(self, items: List[Dict]):
+        """由发布方调用；不在订阅者所在事件循环时转交给该循环"""
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        if current is self._loop:
+            self._push(items)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._push, items)
+
+    async def next_batch(self, timeout: Optional[float] = None) -> List[Dict]:
+        """等待并取出缓冲中的全部消息（超时返回空列表）"""
+        if not self._buffer:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self._ready.clear()
+        items = list(self._buffer)
+        self._buffer.clear()
+        return items
+
+    def take_dropped(self) -> int:
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class EventBroadcaster:
+    """进程内广播中心"""
+
+    def __init__(self, max_subscribers: Optional[int] = None):
+        self.max_subscribers = max_subscribers or settings.LIVE_MAX_SUBSCRIBERS
+        self._subscribers: Set[Subscription] = set()
+
+    def subscribe(
+        self,
+        source: Optional[str] = None,
+        event_type: Optional[str] = None,
+        buffer_size: Optional[int] = None
+    ) -> Subscription:
+        """新增订阅者，超过上限时抛出 RuntimeError"""
+        if len(self._subscribers) >= self.max_subscribers:
+            raise RuntimeError("Too many live subscribers")
+        subscription = Subscription(source, event_type, buffer_size)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def publish(self, items: List[Dict]):
+        """发布事件摘要（非阻塞，无订阅者时几乎零开销）"""
+        if not items or not self._subscribers:
+            return
+        for subscription in list(self._subscribers):
+            matched = [item for item in items if subscription.matches(item)]
+            if matched:
+                subscription.offer(matched)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+
+def format_sse_event(item: Dict) -> str:
+    return f"event: event\nid: {item['id']}\ndata: {json.dumps(item)}\n\n"
+
+
+def format_sse_dropped(count: int) -> str:
+    return f"event: dropped\ndata: {json.dumps({'count': count})}\n\n"
+
+
+# 应用级单例
+live_hub = EventBroadcaster()
@@ -6,21 +6,36 @@ from typing import List, Optional
 import json
 import uuid
 import random
-from fastapi import FastAPI, Request, Depends, Query, HTTPException, Body
-from fastapi.responses import HTMLResponse
+import asyncio
+from fastapi import FastAPI, Request, Response, Depends, Query, HTTPException, Body, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import desc, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, undefer_group
 
 from app.settings import settings
 from app.models import (
-    init_db, get_db, Event, EventResponse, 
-    EventStats, ReplayResponse, ForwardLog
+    init_db, get_async_db, Event, EventResponse, 
+    EventStats, ReplayResponse, ForwardLog,
+    DeadLetterResponse, RedriveRequest, RedriveResponse, BulkReplayRequest,
+    StatsPoint, SearchHit, CircuitState, SessionLocal
 )
 from app.webhooks import WebhookHandler
-from app.forwarder import EventForwarder
+from app.circuit import circuit_breakers
+from app.forwarder import EventForwarder, client_pool
+from app.outbox import forward_queue
+from app.routing import router
+from app.ingest import ingest_event, batch_writer
+from app.retry import list_dead_letters, redrive_dead_letters
+from app.replay import BulkReplayer, format_ndjson, format_sse
+from app import metrics, stats
+from app.fields import filter_fields, parse_field_params
+from app.search import enabled as search_enabled, search_events
+from app.paging import apply_cursor, decode_cursor, encode_cursor, filter_events, iter_export
+from app.retention import archive_store, retention_job
+from app.live import live_hub, format_sse_dropped, format_sse_event
 from app.rate_limiter import limiter
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
@@ -39,6 +54,9 @@ app = FastAPI(
 app.state.limiter = limiter
 app.add_middleware(SlowAPIMiddleware)
 
+# Webhook 请求计数与耗时
+app.add_middleware(metrics.WebhookMetricsMiddleware)
+
 # CORS 配置
 app.add_middleware(
     CORSMiddleware,
@@ -46,6 +64,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # 静态文件与模板
@@ -54,6 +73,15 @@ try:
 except:
     pass
 
+# 抓取 /metrics 时计算的队列深度与状态
+metrics.ingest_queue_depth.set_function(lambda: {(): batch_writer.depth()})
+metrics.forward_outbox_depth.set_function(lambda: {(status,): count for status, count in forward_queue.depth().items()})
+metrics.forward_in_flight.set_function(lambda: {(): forward_queue.in_flight})
+metrics.live_subscribers.set_function(lambda: {(): len(live_hub)})
+metrics.circuit_state.set_function(
+    lambda: {(item["host"], item["state"]): 1 for item in circuit_breakers.snapshot()}
+)
+
 templates_dir = Path(__file__).resolve().parent / "templates"
 templates = Jinja2Templates(directory=str(templates_dir))
 
@@ -62,11 +90,31 @@ templates = Jinja2Templates(directory=str(templates_dir))
 async def startup_event():
     """启动时初始化"""
     init_db()
+    db = SessionLocal()
+    try:
+        stats.ensure_rollup(db)
+    finally:
+        db.close()
+    await client_pool.open()
+    if settings.INGEST_MODE == "batch":
+        await batch_writer.start()
+    if settings.FORWARD_ENABLED:
+        await forward_queue.start()
+    await retention_job.start()
     print(f"✓ {settings.APP_NAME} v{settings.APP_VERSION} 启动成功")
     print(f"  - 监听地址: http://{settings.HOST}:{settings.PORT}")
     print(f"  - API文档: http://{settings.HOST}:{settings.PORT}/api/docs")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """关闭时停止后台任务"""
+    await batch_writer.stop()
+    await forward_queue.stop()
+    await retention_job.stop()
+    await client_pool.close()
+
+
 @app.exception_handler(RateLimitExceeded)
 async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
     """速率限制异常处理"""
@@ -85,7 +133,7 @@ async def root(request: Request):
 @app.post("/api/simulate/stripe")
 async def simulate_stripe_event(
     payload: dict = Body(..., example={"type": "payment_intent.succeeded"}),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     [New Feature] Simulate a Stripe Event
@@ -125,7 +173,7 @@ async def simulate_stripe_event(
     event = Event(
         source="stripe (simulated)",
         event_type=event_type,
-        payload=json.dumps(mock_data, indent=2),
+        payload=json.dumps(mock_data, separators=(",", ":")),
         headers=json.dumps({
             "User-Agent": "Stripe/1.0 (+https://stripe.com/docs/webhooks)",
             "Stripe-Signature": "t=1234567890,v1=simulated_signature",
@@ -133,18 +181,12 @@ async def simulate_stripe_event(
         }),
         signature_valid=True # Simulated events are always valid
     )
-    db.add(event)
-    db.commit()
-    db.refresh(event)
-    
-    # Trigger forwarding if enabled
+    # Forwarding is queued along with the event if enabled
     # (Optional: In a real debugger, you might NOT want to forward simulations, 
     # but here we do to show the full flow)
-    if settings.FORWARD_ENABLED and settings.FORWARD_URL:
-        forwarder = EventForwarder()
-        await forwarder.forward_event(event, settings.FORWARD_URL)
+    result = await ingest_event(db, event)
 
-    return {"success": True, "event_id": event.id, "type": event_type}
+    return {"success": True, "event_id": result.event_id, "type": event_type}
 
 
 @app.get("/api/health")
@@ -161,7 +203,7 @@ async def health_check():
 
 @app.post("/webhook/github")
 @limiter.limit(f"{settings.RATE_LIMIT_PER_MINUTE}/minute")
-async def github_webhook(request: Request, db: Session = Depends(get_db)):
+async def github_webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
     """接收 GitHub Webhook"""
     handler = WebhookHandler(db)
     return await handler.handle_github(request)
@@ -169,7 +211,7 @@ async def github_webhook(request: Request, db: Session = Depends(get_db)):
 
 @app.post("/webhook/stripe")
 @limiter.limit(f"{settings.RATE_LIMIT_PER_MINUTE}/minute")
-async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
+async def stripe_webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
     """接收 Stripe Webhook"""
     handler = WebhookHandler(db)
     return await handler.handle_stripe(request)
@@ -177,7 +219,7 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
 
 @app.post("/webhook/custom")
 @limiter.limit(f"{settings.RATE_LIMIT_PER_MINUTE}/minute")
-async def custom_webhook(request: Request, db: Session = Depends(get_db)):
+async def custom_webhook(request: Request, db: AsyncSession = Depends(get_async_db)):
     """接收自定义 Webhook"""
     handler = WebhookHandler(db)
     return await handler.handle_custom(request)
@@ -185,29 +227,175 @@ async def custom_webhook(request: Request, db: Session = Depends(get_db)):
 
 @app.get("/api/events", response_model=List[EventResponse])
 async def get_events(
+    request: Request,
+    response: Response,
     source: Optional[str] = Query(None, description="事件源"),
     event_type: Optional[str] = Query(None, description="事件类型"),
     days: int = Query(7, ge=1, le=90, description="查询天数"),
     limit: int = Query(100, ge=1, le=1000, description="返回数量"),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="分页游标（上一页响应头 X-Next-Cursor）"),
+    include_archive: bool = Query(False, description="同时查询已归档的过期事件"),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取事件列表"""
+    """
+    获取事件列表
+    
+    按 created_at、id 倒序返回；还有下一页时在响应头 X-Next-Cursor 中返回游标。
+    include_archive=true 时，数据库中的记录取完后继续读取归档文件（归档事件均早于库内事件）。
+    field.<名称>=<值> 按 FIELD_EXTRACTORS 提取的字段过滤（走 event_fields 索引，不含归档）。
+    """
+    try:
+        field_filters = parse_field_params(request.query_params.multi_items())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     cutoff_date = datetime.utcnow() - timedelta(days=days)
-    query = db.query(Event).filter(Event.created_at >= cutoff_date)
     
-    if source:
-        query = query.filter(Event.source == source)
-    if event_type:
-        query = query.filter(Event.event_type == event_type)
+    def load(session: Session) -> List[EventResponse]:
+        query = filter_events(session.query(Event).options(undefer_group("body")), source, event_type, since=cutoff_date)
+        query = filter_fields(query, field_filters)
+        query = apply_cursor(query, cursor)
+        return [EventResponse.model_validate(event) for event in query.limit(limit + 1).all()]
     
-    events = query.order_by(desc(Event.created_at)).limit(limit).all()
+    try:
+        events = await db.run_sync(load)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    if include_archive and not field_filters and len(events) <= limit:
+        last = events[-1] if events else None
+        before = (last.created_at, last.id) if last else (decode_cursor(cursor) if cursor else None)
+        events += archive_store.query_events(
+            source, event_type, since=cutoff_date, before=before, limit=limit + 1 - len(events)
+        )
+    if len(events) > limit:
+        events = events[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(events[-1].created_at, events[-1].id)
     return events
 
 
+@app.get("/api/events/export")
+async def export_events(
+    source: Optional[str] = Query(None, description="事件源"),
+    event_type: Optional[str] = Query(None, description="事件类型"),
+    since: Optional[datetime] = Query(None, description="起始时间（含）"),
+    until: Optional[datetime] = Query(None, description="结束时间（不含）"),
+    compress: Optional[str] = Query(None, pattern="^gzip$", description="压缩格式：gzip")
+):
+    """流式导出事件（NDJSON，可选 gzip），内存占用与导出行数无关"""
+    gzip = compress == "gzip"
+    filename = f"events-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.ndjson" + (".gz" if gzip else "")
+    return StreamingResponse(
+        iter_export(source, event_type, since, until, compress=gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+@app.get("/api/events/search", response_model=List[SearchHit])
+async def search_payloads(
+    q: str = Query(..., min_length=1, description="检索词（空格分隔取交集，\"短语\"，结尾 * 为前缀匹配）"),
+    source: Optional[str] = Query(None, description="事件源"),
+    since: Optional[datetime] = Query(None, description="起始时间（含）"),
+    until: Optional[datetime] = Query(None, description="结束时间（不含）"),
+    limit: int = Query(20, ge=1, le=100, description="返回数量"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """全文检索 payload（SQLite FTS5），按相关度排序并返回命中片段"""
+    if not await db.run_sync(search_enabled):
+        raise HTTPException(status_code=503, detail="Full-text search is disabled")
+    try:
+        return await db.run_sync(search_events, q, source=source, since=since, until=until, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/events/stream")
+async def stream_events(
+    source: Optional[str] = Query(None, description="事件源"),
+    event_type: Optional[str] = Query(None, description="事件类型")
+):
+    """
+    实时推送新入库的事件（SSE，不含 payload）
+
+    慢客户端的缓冲满后丢弃最旧的消息，并收到 dropped 事件（count 为丢弃条数）。
+    """
+    try:
+        subscription = live_hub.subscribe(source, event_type)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    async def stream():
+        try:
+            yield ": connected\n\n"
+            while True:
+                items = await subscription.next_batch(timeout=settings.LIVE_HEARTBEAT_SECONDS)
+                dropped = subscription.take_dropped()
+                if dropped:
+                    yield format_sse_dropped(dropped)
+                if not items:
+                    yield ": ping\n\n"
+                for item in items:
+                    yield format_sse_event(item)
+        finally:
+            live_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.websocket("/ws/events")
+async def websocket_events(
+    websocket: WebSocket,
+    source: Optional[str] = None,
+    event_type: Optional[str] = None
+):
+    """实时推送新入库的事件（WebSocket，消息格式同 SSE）"""
+    try:
+        subscription = live_hub.subscribe(source, event_type)
+    except RuntimeError:
+        await websocket.close(code=1013)
+        return
+    await websocket.accept()
+
+    async def wait_disconnect():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    disconnected = asyncio.ensure_future(wait_disconnect())
+    try:
+        while not disconnected.done():
+            batch = asyncio.ensure_future(subscription.next_batch(timeout=settings.LIVE_HEARTBEAT_SECONDS))
+            await asyncio.wait({batch, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not batch.done():
+                batch.cancel()
+                break
+            dropped = subscription.take_dropped()
+            if dropped:
+                await websocket.send_json({"type": "dropped", "count": dropped})
+            for item in batch.result():
+                await websocket.send_json({"type": "event", "event": item})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        disconnected.cancel()
+        live_hub.unsubscribe(subscription)
+
+
+def _load_event(session: Session, event_id: int) -> Optional[Event]:
+    """按 ID 读取事件（含 payload / headers，在 AsyncSession.run_sync 中执行）"""
+    return session.query(Event).options(undefer_group("body")).filter(Event.id == event_id).first()
+
+
 @app.get("/api/events/{event_id}", response_model=EventResponse)
-async def get_event(event_id: int, db: Session = Depends(get_db)):
+async def get_event(event_id: int, db: AsyncSession = Depends(get_async_db)):
     """获取单个事件详情"""
-    event = db.query(Event).filter(Event.id == event_id).first()
+    event = await db.run_sync(_load_event, event_id)
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
     return event
@@ -217,20 +405,23 @@ async def get_event(event_id: int, db: Session = Depends(get_db)):
 async def replay_event(
     event_id: int,
     target_url: Optional[str] = Query(None, description="目标URL"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """重放事件"""
-    event = db.query(Event).filter(Event.id == event_id).first()
+    event = await db.run_sync(_load_event, event_id)
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
     
     forwarder = EventForwarder()
-    url = target_url or settings.FORWARD_URL
-    
-    if not url:
-        raise HTTPException(status_code=400, detail="No target URL provided")
-    
-    success = await forwarder.replay_event(event_id, url)
+    if target_url:
+        success = await forwarder.forward_event(event, target_url)
+    else:
+        # 未指定目标时按路由表并发转发到全部匹配目标
+        urls = [target.url for target in router.match(event.source, event.event_type)]
+        if not urls:
+            raise HTTPException(status_code=400, detail="No target URL provided")
+        results = await forwarder.fan_out(event, urls)
+        success = all(result.success for result in results)
     
     return ReplayResponse(
         success=success,
@@ -239,38 +430,96 @@ async def replay_event(
     )
 
 
-@app.get("/api/stats", response_model=EventStats)
-async def get_stats(db: Session = Depends(get_db)):
-    """获取事件统计"""
-    total = db.query(func.count(Event.id)).scalar()
-    
-    # 按来源统计
-    by_source = {}
-    for source, count in db.query(Event.source, func.count(Event.id)).group_by(Event.source).all():
-        by_source[source] = count
+@app.post("/api/events/replay")
+async def bulk_replay(
+    request: Request,
+    replay: BulkReplayRequest,
+    format: Optional[str] = Query(None, description="进度格式：ndjson 或 sse")
+):
+    """
+    批量重放事件
     
-    # 按事件类型统计
-    by_event_type = {}
-    for event_type, count in db.query(Event.event_type, func.count(Event.id)).group_by(Event.event_type).limit(10).all():
-        if event_type:
-            by_event_type[event_type] = count
+    按 source / event_type / 时间范围 / ID 范围筛选，分块读取并以指定并发度与速率重新转发，
+    进度以 NDJSON（默认）或 SSE 流式返回。
+    """
+    if not (replay.target_url or router.targets):
+        raise HTTPException(status_code=400, detail="No target URL provided")
     
-    # 最近24小时
-    cutoff = datetime.utcnow() - timedelta(hours=24)
-    recent_24h = db.query(func.count(Event.id)).filter(Event.created_at >= cutoff).scalar()
+    use_sse = format == "sse" or (
+        format is None and "text/event-stream" in request.headers.get("accept", "")
+    )
+    formatter = format_sse if use_sse else format_ndjson
     
-    # 签名成功率
-    total_with_sig = db.query(func.count(Event.id)).scalar()
-    valid_sig = db.query(func.count(Event.id)).filter(Event.signature_valid == True).scalar()
-    sig_success_rate = (valid_sig / total_with_sig * 100) if total_with_sig > 0 else 0.0
+    async def stream():
+        async for item in BulkReplayer().run(replay):
+            yield formatter(item)
     
-    return EventStats(
-        total_events=total,
-        by_source=by_source,
-        by_event_type=by_event_type,
-        recent_24h=recent_24h,
-        signature_success_rate=sig_success_rate
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream" if use_sse else "application/x-ndjson"
+    )
+
+
+@app.get("/api/dead-letters", response_model=List[DeadLetterResponse])
+async def get_dead_letters(
+    target_url: Optional[str] = Query(None, description="目标URL"),
+    event_id: Optional[int] = Query(None, description="事件ID"),
+    limit: int = Query(100, ge=1, le=1000, description="返回数量"),
+    offset: int = Query(0, ge=0, description="偏移量"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """查看死信（重试耗尽的转发）"""
+    return await db.run_sync(
+        list_dead_letters, target_url=target_url, event_id=event_id, limit=limit, offset=offset
+    )
+
+
+@app.post("/api/dead-letters/redrive", response_model=RedriveResponse)
+async def redrive(request: RedriveRequest, db: AsyncSession = Depends(get_async_db)):
+    """批量重投死信"""
+    requeued = await db.run_sync(
+        redrive_dead_letters,
+        ids=request.ids,
+        target_url=request.target_url,
+        override_url=request.override_url,
+        limit=request.limit
     )
+    forward_queue.notify()
+    return RedriveResponse(requeued=requeued)
+
+
+@app.get("/api/forward/circuits", response_model=List[CircuitState])
+async def get_circuits():
+    """各转发目标主机的熔断状态"""
+    return circuit_breakers.snapshot()
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+@limiter.exempt
+async def prometheus_metrics():
+    """Prometheus 文本格式指标（渲染时会查询 outbox 深度，放到线程中执行）"""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    body = await asyncio.to_thread(metrics.registry.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/stats", response_model=EventStats)
+async def get_stats(db: AsyncSession = Depends(get_async_db)):
+    """获取事件统计（读取入库时维护的汇总表）"""
+    return await db.run_sync(stats.compute_stats)
+
+
+@app.get("/api/stats/timeseries", response_model=List[StatsPoint])
+async def get_stats_timeseries(
+    granularity: str = Query("hour", pattern="^(minute|hour)$", description="桶粒度"),
+    hours: int = Query(24, ge=1, le=24 * 90, description="时间窗口（小时）"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """按分钟/小时返回事件数时间序列"""
+    if granularity == "minute":
+        hours = min(hours, settings.STATS_MINUTE_RETENTION_HOURS)
+    return await db.run_sync(stats.timeseries, granularity, datetime.utcnow() - timedelta(hours=hours))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,285 @@
+"""
+Prometheus 指标
+
+进程内的计数器 / 直方图 / 仪表盘，/metrics 以 Prometheus 文本格式（0.0.4）输出。
+热路径上的记录只做一次 bisect 和加锁累加，不分配对象；队列深度等仪表盘在抓取时计算。
+
+    relay_webhook_requests_total{source,status}     Webhook 请求数
+    relay_webhook_request_seconds{source}           Webhook 请求总耗时
+    relay_stage_seconds{stage,source}               各阶段耗时：body_read / verify / parse
+    relay_db_commit_seconds{mode}                   入库事务耗时（direct / batch）
+    relay_forward_seconds{target}                   转发请求耗时
+    relay_forwards_total{target,outcome}            转发结果：success / failure / circuit_open
+    relay_ingest_queue_depth                        批量写入队列中等待提交的事件数
+    relay_forward_outbox_depth{status}              outbox 记录数（pending / processing）
+    relay_forward_in_flight                         本进程正在转发的记录数
+    relay_live_subscribers                          实时推送订阅者数
+    relay_circuit_state{host,state}                 各主机当前熔断状态（取值恒为 1）
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in items]
+
+
+class Gauge(_Metric):
+    """
+    仪表盘
+
+    可以直接 set，也可以用 set_function 注册抓取时调用的回调（返回 {标签值元组: 数值}）。
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], Dict[LabelValues, float]]] = None
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def set_function(self, function: Callable[[], Dict[LabelValues, float]]):
+        self._function = function
+
+    def render(self) -> List[str]:
+        if self._function is not None:
+            items = list(self._function().items())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in items]
+
+
+class _Timer:
+    """Histogram.time() 返回的计时器（with 块内可以 await）"""
+    __slots__ = ("_histogram", "_labels", "_started")
+
+    def __init__(self, histogram: "Histogram", labels: LabelValues):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started, *self._labels)
+        return False
+
+
+class Histogram(_Metric):
+    """累积分桶直方图（内部按桶计数，输出时累加）"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List[float]] = {}  # [各桶计数..., +Inf 桶, sum]
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labels: str) -> _Timer:
+        return _Timer(self, labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        lines = []
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.header()
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class WebhookMetricsMiddleware:
+    """
+    ASGI 中间件：记录 /webhook/* 的请求数（按状态码）与总耗时
+
+    纯 ASGI 实现，不经过 BaseHTTPMiddleware 的额外任务与队列。
+    """
+
+    KNOWN_SOURCES = {"github", "stripe", "custom"}
+
+    def __init__(self, app, prefix: str = "/webhook/"):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        source = scope["path"][len(self.prefix):].split("/", 1)[0]
+        if source not in self.KNOWN_SOURCES:
+            source = "other"
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            webhook_request_seconds.observe(time.perf_counter() - started, source)
+            webhook_requests_total.inc(source, str(status))
+
+
+# 应用级单例
+registry = MetricsRegistry()
+
+webhook_requests_total = registry.counter(
+    "relay_webhook_requests_total", "Webhook requests by source and HTTP status", ("source", "status")
+)
+webhook_request_seconds = registry.histogram(
+    "relay_webhook_request_seconds", "Webhook request duration in seconds", ("source",)
+)
+stage_seconds = registry.histogram(
+    "relay_stage_seconds", "Webhook processing stage duration in seconds", ("stage", "source")
+)
+db_commit_seconds = registry.histogram(
+    "relay_db_commit_seconds", "Event insert transaction duration in seconds", ("mode",)
+)
+forward_seconds = registry.histogram(
+    "relay_forward_seconds", "Forward request duration in seconds", ("target",)
+)
+forwards_total = registry.counter(
+    "relay_forwards_total", "Forward attempts by target and outcome", ("target", "outcome")
+)
+
+# 以下仪表盘的取值回调在 app.main 中注册，抓取时计算
+ingest_queue_depth = registry.gauge(
+    "relay_ingest_queue_depth", "Events waiting in the batch writer queue"
+)
+forward_outbox_depth = registry.gauge(
+    "relay_forward_outbox_depth", "Forward outbox entries by status", ("status",)
+)
+forward_in_flight = registry.gauge(
+    "relay_forward_in_flight", "Outbox entries claimed by this process"
+)
+live_subscribers = registry.gauge(
+    "relay_live_subscribers", "Connected live stream subscribers"
+)
+circuit_state = registry.gauge(
+    "relay_circuit_state", "Current circuit breaker state per host", ("host", "state")
+)
@@ -2,12 +2,18 @@
 数据模型
 """
 from datetime import datetime
-from typing import Optional, Dict, Any
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Index, create_engine
+from typing import Optional, Dict, Any, List
+from sqlalchemy import (
+    Column, Integer, String, Text, DateTime, Boolean, Index, UniqueConstraint, LargeBinary,
+    DDL, create_engine, event, inspect, text
+)
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import deferred, object_session, sessionmaker
 from pydantic import BaseModel, Field
 
+from app import codecs
 from app.settings import settings
 
 
@@ -21,18 +27,120 @@ class Event(Base):
     id = Column(Integer, primary_key=True, index=True)
     source = Column(String(50), index=True, nullable=False)  # github, stripe, custom
     event_type = Column(String(100), index=True)
-    payload = Column(Text, nullable=False)  # JSON string
-    headers = Column(Text)  # JSON string of headers
+    payload_text = Column("payload", Text, nullable=False, default="")  # 未压缩的 JSON（压缩存储时为空）
+    headers_text = Column("headers", Text)  # 未压缩的 headers JSON
+    # 压缩后的 payload / headers：延迟加载，列表查询不读取正文，需要时 undefer_group("body")
+    payload_blob = deferred(Column(LargeBinary), group="body")
+    headers_blob = deferred(Column(LargeBinary), group="body")
+    codec = Column(String(32))  # 压缩格式：None / zlib / zstd / zstd:<dict_id>
+    delivery_id = Column(String(255))  # 服务商投递 ID（用于去重）
     signature_valid = Column(Boolean, default=False)
     forwarded = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     __table_args__ = (
         Index('idx_source_created', 'source', 'created_at'),
+        Index('uq_source_delivery', 'source', 'delivery_id', unique=True),
     )
     
     def __repr__(self):
         return f"<Event {self.id}: {self.source}/{self.event_type}>"
+    
+    @property
+    def payload(self) -> str:
+        """payload 原文（压缩存储时在首次读取时解压并缓存）"""
+        cached = getattr(self, "_payload_cache", None)
+        if cached is None:
+            cached = codecs.decode_text(self.codec, self.payload_blob, self.payload_text, self._bind()) or ""
+            self._payload_cache = cached
+        return cached
+    
+    @payload.setter
+    def payload(self, value: str):
+        self.payload_text = value
+        self.payload_blob = None
+        self._payload_cache = value
+        self._reset_codec()
+    
+    @property
+    def headers(self) -> Optional[str]:
+        """headers 原文（压缩存储时在首次读取时解压并缓存）"""
+        cached = getattr(self, "_headers_cache", None)
+        if cached is None:
+            cached = codecs.decode_text(self.codec, self.headers_blob, self.headers_text, self._bind())
+            self._headers_cache = cached
+        return cached
+    
+    @headers.setter
+    def headers(self, value: Optional[str]):
+        self.headers_text = value
+        self.headers_blob = None
+        self._headers_cache = value
+        self._reset_codec()
+    
+    def _reset_codec(self):
+        """重新赋值后两个字段都以明文保存，写入时再统一压缩"""
+        if self.codec is not None:
+            if self.payload_blob is not None:
+                self.payload_text = self.payload
+                self.payload_blob = None
+            if self.headers_blob is not None:
+                self.headers_text = self.headers
+                self.headers_blob = None
+            self.codec = None
+
+    def _bind(self):
+        """读取压缩字典用的连接源（脱离会话时使用默认引擎）"""
+        session = object_session(self)
+        return session.get_bind() if session is not None else engine
+
+    def compress(self, connection=None) -> bool:
+        """把明文 payload / headers 压缩为 BLOB，返回是否压缩"""
+        if self.codec is not None:
+            return False
+        payload = (self.payload_text or "").encode("utf-8")
+        headers = self.headers_text.encode("utf-8") if self.headers_text else None
+        if len(payload) + len(headers or b"") < settings.STORAGE_COMPRESSION_MIN_BYTES:
+            return False
+        codec = codecs.choose_codec(self.source, connection if connection is not None else self._bind())
+        if codec is None:
+            return False
+
+        self.payload_blob = codecs.compress(codec, payload)
+        self.payload_text = ""
+        if headers is not None:
+            self.headers_blob = codecs.compress(codec, headers)
+            self.headers_text = None
+        self.codec = codec
+        return True
+
+
+@event.listens_for(Event, "before_insert")
+@event.listens_for(Event, "before_update")
+def _compress_before_write(mapper, connection, target: Event):
+    """写入时按 STORAGE_COMPRESSION 压缩"""
+    target.compress(connection)
+
+
+class EventField(Base):
+    """从 payload 提取的索引字段（按 FIELD_EXTRACTORS 配置在入库时写入）"""
+    __tablename__ = "event_fields"
+    
+    id = Column(Integer, primary_key=True)
+    event_id = Column(Integer, index=True, nullable=False)
+    field = Column(String(64), nullable=False)
+    value = Column(String(255), nullable=False)
+    
+    __table_args__ = (
+        Index('idx_field_value_event', 'field', 'value', 'event_id'),
+    )
+
+
+# payload 全文索引（SQLite FTS5）：contentless 表只保存倒排索引，不重复存放 payload 原文，
+# rowid 即 events.id；写入与删除由 app.search 在入库路径和保留期清理中同步
+EVENTS_FTS_DDL = "CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(payload, source, content='')"
+
+event.listen(Event.__table__, "after_create", DDL(EVENTS_FTS_DDL).execute_if(dialect="sqlite"))
 
 
 class ForwardLog(Base):
@@ -48,6 +156,70 @@ class ForwardLog(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class ForwardOutbox(Base):
+    """待转发队列表（outbox，与事件同事务写入，重启后继续投递）"""
+    __tablename__ = "forward_outbox"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(Integer, index=True, nullable=False)
+    target_url = Column(String(500), nullable=False)
+    status = Column(String(20), default="pending", nullable=False)  # pending, processing
+    attempts = Column(Integer, default=0, nullable=False)
+    available_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    locked_at = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_outbox_status_available', 'status', 'available_at'),
+    )
+
+
+class DeadLetter(Base):
+    """死信表（重试耗尽的转发）"""
+    __tablename__ = "dead_letters"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(Integer, index=True, nullable=False)
+    target_url = Column(String(500), nullable=False)
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    first_queued_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class EventStatsBucket(Base):
+    """事件统计汇总表（按分钟/小时桶累加，入库时增量维护）"""
+    __tablename__ = "event_stats"
+    
+    id = Column(Integer, primary_key=True)
+    granularity = Column(String(10), nullable=False)  # minute, hour
+    bucket = Column(DateTime, nullable=False)
+    source = Column(String(50), nullable=False)
+    event_type = Column(String(100), nullable=False, default="")
+    signature_valid = Column(Boolean, nullable=False, default=False)
+    count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        UniqueConstraint(
+            'granularity', 'bucket', 'source', 'event_type', 'signature_valid',
+            name='uq_event_stats_bucket'
+        ),
+    )
+
+
+class CompressionDict(Base):
+    """按事件源训练的 zstd 压缩字典"""
+    __tablename__ = "compression_dicts"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String(50), index=True, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    sample_count = Column(Integer, default=0)
+    active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 # Pydantic 模型
 class EventCreate(BaseModel):
     """创建事件请求"""
@@ -66,11 +238,21 @@ class EventResponse(BaseModel):
     signature_valid: bool
     forwarded: bool
     created_at: datetime
-    
+
     class Config:
         from_attributes = True
 
 
+class SearchHit(BaseModel):
+    """全文检索结果（score 越大越相关，snippet 中命中词以 <mark> 标出）"""
+    id: int
+    source: str
+    event_type: Optional[str]
+    created_at: datetime
+    score: float
+    snippet: str
+
+
 class EventStats(BaseModel):
     """事件统计"""
     total_events: int
@@ -80,6 +262,63 @@ class EventStats(BaseModel):
     signature_success_rate: float
 
 
+class StatsPoint(BaseModel):
+    """统计时间序列点"""
+    bucket: datetime
+    count: int
+
+
+class CircuitState(BaseModel):
+    """转发目标主机的熔断状态"""
+    host: str
+    state: str  # closed / open / half_open
+    requests: int  # 统计窗口内的请求数
+    failure_rate: float
+    avg_latency: float
+    retry_at: Optional[datetime] = None
+
+
+class DeadLetterResponse(BaseModel):
+    """死信记录"""
+    id: int
+    event_id: int
+    target_url: str
+    attempts: int
+    last_error: Optional[str]
+    first_queued_at: Optional[datetime]
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+
+class RedriveRequest(BaseModel):
+    """死信重投请求（ids 为空时按 target_url 过滤或全部重投）"""
+    ids: Optional[List[int]] = None
+    target_url: Optional[str] = None
+    override_url: Optional[str] = None
+    limit: int = Field(1000, ge=1, le=100000)
+
+
+class RedriveResponse(BaseModel):
+    """死信重投响应"""
+    requeued: int
+
+
+class BulkReplayRequest(BaseModel):
+    """批量重放请求（过滤条件可组合）"""
+    source: Optional[str] = None
+    event_type: Optional[str] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    id_from: Optional[int] = None
+    id_to: Optional[int] = None
+    target_url: Optional[str] = None
+    concurrency: int = Field(settings.REPLAY_CONCURRENCY, ge=1)
+    rate_limit: Optional[float] = Field(None, gt=0, description="每秒最多转发条数")
+    chunk_size: int = Field(settings.REPLAY_CHUNK_SIZE, ge=1, le=10000)
+
+
 class ReplayResponse(BaseModel):
     """重放响应"""
     success: bool
@@ -87,24 +326,100 @@ class ReplayResponse(BaseModel):
     event_id: int
 
 
-# 数据库引擎
+# 异步驱动（按数据库方言）
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+
+def async_database_url(url: str) -> str:
+    """把同步连接串换成对应的异步驱动（sqlite:// -> sqlite+aiosqlite://）"""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for {parsed.get_backend_name()}")
+    return parsed.set(drivername=f"{parsed.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """SQLite 连接参数：batch 入库模式使用 WAL + synchronous=NORMAL"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+    if settings.INGEST_MODE == "batch":
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+# 数据库引擎（同步：脚本、后台线程）
 engine = create_engine(
     settings.DATABASE_URL,
     connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 数据库引擎（异步：请求处理）
+# 提交后不过期实例，响应序列化时不会在事件循环上触发延迟加载
+async_engine = create_async_engine(async_database_url(settings.DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
 
 def init_db():
     """初始化数据库"""
-    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            # 新建的库使用 incremental auto_vacuum，保留期清理后可分步归还空间
+            # （已有数据的库需执行一次 python -m app.retention vacuum）
+            conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        Base.metadata.create_all(bind=conn)
+        if engine.dialect.name == "sqlite":
+            # 已有的库不会触发 after_create，单独补建全文索引表
+            conn.exec_driver_sql(EVENTS_FTS_DDL)
+    _migrate_columns()
+
+
+def _migrate_columns():
+    """
+    轻量迁移：为已存在的表补充新增的列和索引
+    
+    新增列一律以可空方式添加，默认值由 ORM 在写入时填充。
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
 
 
 def get_db():
-    """获取数据库会话"""
+    """获取数据库会话（同步）"""
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+
+async def get_async_db():
+    """
+    获取数据库会话（异步，请求处理使用）
+
+    复用同步查询代码时通过 AsyncSession.run_sync 执行，I/O 由异步驱动完成，不阻塞事件循环。
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
@@ -0,0 +1,358 @@
+"""
+持久化转发队列（outbox）
+
+Webhook 入库时在同一事务内写入 forward_outbox，
+后台 worker 异步领取并转发，接收请求无需等待下游响应。
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, undefer_group
+
+from app.models import Event, ForwardOutbox, SessionLocal
+from app.forwarder import EventForwarder, ForwardResult
+from app.retry import RetryPolicy, defer_entry, schedule_retry
+from app.routing import router
+from app.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class ForwardQueue:
+    """转发队列：一个领取协程 + 多个转发 worker"""
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        forwarder: Optional[EventForwarder] = None,
+        session_factory=SessionLocal,
+        retry_policy: Optional[RetryPolicy] = None
+    ):
+        self.workers = workers or settings.FORWARD_WORKERS
+        self.session_factory = session_factory
+        self.forwarder = forwarder or EventForwarder(session_factory)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_concurrency = max(1, min(settings.FORWARD_RETRY_CONCURRENCY, self.workers))
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pending: Optional[asyncio.Queue] = None
+        self._claimed: Set[int] = set()
+        self._retrying: Set[int] = set()
+        self._claimed_urls: Dict[int, str] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    @staticmethod
+    def enqueue(db: Session, event: Event, target_url: str) -> ForwardOutbox:
+        """
+        在调用方事务内写入一条待转发记录（不提交）
+
+        事件需已 flush（拥有 id），由调用方统一 commit。
+        """
+        entry = ForwardOutbox(event_id=event.id, target_url=target_url)
+        db.add(entry)
+        return entry
+
+    @property
+    def in_flight(self) -> int:
+        """本进程已领取、尚未完成的记录数"""
+        return len(self._claimed)
+
+    def depth(self) -> Dict[str, int]:
+        """按状态统计 outbox 中的记录数（pending / processing）"""
+        db = self.session_factory()
+        try:
+            rows = db.query(ForwardOutbox.status, func.count(ForwardOutbox.id)).group_by(ForwardOutbox.status).all()
+        finally:
+            db.close()
+        counts = {"pending": 0, "processing": 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def notify(self):
+        """唤醒领取协程（有新事件入队时调用）"""
+        if self._running and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        """启动后台 worker"""
+        if self._running:
+            return
+        self._running = True
+        self._wakeup = asyncio.Event()
+        self._pending = asyncio.Queue(maxsize=self.workers * 2)
+        await asyncio.to_thread(self._release_stale)
+        self._tasks = [asyncio.create_task(self._fetch_loop())]
+        self._tasks += [asyncio.create_task(self._worker_loop()) for _ in range(self.workers)]
+        logger.info("forward queue started with %d workers", self.workers)
+
+    async def stop(self):
+        """停止 worker，并把已领取但未完成的记录放回队列"""
+        if not self._running:
+            return
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self._claimed:
+            await asyncio.to_thread(self._release, list(self._claimed))
+            self._claimed.clear()
+            self._retrying.clear()
+            self._claimed_urls.clear()
+
+    async def _fetch_loop(self):
+        """
+        从 outbox 领取到期记录并分发给 worker
+
+        只领取空闲 worker 数量的记录，领取后立即开始投递，
+        不会在内存里排队到超过锁超时而被回收、重复投递。
+        重试记录在领取时限量（FORWARD_RETRY_CONCURRENCY），
+        目标故障时其余 worker 仍留给首次投递；配置了 max_in_flight 的目标
+        同样在领取时限量，慢目标不会占满 worker 拖慢其他目标。
+        """
+        last_stale_check = datetime.utcnow()
+        while self._running:
+            limit = min(self.workers - len(self._claimed), settings.FORWARD_QUEUE_BATCH_SIZE)
+            retry_limit = self.retry_concurrency - len(self._retrying)
+            claimed: List[Tuple[int, bool, str]] = []
+            if limit > 0:
+                try:
+                    claimed = await asyncio.to_thread(self._claim, limit, retry_limit, self._target_capacity())
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception("failed to claim outbox entries")
+
+            for entry_id, is_retry, target_url in claimed:
+                self._claimed.add(entry_id)
+                self._claimed_urls[entry_id] = target_url
+                if is_retry:
+                    self._retrying.add(entry_id)
+                await self._pending.put(entry_id)
+
+            now = datetime.utcnow()
+            if (now - last_stale_check).total_seconds() >= settings.FORWARD_QUEUE_LOCK_TIMEOUT:
+                last_stale_check = now
+                await asyncio.to_thread(self._release_stale, list(self._claimed))
+
+            if limit <= 0 or len(claimed) < limit:
+                # 没有空闲 worker 或暂无到期记录：等新事件或 worker 完成
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(),
+                        timeout=settings.FORWARD_QUEUE_POLL_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def _worker_loop(self):
+        """转发 worker"""
+        while True:
+            entry_id = await self._pending.get()
+            try:
+                await self._process(entry_id)
+            except asyncio.CancelledError:
+                # 保留在 _claimed 中，stop() 时放回队列
+                raise
+            except Exception:
+                logger.exception("failed to process outbox entry %s", entry_id)
+            self._claimed.discard(entry_id)
+            self._retrying.discard(entry_id)
+            self._claimed_urls.pop(entry_id, None)
+            self._pending.task_done()
+            self._wakeup.set()
+
+    async def _process(self, entry_id: int):
+        """转发单条 outbox 记录"""
+        entry, event = await asyncio.to_thread(self._load, entry_id)
+        if entry is None:
+            return
+        if event is None:
+            await asyncio.to_thread(self._delete, entry_id)
+            return
+
+        result = await self.forwarder.send(event, entry.target_url)
+        await asyncio.to_thread(self._finish, entry, result)
+
+    def _finish(self, entry: ForwardOutbox, result: ForwardResult):
+        """记录转发日志并更新队列状态"""
+        if result.retry_after is not None:
+            # 目标熔断：未发出请求，不写转发日志、不消耗重试次数，熔断到期后再投递
+            self._defer(entry.id, result.retry_after, result.error_message)
+            return
+        self.forwarder.record([(entry.event_id, entry.target_url, result)])
+        self._complete(entry.id, result.success, result.error_message)
+
+    def _target_capacity(self) -> Dict[str, int]:
+        """配置了 max_in_flight 的目标还能领取的记录数"""
+        capacity = {}
+        for target in router.targets:
+            if target.max_in_flight > 0:
+                in_flight = sum(1 for url in self._claimed_urls.values() if url == target.url)
+                capacity[target.url] = target.max_in_flight - in_flight
+        return capacity
+
+    def _claim(
+        self,
+        limit: int,
+        retry_limit: int = 0,
+        capacity: Optional[Dict[str, int]] = None
+    ) -> List[Tuple[int, bool, str]]:
+        """
+        领取到期的 pending 记录（条件更新，多进程下不会重复领取）
+
+        重试记录（attempts > 0）最多领取 retry_limit 条，其余名额给首次投递；
+        capacity 中的目标最多领取对应条数，已满的目标在查询中直接排除。
+
+        Returns:
+            [(记录ID, 是否重试, 目标URL)]
+        """
+        capacity = dict(capacity or {})
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            claimed: List[Tuple[int, bool, str]] = []
+            while True:
+                # 本轮领取使某个目标满额时，排除该目标再查一轮，名额留给其他目标
+                due = db.query(ForwardOutbox.id, ForwardOutbox.target_url).filter(
+                    ForwardOutbox.status == "pending",
+                    ForwardOutbox.available_at <= now
+                )
+                full = [url for url, remaining in capacity.items() if remaining <= 0]
+                if full:
+                    due = due.filter(ForwardOutbox.target_url.notin_(full))
+                remaining = limit - len(claimed)
+                retry_remaining = min(retry_limit - sum(1 for _, is_retry, _ in claimed if is_retry), remaining)
+                candidates: List[Tuple[int, bool, str]] = []
+                if retry_remaining > 0:
+                    candidates += [
+                        (row.id, True, row.target_url) for row in due.filter(ForwardOutbox.attempts > 0)
+                        .order_by(ForwardOutbox.id)
+                        .limit(retry_remaining)
+                        .all()
+                    ]
+                candidates += [
+                    (row.id, False, row.target_url) for row in due.filter(ForwardOutbox.attempts == 0)
+                    .order_by(ForwardOutbox.id)
+                    .limit(remaining - len(candidates))
+                    .all()
+                ]
+                skipped = False
+                for entry_id, is_retry, target_url in candidates:
+                    if target_url in capacity:
+                        if capacity[target_url] <= 0:
+                            skipped = True
+                            continue
+                        capacity[target_url] -= 1
+                    updated = db.query(ForwardOutbox).filter(
+                        ForwardOutbox.id == entry_id,
+                        ForwardOutbox.status == "pending"
+                    ).update({"status": "processing", "locked_at": now}, synchronize_session=False)
+                    if updated:
+                        claimed.append((entry_id, is_retry, target_url))
+                if not skipped or len(claimed) >= limit:
+                    break
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+    def _load(self, entry_id: int) -> Tuple[Optional[ForwardOutbox], Optional[Event]]:
+        """加载 outbox 记录及对应事件（脱离会话后返回）"""
+        db = self.session_factory()
+        try:
+            entry = db.query(ForwardOutbox).filter(ForwardOutbox.id == entry_id).first()
+            if entry is None:
+                return None, None
+            event = (
+                db.query(Event)
+                .options(undefer_group("body"))
+                .filter(Event.id == entry.event_id)
+                .first()
+            )
+            db.expunge(entry)
+            if event is not None:
+                db.expunge(event)
+            return entry, event
+        finally:
+            db.close()
+
+    def _complete(self, entry_id: int, success: bool, error: Optional[str] = None):
+        """成功则移出队列；失败则按退避策略重新排期或移入死信"""
+        if success:
+            self._delete(entry_id)
+            return
+
+        db = self.session_factory()
+        try:
+            entry = db.query(ForwardOutbox).filter(ForwardOutbox.id == entry_id).first()
+            if entry is None:
+                return
+            if schedule_retry(db, entry, error, self.retry_policy):
+                logger.warning(
+                    "event %s moved to dead letters after %d attempts to %s",
+                    entry.event_id, self.retry_policy.max_attempts, entry.target_url
+                )
+            db.commit()
+        finally:
+            db.close()
+
+    def _defer(self, entry_id: int, delay: float, error: Optional[str] = None):
+        db = self.session_factory()
+        try:
+            entry = db.query(ForwardOutbox).filter(ForwardOutbox.id == entry_id).first()
+            if entry is not None:
+                defer_entry(entry, delay, error)
+                db.commit()
+        finally:
+            db.close()
+
+    def _delete(self, entry_id: int):
+        db = self.session_factory()
+        try:
+            db.query(ForwardOutbox).filter(ForwardOutbox.id == entry_id).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _release(self, entry_ids: List[int]):
+        """把指定记录放回 pending"""
+        db = self.session_factory()
+        try:
+            db.query(ForwardOutbox).filter(
+                ForwardOutbox.id.in_(entry_ids),
+                ForwardOutbox.status == "processing"
+            ).update({"status": "pending", "locked_at": None}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _release_stale(self, exclude: Optional[List[int]] = None):
+        """回收超时未完成的领取（进程崩溃或被杀时遗留），本进程正在处理的除外"""
+        cutoff = datetime.utcnow() - timedelta(seconds=settings.FORWARD_QUEUE_LOCK_TIMEOUT)
+        db = self.session_factory()
+        try:
+            query = db.query(ForwardOutbox).filter(
+                ForwardOutbox.status == "processing",
+                ForwardOutbox.locked_at < cutoff
+            )
+            if exclude:
+                query = query.filter(ForwardOutbox.id.notin_(exclude))
+            query.update({"status": "pending", "locked_at": None}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+# 应用级单例
+forward_queue = ForwardQueue()
@@ -0,0 +1,117 @@
+"""
+事件分页与流式导出
+
+分页使用 (created_at, id) 键集游标，深翻页不依赖 OFFSET；
+导出使用服务端游标分批读取，内存占用与导出行数无关。
+"""
+import base64
+import json
+import zlib
+from datetime import datetime
+from typing import Iterator, Optional, Tuple
+
+from sqlalchemy import and_, desc, or_
+from sqlalchemy.orm import Query, undefer_group
+
+from app.models import Event, SessionLocal
+
+
+EXPORT_BATCH_SIZE = 1000
+FLUSH_BYTES = 64 * 1024
+
+
+def encode_cursor(created_at: datetime, event_id: int) -> str:
+    """编码游标（指向本页最后一条）"""
+    raw = f"{created_at.isoformat()}|{event_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析游标，格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, event_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(created_at), int(event_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def apply_cursor(query: Query, cursor: Optional[str]) -> Query:
+    """按 created_at DESC, id DESC 排序，并从游标之后开始"""
+    if cursor:
+        created_at, event_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            Event.created_at < created_at,
+            and_(Event.created_at == created_at, Event.id < event_id)
+        ))
+    return query.order_by(desc(Event.created_at), desc(Event.id))
+
+
+def filter_events(
+    query: Query,
+    source: Optional[str] = None,
+    event_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> Query:
+    if source:
+        query = query.filter(Event.source == source)
+    if event_type:
+        query = query.filter(Event.event_type == event_type)
+    if since:
+        query = query.filter(Event.created_at >= since)
+    if until:
+        query = query.filter(Event.created_at < until)
+    return query
+
+
+def event_to_dict(event: Event) -> dict:
+    return {
+        "id": event.id,
+        "source": event.source,
+        "event_type": event.event_type,
+        "payload": event.payload,
+        "headers": event.headers,
+        "signature_valid": event.signature_valid,
+        "forwarded": event.forwarded,
+        "created_at": event.created_at.isoformat() if event.created_at else None,
+    }
+
+
+def iter_export(
+    source: Optional[str] = None,
+    event_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    compress: bool = False,
+    session_factory=SessionLocal
+) -> Iterator[bytes]:
+    """
+    逐行产出 NDJSON（可选 gzip）
+
+    按 id 升序导出；查询以 stream_results + yield_per 分批读取，
+    已输出的 ORM 对象不被会话强引用，可随时回收。
+    """
+    db = session_factory()
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = bytearray()
+    try:
+        query = filter_events(db.query(Event).options(undefer_group("body")), source, event_type, since, until)
+        rows = (
+            query.order_by(Event.id)
+            .execution_options(stream_results=True)
+            .yield_per(EXPORT_BATCH_SIZE)
+        )
+        for event in rows:
+            line = (json.dumps(event_to_dict(event), ensure_ascii=False) + "\n").encode("utf-8")
+            buffer += compressor.compress(line) if compressor else line
+            if len(buffer) >= FLUSH_BYTES:
+                yield bytes(buffer)
+                buffer.clear()
+
+        if compressor is not None:
+            buffer += compressor.flush()
+        if buffer:
+            yield bytes(buffer)
+    finally:
+        db.close()
@@ -0,0 +1,152 @@
+"""
+批量重放
+
+按条件分块读取历史事件，以可配置的并发度和速率上限重新转发，
+过程中持续产出进度（NDJSON / SSE）。
+"""
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, undefer_group
+
+from app.forwarder import AsyncTokenBucket, EventForwarder
+from app.models import BulkReplayRequest, Event, SessionLocal
+from app.routing import router
+from app.settings import settings
+
+
+class BulkReplayer:
+    """批量重放器"""
+
+    def __init__(self, forwarder: Optional[EventForwarder] = None, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self.forwarder = forwarder or EventForwarder(session_factory)
+
+    @staticmethod
+    def _filtered(query, request: BulkReplayRequest):
+        if request.source:
+            query = query.filter(Event.source == request.source)
+        if request.event_type:
+            query = query.filter(Event.event_type == request.event_type)
+        if request.since:
+            query = query.filter(Event.created_at >= request.since)
+        if request.until:
+            query = query.filter(Event.created_at < request.until)
+        if request.id_from is not None:
+            query = query.filter(Event.id >= request.id_from)
+        if request.id_to is not None:
+            query = query.filter(Event.id <= request.id_to)
+        return query
+
+    def _count(self, request: BulkReplayRequest) -> int:
+        db = self.session_factory()
+        try:
+            return self._filtered(db.query(func.count(Event.id)), request).scalar()
+        finally:
+            db.close()
+
+    def _load_chunk(self, request: BulkReplayRequest, after_id: int, size: int) -> List[Event]:
+        """按 ID 升序的 keyset 分块读取（不依赖 OFFSET，深翻页同样快）"""
+        db: Session = self.session_factory()
+        try:
+            events = (
+                self._filtered(db.query(Event).options(undefer_group("body")), request)
+                .filter(Event.id > after_id)
+                .order_by(Event.id)
+                .limit(size)
+                .all()
+            )
+            for event in events:
+                db.expunge(event)
+            return events
+        finally:
+            db.close()
+
+    async def run(self, request: BulkReplayRequest) -> AsyncIterator[Dict]:
+        """执行重放，逐步产出进度"""
+        target_url = request.target_url
+        concurrency = min(request.concurrency, settings.REPLAY_MAX_CONCURRENCY)
+        bucket = AsyncTokenBucket(request.rate_limit) if request.rate_limit else None
+
+        total = await asyncio.to_thread(self._count, request)
+        yield {"type": "start", "total": total, "target_url": target_url, "concurrency": concurrency}
+
+        stats = {"sent": 0, "succeeded": 0, "failed": 0, "last_event_id": None}
+        started = time.monotonic()
+        pending: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+        results: List = []
+
+        async def worker():
+            while True:
+                event = await pending.get()
+                try:
+                    if event is None:
+                        return
+                    if bucket is not None:
+                        await bucket.acquire()
+                    # 未指定目标时按路由表并发转发到全部匹配目标
+                    urls = [target_url] if target_url else [
+                        target.url for target in router.match(event.source, event.event_type)
+                    ]
+                    sent = await asyncio.gather(*(self.forwarder.send(event, url) for url in urls))
+                    for url, result in zip(urls, sent):
+                        results.append((event.id, url, result))
+                        stats["sent"] += 1
+                        stats["succeeded" if result.success else "failed"] += 1
+                finally:
+                    pending.task_done()
+
+        def progress(kind: str) -> Dict:
+            elapsed = time.monotonic() - started
+            return {
+                "type": kind,
+                "total": total,
+                **stats,
+                "elapsed": round(elapsed, 3),
+                "rate": round(stats["sent"] / elapsed, 1) if elapsed > 0 else 0.0
+            }
+
+        async def flush_logs():
+            if results:
+                batch = results[:]
+                results.clear()
+                await asyncio.to_thread(self.forwarder.record, batch)
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            after_id = 0
+            while True:
+                chunk = await asyncio.to_thread(self._load_chunk, request, after_id, request.chunk_size)
+                if not chunk:
+                    break
+                for event in chunk:
+                    await pending.put(event)
+                after_id = chunk[-1].id
+                stats["last_event_id"] = after_id
+
+                await flush_logs()
+                yield progress("progress")
+
+            for _ in workers:
+                await pending.put(None)
+            await asyncio.gather(*workers)
+            await flush_logs()
+            yield progress("done")
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # 客户端中途断开时，已发送部分的日志仍然落库
+            if results:
+                await asyncio.to_thread(self.forwarder.record, results[:])
+
+
+def format_ndjson(item: Dict) -> str:
+    return json.dumps(item, default=str) + "\n"
+
+
+def format_sse(item: Dict) -> str:
+    return f"event: {item['type']}\ndata: {json.dumps(item, default=str)}\n\n"
@@ -0,0 +1,312 @@
+"""
+事件保留与冷归档
+
+超过 RETENTION_DAYS 的事件和转发日志先追加写入按日分区的 JSONL.gz 归档文件，
+再以小批量事务从数据库删除（批次间让出写锁，不阻塞入库），最后执行 SQLite incremental_vacuum。
+归档文件可通过 /api/events?include_archive=true 继续查询。
+
+归档先于删除落盘：进程在两步之间中断时重跑会再次归档同一批记录（至少一次），不会丢数据。
+
+手动执行：
+    python -m app.retention run      # 立即执行一轮清理
+    python -m app.retention vacuum   # 旧库切换为 incremental auto_vacuum（执行一次完整 VACUUM）
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, undefer_group
+
+from app import search, stats
+from app.models import (
+    DeadLetter, Event, EventField, EventResponse, ForwardLog, ForwardOutbox, SessionLocal, engine, init_db
+)
+from app.paging import event_to_dict
+from app.settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveStore:
+    """按日分区的 JSONL.gz 归档：<root>/<kind>/YYYY-MM-DD.jsonl.gz"""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = Path(root or settings.ARCHIVE_DIR)
+
+    def path(self, kind: str, day: date) -> Path:
+        return self.root / kind / f"{day.isoformat()}.jsonl.gz"
+
+    def append(self, kind: str, records: List[Dict]):
+        """
+        追加记录（按 created_at 所在日期分区）
+
+        每次追加写入一个独立的 gzip member，多 member 文件可直接顺序解压；
+        写入后 fsync，保证删除数据库记录前归档已落盘。
+        """
+        by_day: Dict[date, List[Dict]] = {}
+        for record in records:
+            day = datetime.fromisoformat(record["created_at"]).date()
+            by_day.setdefault(day, []).append(record)
+
+        for day, rows in by_day.items():
+            path = self.path(kind, day)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            data = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
+            with open(path, "ab") as f:
+                f.write(gzip.compress(data))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read_day(self, kind: str, day: date) -> List[Dict]:
+        path = self.path(kind, day)
+        if not path.exists():
+            return []
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def query_events(
+        self,
+        source: Optional[str] = None,
+        event_type: Optional[str] = None,
+        since: Optional[datetime] = None,
+        before: Optional[Tuple[datetime, int]] = None,
+        limit: int = 100
+    ) -> List[EventResponse]:
+        """
+        按 created_at DESC, id DESC 查询归档事件
+
+        before 为 (created_at, id)，只返回排在它之后的记录，与数据库分页游标语义一致。
+        """
+        newest = (before[0] if before else datetime.utcnow()).date()
+        oldest = since.date() if since else self._oldest_day("events")
+        if oldest is None:
+            return []
+
+        results: List[EventResponse] = []
+        day = newest
+        while day >= oldest and len(results) < limit:
+            rows = []
+            for record in self.read_day("events", day):
+                created_at = datetime.fromisoformat(record["created_at"])
+                if source and record["source"] != source:
+                    continue
+                if event_type and record["event_type"] != event_type:
+                    continue
+                if since and created_at < since:
+                    continue
+                if before and (created_at, record["id"]) >= before:
+                    continue
+                rows.append((created_at, record))
+            rows.sort(key=lambda item: (item[0], item[1]["id"]), reverse=True)
+            for _, record in rows[:limit - len(results)]:
+                results.append(EventResponse(**record))
+            day -= timedelta(days=1)
+        return results
+
+    def _oldest_day(self, kind: str) -> Optional[date]:
+        directory = self.root / kind
+        if not directory.exists():
+            return None
+        days = [date.fromisoformat(path.name.split(".", 1)[0]) for path in directory.glob("*.jsonl.gz")]
+        return min(days) if days else None
+
+
+def forward_log_to_dict(log: ForwardLog) -> Dict:
+    return {
+        "id": log.id,
+        "event_id": log.event_id,
+        "target_url": log.target_url,
+        "status_code": log.status_code,
+        "success": log.success,
+        "error_message": log.error_message,
+        "created_at": log.created_at.isoformat() if log.created_at else None,
+    }
+
+
+class RetentionJob:
+    """保留期清理任务（后台定时执行）"""
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        archive: Optional[ArchiveStore] = None,
+        batch_size: Optional[int] = None
+    ):
+        self.session_factory = session_factory
+        self.archive = archive or archive_store
+        self.batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+        self._task: Optional[asyncio.Task] = None
+        self._warned_vacuum = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running or settings.RETENTION_INTERVAL_SECONDS <= 0:
+            return
+        self._task = asyncio.create_task(self._loop())
+        logger.info(
+            "retention job started (%d days, every %d s)",
+            settings.RETENTION_DAYS, settings.RETENTION_INTERVAL_SECONDS
+        )
+
+    async def stop(self):
+        if not self.running:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                result = await self.run_once()
+                if result["events"] or result["forward_logs"]:
+                    logger.info("retention: %s", result)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("retention run failed")
+            await asyncio.sleep(settings.RETENTION_INTERVAL_SECONDS)
+
+    async def run_once(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """
+        执行一轮清理
+
+        Returns:
+            归档并删除的事件数、转发日志数，以及 incremental_vacuum 归还的页数
+        """
+        cutoff = (now or datetime.utcnow()) - timedelta(days=settings.RETENTION_DAYS)
+        pause = settings.RETENTION_BATCH_PAUSE_MS / 1000
+        result = {"events": 0, "forward_logs": 0, "vacuumed_pages": 0}
+
+        for key, purge in (("events", self._purge_events), ("forward_logs", self._purge_forward_logs)):
+            while True:
+                deleted = await asyncio.to_thread(purge, cutoff)
+                result[key] += deleted
+                if deleted < self.batch_size:
+                    break
+                await asyncio.sleep(pause)
+
+        if result["events"] or result["forward_logs"]:
+            result["vacuumed_pages"] = await asyncio.to_thread(self._incremental_vacuum)
+        return result
+
+    def _purge_events(self, cutoff: datetime) -> int:
+        """归档并删除一批过期事件（连同其 outbox / 死信 / 字段索引 / 全文索引），同一事务内扣减统计"""
+        db: Session = self.session_factory()
+        try:
+            events = (
+                db.query(Event)
+                .options(undefer_group("body"))
+                .filter(Event.created_at < cutoff)
+                .order_by(Event.created_at, Event.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not events:
+                return 0
+            if settings.ARCHIVE_ENABLED:
+                self.archive.append("events", [event_to_dict(event) for event in events])
+
+            ids = [event.id for event in events]
+            stats.discount_events(db, [
+                (event.created_at, event.source, event.event_type, event.signature_valid)
+                for event in events
+            ])
+            db.query(ForwardOutbox).filter(ForwardOutbox.event_id.in_(ids)).delete(synchronize_session=False)
+            db.query(DeadLetter).filter(DeadLetter.event_id.in_(ids)).delete(synchronize_session=False)
+            db.query(EventField).filter(EventField.event_id.in_(ids)).delete(synchronize_session=False)
+            search.unindex_events(db, events)
+            db.query(Event).filter(Event.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+            return len(ids)
+        finally:
+            db.close()
+
+    def _purge_forward_logs(self, cutoff: datetime) -> int:
+        db: Session = self.session_factory()
+        try:
+            logs = (
+                db.query(ForwardLog)
+                .filter(ForwardLog.created_at < cutoff)
+                .order_by(ForwardLog.created_at, ForwardLog.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not logs:
+                return 0
+            if settings.ARCHIVE_ENABLED:
+                self.archive.append("forward_logs", [forward_log_to_dict(log) for log in logs])
+            ids = [log.id for log in logs]
+            db.query(ForwardLog).filter(ForwardLog.id.in_(ids)).delete(synchronize_session=False)
+            db.commit()
+            return len(ids)
+        finally:
+            db.close()
+
+    def _incremental_vacuum(self) -> int:
+        """SQLite incremental auto_vacuum 模式下归还空闲页，返回归还页数"""
+        db: Session = self.session_factory()
+        try:
+            if db.get_bind().dialect.name != "sqlite":
+                return 0
+            connection = db.connection()
+            if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+                if not self._warned_vacuum:
+                    logger.info("SQLite auto_vacuum is not INCREMENTAL; run 'python -m app.retention vacuum' once")
+                    self._warned_vacuum = True
+                return 0
+            before = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+            connection.exec_driver_sql(f"PRAGMA incremental_vacuum({settings.RETENTION_VACUUM_PAGES})").fetchall()
+            after = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+            db.commit()
+            return before - after
+        finally:
+            db.close()
+
+
+def enable_incremental_vacuum():
+    """把已有 SQLite 库切换为 incremental auto_vacuum（需要一次完整 VACUUM）"""
+    if engine.dialect.name != "sqlite":
+        raise RuntimeError("incremental vacuum only applies to SQLite")
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+
+
+# 应用级单例
+archive_store = ArchiveStore()
+retention_job = RetentionJob()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event retention tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("run", help="archive and delete expired events now")
+    sub.add_parser("vacuum", help="switch SQLite to incremental auto_vacuum (full VACUUM)")
+
+    args = parser.parse_args()
+    init_db()
+
+    if args.command == "run":
+        result = asyncio.run(retention_job.run_once())
+        print(
+            f"✓ archived and deleted {result['events']} events, {result['forward_logs']} forward logs; "
+            f"vacuumed {result['vacuumed_pages']} pages"
+        )
+    elif args.command == "vacuum":
+        enable_incremental_vacuum()
+        print("✓ auto_vacuum=INCREMENTAL enabled")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+转发重试与死信
+
+失败的转发按带抖动的指数退避重新排期，超过最大次数后移入死信表，
+可通过 API 查看并批量重投。
+"""
+import random
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.models import DeadLetter, ForwardOutbox
+from app.settings import settings
+
+
+class RetryPolicy:
+    """带抖动的指数退避策略"""
+
+    def __init__(
+        self,
+        max_attempts: Optional[int] = None,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None
+    ):
+        self.max_attempts = max_attempts or settings.FORWARD_MAX_ATTEMPTS
+        self.base_delay = base_delay if base_delay is not None else settings.FORWARD_RETRY_BASE_DELAY
+        self.max_delay = max_delay if max_delay is not None else settings.FORWARD_RETRY_MAX_DELAY
+
+    def next_delay(self, attempts: int) -> float:
+        """
+        第 attempts 次失败后的等待秒数
+
+        取 base * 2^(attempts-1)（不超过 max_delay），再在 [d/2, d] 内随机，
+        避免同一批失败的事件在同一时刻集中重试。
+        """
+        delay = min(self.max_delay, self.base_delay * (2 ** max(attempts - 1, 0)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def exhausted(self, attempts: int) -> bool:
+        return attempts >= self.max_attempts
+
+
+def schedule_retry(db: Session, entry: ForwardOutbox, error: Optional[str], policy: RetryPolicy) -> bool:
+    """
+    记录一次失败：重新排期或移入死信（不提交）
+
+    Returns:
+        True 表示已移入死信
+    """
+    attempts = (entry.attempts or 0) + 1
+    if policy.exhausted(attempts):
+        db.add(DeadLetter(
+            event_id=entry.event_id,
+            target_url=entry.target_url,
+            attempts=attempts,
+            last_error=error,
+            first_queued_at=entry.created_at
+        ))
+        db.delete(entry)
+        return True
+
+    entry.attempts = attempts
+    entry.last_error = error
+    entry.status = "pending"
+    entry.locked_at = None
+    entry.available_at = datetime.utcnow() + timedelta(seconds=policy.next_delay(attempts))
+    return False
+
+
+def defer_entry(entry: ForwardOutbox, delay: float, error: Optional[str] = None):
+    """延后投递但不计入重试次数（目标熔断时未实际发出请求，不提交）"""
+    entry.last_error = error
+    entry.status = "pending"
+    entry.locked_at = None
+    entry.available_at = datetime.utcnow() + timedelta(seconds=delay)
+
+
+def list_dead_letters(
+    db: Session,
+    target_url: Optional[str] = None,
+    event_id: Optional[int] = None,
+    limit: int = 100,
+    offset: int = 0
+) -> List[DeadLetter]:
+    """查询死信（最新的在前）"""
+    query = db.query(DeadLetter)
+    if target_url:
+        query = query.filter(DeadLetter.target_url == target_url)
+    if event_id is not None:
+        query = query.filter(DeadLetter.event_id == event_id)
+    return query.order_by(DeadLetter.id.desc()).offset(offset).limit(limit).all()
+
+
+def redrive_dead_letters(
+    db: Session,
+    ids: Optional[List[int]] = None,
+    target_url: Optional[str] = None,
+    override_url: Optional[str] = None,
+    limit: int = 1000
+) -> int:
+    """
+    把死信重新放回转发队列（重试次数清零），返回重投条数
+
+    Args:
+        ids: 指定死信 ID；为空时按 target_url 过滤或全部重投
+        target_url: 仅重投该目标的死信
+        override_url: 改投到新的目标 URL
+        limit: 单次最多重投条数
+    """
+    query = db.query(DeadLetter)
+    if ids:
+        query = query.filter(DeadLetter.id.in_(ids))
+    if target_url:
+        query = query.filter(DeadLetter.target_url == target_url)
+    letters = query.order_by(DeadLetter.id).limit(limit).all()
+
+    for letter in letters:
+        db.add(ForwardOutbox(
+            event_id=letter.event_id,
+            target_url=override_url or letter.target_url
+        ))
+        db.delete(letter)
+    db.commit()
+    return len(letters)
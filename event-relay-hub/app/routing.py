@@ -0,0 +1,126 @@
+"""
+转发路由
+
+FORWARD_TARGETS 定义具名转发目标（URL、超时、最大并发、速率），
+FORWARD_ROUTES 按 (source, event_type) 通配符把事件分发到一个或多个目标：
+
+    FORWARD_TARGETS={"billing": {"url": "http://billing/hook", "timeout": 5, "max_in_flight": 4, "rate_limit": 20}}
+    FORWARD_ROUTES=[{"source": "stripe", "event_type": "charge.*", "targets": ["billing", "audit"]}]
+
+FORWARD_URL 仍然有效，作为名为 default、匹配全部事件的目标。
+入库时每个匹配目标写入一条 outbox 记录，由转发 worker 并行投递，各自记录 ForwardLog。
+"""
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.settings import settings
+
+
+@dataclass(frozen=True)
+class ForwardTarget:
+    """转发目标（max_in_flight / rate_limit 为 0 表示不限制）"""
+    name: str
+    url: str
+    timeout: float
+    max_in_flight: int = 0
+    rate_limit: float = 0.0  # 每秒请求数
+
+
+@dataclass(frozen=True)
+class Route:
+    """路由规则：source / event_type 支持 fnmatch 通配符"""
+    source: str
+    event_type: str
+    targets: Tuple[str, ...]
+
+    def matches(self, source: str, event_type: Optional[str]) -> bool:
+        return fnmatchcase(source, self.source) and fnmatchcase(event_type or "", self.event_type)
+
+
+class RoutingTable:
+    """
+    路由表
+
+    未显式传入配置时跟随 settings（配置对象被替换时重新编译），
+    便于运行时调整和测试中 monkeypatch。
+    """
+
+    def __init__(
+        self,
+        targets: Optional[Dict[str, Dict[str, Any]]] = None,
+        routes: Optional[List[Dict[str, Any]]] = None,
+        default_url: Optional[str] = None
+    ):
+        self._explicit = (targets, routes, default_url)
+        self._key = None
+        self._targets: Dict[str, ForwardTarget] = {}
+        self._by_url: Dict[str, ForwardTarget] = {}
+        self._routes: List[Route] = []
+
+    def _config(self) -> Tuple[Dict, List, Optional[str]]:
+        targets, routes, default_url = self._explicit
+        return (
+            settings.FORWARD_TARGETS if targets is None else targets,
+            settings.FORWARD_ROUTES if routes is None else routes,
+            settings.FORWARD_URL if default_url is None else default_url,
+        )
+
+    def _compile(self):
+        targets, routes, default_url = self._config()
+        key = (id(targets), id(routes), default_url)
+        if key == self._key:
+            return
+
+        compiled = {
+            name: ForwardTarget(
+                name=name,
+                url=config["url"],
+                timeout=float(config.get("timeout", settings.FORWARD_TIMEOUT)),
+                max_in_flight=int(config.get("max_in_flight", 0)),
+                rate_limit=float(config.get("rate_limit", 0)),
+            )
+            for name, config in targets.items()
+        }
+        compiled_routes = []
+        for route in routes:
+            names = tuple(route.get("targets", ()))
+            unknown = [name for name in names if name not in compiled]
+            if unknown:
+                raise ValueError(f"Route references unknown forward targets: {', '.join(unknown)}")
+            compiled_routes.append(Route(route.get("source", "*"), route.get("event_type", "*"), names))
+        if default_url:
+            compiled.setdefault("default", ForwardTarget("default", default_url, float(settings.FORWARD_TIMEOUT)))
+            compiled_routes.append(Route("*", "*", ("default",)))
+
+        self._targets = compiled
+        self._by_url = {target.url: target for target in compiled.values()}
+        self._routes = compiled_routes
+        self._key = key
+
+    @property
+    def targets(self) -> List[ForwardTarget]:
+        self._compile()
+        return list(self._targets.values())
+
+    def match(self, source: str, event_type: Optional[str]) -> List[ForwardTarget]:
+        """事件匹配的全部目标（按规则顺序去重）"""
+        self._compile()
+        matched: Dict[str, ForwardTarget] = {}
+        for route in self._routes:
+            if route.matches(source, event_type):
+                for name in route.targets:
+                    matched.setdefault(name, self._targets[name])
+        return list(matched.values())
+
+    def target_for(self, url: str) -> ForwardTarget:
+        """按 URL 查找目标配置（重放 / 死信重投到未配置的 URL 时使用默认超时、不限流）"""
+        self._compile()
+        target = self._by_url.get(url)
+        if target is None:
+            target = ForwardTarget(name=url, url=url, timeout=float(settings.FORWARD_TIMEOUT))
+        return target
+
+
+# 应用级单例
+router = RoutingTable()
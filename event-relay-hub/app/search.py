@@ -0,0 +1,233 @@
+"""
+payload 全文检索（SQLite FTS5）
+
+events_fts 为 contentless 表：只保存倒排索引，不重复存放 payload 原文（payload 可能已压缩存储）。
+入库路径在同一事务内写入索引，保留期清理删除事件前用原文执行 FTS5 'delete' 命令移除索引；
+片段高亮在 Python 中基于解压后的 payload 生成。
+
+检索时 source 作为 FTS 列过滤、时间范围先换算为 rowid（即事件 id）区间，都下推到 FTS5 内部执行，
+再与 events 表连接做精确的时间过滤并按 bm25 排序。
+
+已有数据的库启用检索（或修改 SEARCH_ENABLED 后）重建索引：
+    python -m app.search rebuild
+"""
+import argparse
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import DateTime, bindparam, func, text
+from sqlalchemy.orm import Session, undefer_group
+
+from app.models import Event, SearchHit, SessionLocal, init_db
+from app.settings import settings
+
+
+_TOKEN = re.compile(r'"[^"]*"|\S+')
+
+_SEARCH_QUERY = """
+SELECT events_fts.rowid, bm25(events_fts) AS rank
+FROM events_fts JOIN events ON events.id = events_fts.rowid
+WHERE events_fts MATCH :match {conditions}
+ORDER BY rank
+LIMIT :limit
+"""
+
+
+def enabled(db: Session) -> bool:
+    """全文检索仅在 SQLite 上可用"""
+    return settings.SEARCH_ENABLED and db.get_bind().dialect.name == "sqlite"
+
+
+def index_events(db: Session, events: List[Event]):
+    """入库路径调用：在当前事务内写入全文索引（事件需已 flush）"""
+    if not events or not enabled(db):
+        return
+    db.execute(
+        text("INSERT INTO events_fts (rowid, payload, source) VALUES (:id, :payload, :source)"),
+        [{"id": event.id, "payload": event.payload, "source": event.source} for event in events]
+    )
+
+
+def unindex_events(db: Session, events: List[Event]):
+    """
+    删除事件前移除其全文索引
+
+    contentless 表无法直接 DELETE，需以写入时的原文执行 'delete' 命令（事件需已加载 body）。
+    """
+    if not events or not enabled(db):
+        return
+    db.execute(
+        text("INSERT INTO events_fts (events_fts, rowid, payload, source) VALUES ('delete', :id, :payload, :source)"),
+        [{"id": event.id, "payload": event.payload, "source": event.source} for event in events]
+    )
+
+
+def parse_query(query: str) -> Tuple[str, List[Tuple[str, bool]]]:
+    """
+    把用户输入转换为 FTS5 MATCH 表达式
+
+    每个词（或双引号短语）按短语匹配、彼此 AND，结尾 * 表示前缀匹配；
+    不透传 FTS5 语法，避免输入错误导致查询异常。
+
+    Returns:
+        (MATCH 表达式, [(高亮用的词, 是否前缀)])
+
+    Raises:
+        ValueError: 查询为空
+    """
+    phrases = []
+    terms: List[Tuple[str, bool]] = []
+    for token in _TOKEN.findall(query):
+        prefix = token.endswith("*")
+        term = token.rstrip("*").strip('"').strip()
+        if not term:
+            continue
+        phrases.append('"' + term.replace('"', '""') + '"' + ("*" if prefix else ""))
+        terms.append((term, prefix))
+    if not phrases:
+        raise ValueError("Empty search query")
+    return "payload : (" + " ".join(phrases) + ")", terms
+
+
+def build_snippet(payload: str, terms: List[Tuple[str, bool]], width: Optional[int] = None) -> str:
+    """截取首个命中词附近的片段，命中词以 <mark></mark> 标出"""
+    width = width or settings.SEARCH_SNIPPET_CHARS
+    pattern = re.compile(
+        "|".join(
+            r"(?<!\w)" + re.escape(term) + (r"\w*" if prefix else r"(?!\w)")
+            for term, prefix in sorted(terms, key=lambda item: -len(item[0]))
+        ),
+        re.IGNORECASE
+    )
+    first = pattern.search(payload)
+    start = max(0, first.start() - width // 3) if first else 0
+    end = min(len(payload), start + width)
+    window = pattern.sub(lambda m: f"<mark>{m.group(0)}</mark>", payload[start:end])
+    return ("…" if start > 0 else "") + window + ("…" if end < len(payload) else "")
+
+
+def _id_bounds(db: Session, since: Optional[datetime], until: Optional[datetime]) -> Dict[str, int]:
+    """
+    把时间范围换算为事件 id 区间（走 created_at 索引）
+
+    id 与 created_at 不严格同序，区间只用于缩小 FTS5 扫描范围，精确过滤仍按 created_at。
+    """
+    bounds = {}
+    if since is not None:
+        bounds["min_id"] = db.query(func.min(Event.id)).filter(Event.created_at >= since).scalar()
+    if until is not None:
+        bounds["max_id"] = db.query(func.max(Event.id)).filter(Event.created_at < until).scalar()
+    return bounds
+
+
+def search_events(
+    db: Session,
+    query: str,
+    source: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 20
+) -> List[SearchHit]:
+    """
+    按相关度检索事件
+
+    Raises:
+        ValueError: 查询为空
+    """
+    match, terms = parse_query(query)
+    params: Dict = {"limit": limit}
+    conditions = []
+    if source:
+        # 列过滤在 FTS5 内部缩小候选集，events.source 再做精确匹配
+        match = 'source : "' + source.replace('"', '""') + '" AND ' + match
+        conditions.append("AND events.source = :source")
+        params["source"] = source
+
+    bounds = _id_bounds(db, since, until)
+    if None in bounds.values():
+        return []
+    if "min_id" in bounds:
+        conditions.append("AND events_fts.rowid >= :min_id AND events.created_at >= :since")
+        params.update(min_id=bounds["min_id"], since=since)
+    if "max_id" in bounds:
+        conditions.append("AND events_fts.rowid <= :max_id AND events.created_at < :until")
+        params.update(max_id=bounds["max_id"], until=until)
+    params["match"] = match
+
+    statement = text(_SEARCH_QUERY.format(conditions=" ".join(conditions))).bindparams(
+        *(bindparam(name, type_=DateTime()) for name in ("since", "until") if name in params)
+    )
+    ranked = db.execute(statement, params).all()
+    if not ranked:
+        return []
+
+    events = {
+        event.id: event
+        for event in db.query(Event).options(undefer_group("body")).filter(Event.id.in_([row[0] for row in ranked]))
+    }
+    hits = []
+    for event_id, rank in ranked:
+        event = events[event_id]
+        hits.append(SearchHit(
+            id=event.id,
+            source=event.source,
+            event_type=event.event_type,
+            created_at=event.created_at,
+            score=-rank,
+            snippet=build_snippet(event.payload, terms),
+        ))
+    return hits
+
+
+def rebuild(batch_size: int = 1000, session_factory=SessionLocal) -> int:
+    """清空并按 id 分批重建全文索引，返回事件数"""
+    db: Session = session_factory()
+    try:
+        if not enabled(db):
+            raise RuntimeError("full-text search requires SQLite and SEARCH_ENABLED=True")
+        db.execute(text("INSERT INTO events_fts (events_fts) VALUES ('delete-all')"))
+        db.commit()
+    finally:
+        db.close()
+
+    total = 0
+    after_id = 0
+    while True:
+        db = session_factory()
+        try:
+            events = (
+                db.query(Event)
+                .options(undefer_group("body"))
+                .filter(Event.id > after_id)
+                .order_by(Event.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not events:
+                break
+            after_id = events[-1].id
+            index_events(db, events)
+            db.commit()
+            total += len(events)
+        finally:
+            db.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = sub.add_parser("rebuild", help="rebuild the events_fts index from stored events")
+    rebuild_parser.add_argument("--batch-size", type=int, default=1000)
+
+    args = parser.parse_args()
+    init_db()
+
+    if args.command == "rebuild":
+        total = rebuild(batch_size=args.batch_size)
+        print(f"✓ indexed {total} events")
+
+
+if __name__ == "__main__":
+    main()
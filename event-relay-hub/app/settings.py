@@ -2,7 +2,7 @@
 Event Relay Hub 配置
 """
 import os
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -17,12 +17,39 @@ class Settings(BaseSettings):
     
     # 数据库
     DATABASE_URL: str = "sqlite:///./event_hub.db"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    
+    # payload / headers 压缩存储：none / zlib / zstd（zstd 需要安装 zstandard）
+    STORAGE_COMPRESSION: str = "zlib"
+    STORAGE_COMPRESSION_LEVEL: int = 6
+    STORAGE_COMPRESSION_MIN_BYTES: int = 256
+    
+    # 事件入库模式：direct（每请求提交）/ batch（合并提交，SQLite 启用 WAL）
+    INGEST_MODE: str = "direct"
+    INGEST_BATCH_MAX_EVENTS: int = 500
+    INGEST_BATCH_INTERVAL_MS: int = 10
+    INGEST_QUEUE_SIZE: int = 10000
     
     # Webhook 密钥
     GITHUB_WEBHOOK_SECRET: Optional[str] = None
     STRIPE_WEBHOOK_SECRET: Optional[str] = None
     CUSTOM_WEBHOOK_SECRET: Optional[str] = None
     
+    # payload 字段索引：{source: {字段名: 点分路径}}，"*" 对所有事件源生效
+    # 入库时提取写入 event_fields 表，/api/events?field.<字段名>=<值> 走索引查询
+    FIELD_EXTRACTORS: Dict[str, Dict[str, str]] = {
+        "stripe": {"customer": "data.object.customer"},
+        "github": {"repo": "repository.full_name"},
+    }
+    
+    # payload 全文检索（SQLite FTS5，/api/events/search）
+    SEARCH_ENABLED: bool = True
+    SEARCH_SNIPPET_CHARS: int = 160  # 摘要片段长度（字符）
+    
+    # 投递去重（Stripe 事件 id / X-GitHub-Delivery / 自定义头）
+    CUSTOM_DELIVERY_ID_HEADER: str = "X-Delivery-Id"
+    DEDUP_CACHE_SIZE: int = 100000
+    
     # 速率限制
     RATE_LIMIT_PER_MINUTE: int = 60
     RATE_LIMIT_ENABLED: bool = True
@@ -35,8 +62,62 @@ class Settings(BaseSettings):
     FORWARD_URL: Optional[str] = None
     FORWARD_TIMEOUT: int = 10
     
-    # 事件保留
+    # 转发路由：具名目标（url / timeout / max_in_flight / rate_limit）与
+    # (source, event_type 通配符) -> 目标列表 的规则，FORWARD_URL 作为匹配全部事件的 default 目标
+    FORWARD_TARGETS: Dict[str, Dict[str, Any]] = {}
+    FORWARD_ROUTES: List[Dict[str, Any]] = []
+    
+    # 转发连接池（按目标主机复用长连接）
+    FORWARD_MAX_CONNECTIONS: int = 100
+    FORWARD_MAX_KEEPALIVE: int = 20
+    FORWARD_KEEPALIVE_EXPIRY: float = 30.0
+    FORWARD_HTTP2: bool = False  # 需要安装 h2（pip install httpx[http2]）
+    
+    # 转发熔断（按目标主机）：窗口内失败 / 慢调用占比超限时熔断，到期后放行探测请求
+    CIRCUIT_ENABLED: bool = True
+    CIRCUIT_WINDOW_SECONDS: float = 60.0
+    CIRCUIT_MIN_REQUESTS: int = 10
+    CIRCUIT_FAILURE_RATE: float = 0.5
+    CIRCUIT_SLOW_CALL_SECONDS: float = 5.0
+    CIRCUIT_OPEN_SECONDS: float = 30.0
+    CIRCUIT_HALF_OPEN_PROBES: int = 1
+    
+    # 转发队列（outbox + 后台 worker）
+    FORWARD_WORKERS: int = 4
+    FORWARD_QUEUE_BATCH_SIZE: int = 50
+    FORWARD_QUEUE_POLL_INTERVAL: float = 1.0
+    FORWARD_QUEUE_LOCK_TIMEOUT: int = 300  # 秒，超时未完成的领取会被重新放回队列
+    
+    # 转发重试（带抖动的指数退避，耗尽后进入死信表）
+    FORWARD_MAX_ATTEMPTS: int = 8
+    FORWARD_RETRY_BASE_DELAY: float = 5.0
+    FORWARD_RETRY_MAX_DELAY: float = 3600.0
+    FORWARD_RETRY_CONCURRENCY: int = 2
+    
+    # 批量重放
+    REPLAY_CONCURRENCY: int = 16
+    REPLAY_MAX_CONCURRENCY: int = 128
+    REPLAY_CHUNK_SIZE: int = 500
+    
+    # 实时推送（SSE / WebSocket）
+    LIVE_MAX_SUBSCRIBERS: int = 100
+    LIVE_BUFFER_SIZE: int = 256  # 每个订阅者最多缓存的消息数，超出丢弃最旧的
+    LIVE_HEARTBEAT_SECONDS: float = 15.0
+    
+    # 事件保留：过期事件与转发日志归档为按日分区的 JSONL.gz 后分批删除
     RETENTION_DAYS: int = 30
+    RETENTION_INTERVAL_SECONDS: int = 3600  # 后台清理间隔，0 表示不自动执行
+    RETENTION_BATCH_SIZE: int = 500  # 每个删除事务的行数
+    RETENTION_BATCH_PAUSE_MS: int = 50  # 批次间让出写锁给入库
+    RETENTION_VACUUM_PAGES: int = 2000  # 每轮 incremental_vacuum 归还的页数（SQLite）
+    ARCHIVE_ENABLED: bool = True
+    ARCHIVE_DIR: str = "./archive"
+    
+    # 统计汇总：分钟桶保留时长（小时桶随事件保留）
+    STATS_MINUTE_RETENTION_HOURS: int = 48
+    
+    # Prometheus 指标（/metrics）
+    METRICS_ENABLED: bool = True
     
     # CORS
     CORS_ORIGINS: list = ["*"]
@@ -0,0 +1,219 @@
+"""
+事件统计汇总
+
+入库时按 分钟 / 小时 桶累加 (source, event_type, signature_valid) 计数，
+/api/stats 只读汇总表，耗时与事件总量无关。
+"""
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.models import Event, EventStats, EventStatsBucket
+from app.settings import settings
+
+
+GRANULARITIES = ("minute", "hour")
+
+_last_prune = 0.0
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    """时间所在桶的起点"""
+    if granularity == "minute":
+        return moment.replace(second=0, microsecond=0)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _aggregate(rows: Iterable[Tuple[datetime, str, str, bool]]) -> Counter:
+    counts: Counter = Counter()
+    for created_at, source, event_type, signature_valid in rows:
+        for granularity in GRANULARITIES:
+            key = (
+                granularity,
+                bucket_start(created_at, granularity),
+                source,
+                event_type or "",
+                bool(signature_valid)
+            )
+            counts[key] += 1
+    return counts
+
+
+def _upsert(db: Session, counts: Counter, sign: int = 1):
+    """把计数累加到汇总表（sign=-1 时扣减）"""
+    if not counts:
+        return
+    rows = [
+        {
+            "granularity": granularity,
+            "bucket": bucket,
+            "source": source,
+            "event_type": event_type,
+            "signature_valid": signature_valid,
+            "count": sign * count
+        }
+        for (granularity, bucket, source, event_type, signature_valid), count in counts.items()
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = insert(EventStatsBucket).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["granularity", "bucket", "source", "event_type", "signature_valid"],
+            set_={"count": EventStatsBucket.count + stmt.excluded.count}
+        )
+        db.execute(stmt)
+        return
+
+    for row in rows:
+        existing = db.query(EventStatsBucket).filter(
+            EventStatsBucket.granularity == row["granularity"],
+            EventStatsBucket.bucket == row["bucket"],
+            EventStatsBucket.source == row["source"],
+            EventStatsBucket.event_type == row["event_type"],
+            EventStatsBucket.signature_valid == row["signature_valid"]
+        ).first()
+        if existing:
+            existing.count += row["count"]
+        else:
+            db.add(EventStatsBucket(**row))
+
+
+def record_events(db: Session, events: List[Event]):
+    """入库路径调用：在当前事务内累加计数（事件需已 flush）"""
+    _upsert(db, _aggregate(
+        (event.created_at, event.source, event.event_type, event.signature_valid)
+        for event in events
+    ))
+    _maybe_prune(db)
+
+
+def discount_events(db: Session, rows: Iterable[Tuple[datetime, str, str, bool]]):
+    """
+    删除事件（保留期清理）时扣减计数
+
+    rows 为 (created_at, source, event_type, signature_valid)；
+    已被清理的分钟桶不再扣减，避免留下负数桶。
+    """
+    minute_cutoff = bucket_start(
+        datetime.utcnow() - timedelta(hours=settings.STATS_MINUTE_RETENTION_HOURS), "minute"
+    )
+    counts = Counter({
+        key: count for key, count in _aggregate(rows).items()
+        if not (key[0] == "minute" and key[1] < minute_cutoff)
+    })
+    _upsert(db, counts, sign=-1)
+
+
+def _maybe_prune(db: Session):
+    """分钟桶只保留最近 STATS_MINUTE_RETENTION_HOURS 小时（每小时最多清理一次）"""
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune < 3600:
+        return
+    _last_prune = now
+    cutoff = datetime.utcnow() - timedelta(hours=settings.STATS_MINUTE_RETENTION_HOURS)
+    db.query(EventStatsBucket).filter(
+        EventStatsBucket.granularity == "minute",
+        EventStatsBucket.bucket < cutoff
+    ).delete(synchronize_session=False)
+
+
+def rebuild(db: Session, batch_size: int = 5000) -> int:
+    """根据 events 表重建汇总（首次启用或数据修复时使用），返回事件数"""
+    db.query(EventStatsBucket).delete(synchronize_session=False)
+    minute_cutoff = datetime.utcnow() - timedelta(hours=settings.STATS_MINUTE_RETENTION_HOURS)
+    total = 0
+    counts: Counter = Counter()
+    rows = db.query(
+        Event.created_at, Event.source, Event.event_type, Event.signature_valid
+    ).yield_per(batch_size)
+    for row in rows:
+        total += 1
+        for key, count in _aggregate([row]).items():
+            if key[0] == "minute" and key[1] < minute_cutoff:
+                continue
+            counts[key] += count
+        if len(counts) >= batch_size:
+            _upsert(db, counts)
+            counts.clear()
+    _upsert(db, counts)
+    db.commit()
+    return total
+
+
+def ensure_rollup(db: Session):
+    """汇总表为空而事件表有数据时（升级后首次启动）执行一次重建"""
+    if db.query(EventStatsBucket.id).first() is None and db.query(Event.id).first() is not None:
+        rebuild(db)
+
+
+def _sum_by(db: Session, column, granularity: str = "hour", since: datetime = None) -> Dict:
+    query = db.query(column, func.sum(EventStatsBucket.count)).filter(
+        EventStatsBucket.granularity == granularity
+    )
+    if since is not None:
+        query = query.filter(EventStatsBucket.bucket >= since)
+    return {key: int(count or 0) for key, count in query.group_by(column).all()}
+
+
+def count_since(db: Session, since: datetime) -> int:
+    """
+    since 之后的事件数
+
+    整点之后用小时桶，since 所在的不完整小时用分钟桶，扫描的桶数与时间跨度无关。
+    """
+    first_full_hour = bucket_start(since, "hour")
+    if first_full_hour < since:
+        first_full_hour += timedelta(hours=1)
+
+    hours = db.query(func.sum(EventStatsBucket.count)).filter(
+        EventStatsBucket.granularity == "hour",
+        EventStatsBucket.bucket >= first_full_hour
+    ).scalar() or 0
+    minutes = db.query(func.sum(EventStatsBucket.count)).filter(
+        EventStatsBucket.granularity == "minute",
+        EventStatsBucket.bucket >= bucket_start(since, "minute"),
+        EventStatsBucket.bucket < first_full_hour
+    ).scalar() or 0
+    return int(hours) + int(minutes)
+
+
+def compute_stats(db: Session) -> EventStats:
+    """从汇总表计算 /api/stats"""
+    by_source = {key: count for key, count in _sum_by(db, EventStatsBucket.source).items() if count}
+    total = sum(by_source.values())
+
+    by_event_type_all = _sum_by(db, EventStatsBucket.event_type)
+    top_types = sorted(
+        ((key, count) for key, count in by_event_type_all.items() if key and count),
+        key=lambda item: item[1],
+        reverse=True
+    )[:10]
+
+    valid = _sum_by(db, EventStatsBucket.signature_valid).get(True, 0)
+    recent_24h = count_since(db, datetime.utcnow() - timedelta(hours=24))
+
+    return EventStats(
+        total_events=total,
+        by_source=by_source,
+        by_event_type=dict(top_types),
+        recent_24h=recent_24h,
+        signature_success_rate=(valid / total * 100) if total > 0 else 0.0
+    )
+
+
+def timeseries(db: Session, granularity: str, since: datetime) -> List[Dict]:
+    """按桶返回计数序列"""
+    rows = db.query(
+        EventStatsBucket.bucket, func.sum(EventStatsBucket.count)
+    ).filter(
+        EventStatsBucket.granularity == granularity,
+        EventStatsBucket.bucket >= bucket_start(since, granularity)
+    ).group_by(EventStatsBucket.bucket).order_by(EventStatsBucket.bucket).all()
+    return [{"bucket": bucket, "count": int(count or 0)} for bucket, count in rows]
@@ -0,0 +1,149 @@
+"""
+事件 payload / headers 压缩存储
+
+写入时（Event 的 before_insert / before_update 钩子）按 STORAGE_COMPRESSION 压缩为 BLOB，
+读取时仅在访问 Event.payload / Event.headers 时才解压（编解码见 app.codecs）。
+zstd 可使用按事件源训练的字典，对结构相似的小 JSON 压缩率明显更高。
+
+存量数据迁移：
+    python -m app.storage train      # 为各事件源训练 zstd 字典（可选）
+    python -m app.storage backfill   # 压缩已有的明文记录
+"""
+import argparse
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, undefer_group
+
+from app import codecs
+from app.models import CompressionDict, Event, SessionLocal, init_db
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖
+    zstandard = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def backfill(batch_size: int = 500, session_factory=SessionLocal) -> Dict[str, int]:
+    """
+    压缩存量明文事件（按 id 分批提交，可随时中断后重跑）
+
+    Returns:
+        处理条数与压缩前后字节数
+    """
+    result = {"events": 0, "compressed": 0, "bytes_before": 0, "bytes_after": 0}
+    if codecs.configured_codec() is None:
+        raise RuntimeError("STORAGE_COMPRESSION is 'none'; set it to zlib or zstd first")
+
+    after_id = 0
+    while True:
+        db: Session = session_factory()
+        try:
+            events: List[Event] = (
+                db.query(Event)
+                .filter(Event.id > after_id, Event.codec.is_(None))
+                .order_by(Event.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not events:
+                break
+            for event in events:
+                before = len((event.payload_text or "").encode()) + len((event.headers_text or "").encode())
+                if event.compress(db.connection()):
+                    result["compressed"] += 1
+                    result["bytes_before"] += before
+                    result["bytes_after"] += len(event.payload_blob) + len(event.headers_blob or b"")
+                result["events"] += 1
+            after_id = events[-1].id
+            db.commit()
+        finally:
+            db.close()
+    return result
+
+
+def train_dictionaries(
+    sources: Optional[List[str]] = None,
+    max_samples: int = 2000,
+    dict_size: int = 112 * 1024,
+    session_factory=SessionLocal
+) -> Dict[str, Tuple[int, int]]:
+    """
+    为各事件源训练 zstd 字典（取最近的 max_samples 条 payload 作为样本）
+
+    Returns:
+        {source: (字典ID, 样本数)}
+    """
+    if zstandard is None:
+        raise RuntimeError("Dictionary training requires the 'zstandard' package")
+
+    db: Session = session_factory()
+    trained = {}
+    try:
+        if sources is None:
+            sources = [row[0] for row in db.query(Event.source).distinct().all()]
+        for source in sources:
+            events = (
+                db.query(Event)
+                .options(undefer_group("body"))
+                .filter(Event.source == source)
+                .order_by(Event.id.desc())
+                .limit(max_samples)
+                .all()
+            )
+            samples = [event.payload.encode("utf-8") for event in events if event.payload]
+            if len(samples) < 10:
+                logger.info("skip %s: not enough samples (%d)", source, len(samples))
+                continue
+            dictionary = zstandard.train_dictionary(dict_size, samples)
+            db.query(CompressionDict).filter(CompressionDict.source == source).update(
+                {"active": False}, synchronize_session=False
+            )
+            record = CompressionDict(
+                source=source, data=dictionary.as_bytes(), sample_count=len(samples), active=True
+            )
+            db.add(record)
+            db.commit()
+            trained[source] = (record.id, len(samples))
+        codecs.reload_dictionaries(db.connection())
+    finally:
+        db.close()
+    return trained
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event payload compression tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    backfill_parser = sub.add_parser("backfill", help="compress existing plain-text events")
+    backfill_parser.add_argument("--batch-size", type=int, default=500)
+
+    train_parser = sub.add_parser("train", help="train per-source zstd dictionaries")
+    train_parser.add_argument("--source", action="append", dest="sources")
+    train_parser.add_argument("--samples", type=int, default=2000)
+    train_parser.add_argument("--dict-size", type=int, default=112 * 1024)
+
+    args = parser.parse_args()
+    init_db()
+
+    if args.command == "backfill":
+        result = backfill(batch_size=args.batch_size)
+        ratio = result["bytes_after"] / result["bytes_before"] if result["bytes_before"] else 1.0
+        print(
+            f"✓ scanned {result['events']} events, compressed {result['compressed']}: "
+            f"{result['bytes_before']} -> {result['bytes_after']} bytes ({ratio:.1%})"
+        )
+        print("  run VACUUM (SQLite) to return freed pages to the filesystem")
+    elif args.command == "train":
+        trained = train_dictionaries(args.sources, args.samples, args.dict_size)
+        for source, (dict_id, samples) in trained.items():
+            print(f"✓ {source}: dictionary #{dict_id} from {samples} samples")
+        if not trained:
+            print("no dictionaries trained")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,25 +4,27 @@ Webhook 处理器
 import json
 from typing import Optional, Dict, Any
 from fastapi import Request, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models import Event, EventCreate
 from app.verifiers import WebhookVerifier
 from app.settings import settings
-from app.forwarder import EventForwarder
+from app.ingest import ingest_event
+from app.dedup import normalize_delivery_id
+from app.metrics import stage_seconds
 
 
 class WebhookHandler:
     """Webhook 处理器"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
-        self.forwarder = EventForwarder()
     
     async def handle_github(self, request: Request) -> Dict[str, Any]:
         """处理 GitHub Webhook"""
         # 读取原始 payload
-        payload = await request.body()
+        with stage_seconds.time("body_read", "github"):
+            payload = await request.body()
         
         # 获取签名
         signature = request.headers.get('X-Hub-Signature-256', '')
@@ -31,11 +33,12 @@ class WebhookHandler:
         # 验证签名
         signature_valid = False
         if settings.GITHUB_WEBHOOK_SECRET:
-            signature_valid = WebhookVerifier.verify_github(
-                payload,
-                signature,
-                settings.GITHUB_WEBHOOK_SECRET
-            )
+            with stage_seconds.time("verify", "github"):
+                signature_valid = WebhookVerifier.verify_github(
+                    payload,
+                    signature,
+                    settings.GITHUB_WEBHOOK_SECRET
+                )
         else:
             # 如果未配置密钥，跳过验证（仅用于开发）
             signature_valid = True
@@ -45,7 +48,8 @@ class WebhookHandler:
         
         # 解析 payload
         try:
-            payload_json = json.loads(payload)
+            with stage_seconds.time("parse", "github"):
+                payload_json = json.loads(payload)
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Invalid JSON payload")
         
@@ -55,36 +59,34 @@ class WebhookHandler:
             event_type=event_type,
             payload=payload.decode('utf-8'),
             headers=json.dumps(dict(request.headers)),
-            signature_valid=signature_valid
+            signature_valid=signature_valid,
+            delivery_id=normalize_delivery_id(request.headers.get('X-GitHub-Delivery'))
         )
-        self.db.add(event)
-        self.db.commit()
-        self.db.refresh(event)
-        
-        # 异步转发
-        if settings.FORWARD_ENABLED and settings.FORWARD_URL:
-            await self.forwarder.forward_event(event, settings.FORWARD_URL)
+        result = await ingest_event(self.db, event)
         
         return {
             "success": True,
-            "event_id": event.id,
+            "event_id": result.event_id,
+            "duplicate": result.duplicate,
             "source": "github",
             "event_type": event_type
         }
     
     async def handle_stripe(self, request: Request) -> Dict[str, Any]:
         """处理 Stripe Webhook"""
-        payload = await request.body()
+        with stage_seconds.time("body_read", "stripe"):
+            payload = await request.body()
         signature = request.headers.get('Stripe-Signature', '')
         
         # 验证签名
         signature_valid = False
         if settings.STRIPE_WEBHOOK_SECRET:
-            signature_valid = WebhookVerifier.verify_stripe(
-                payload,
-                signature,
-                settings.STRIPE_WEBHOOK_SECRET
-            )
+            with stage_seconds.time("verify", "stripe"):
+                signature_valid = WebhookVerifier.verify_stripe(
+                    payload,
+                    signature,
+                    settings.STRIPE_WEBHOOK_SECRET
+                )
         else:
             signature_valid = True
         
@@ -93,7 +95,8 @@ class WebhookHandler:
         
         # 解析 payload
         try:
-            payload_json = json.loads(payload)
+            with stage_seconds.time("parse", "stripe"):
+                payload_json = json.loads(payload)
             event_type = payload_json.get('type', 'unknown')
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Invalid JSON payload")
@@ -104,36 +107,34 @@ class WebhookHandler:
             event_type=event_type,
             payload=payload.decode('utf-8'),
             headers=json.dumps(dict(request.headers)),
-            signature_valid=signature_valid
+            signature_valid=signature_valid,
+            delivery_id=normalize_delivery_id(payload_json.get('id'))
         )
-        self.db.add(event)
-        self.db.commit()
-        self.db.refresh(event)
-        
-        # 异步转发
-        if settings.FORWARD_ENABLED and settings.FORWARD_URL:
-            await self.forwarder.forward_event(event, settings.FORWARD_URL)
+        result = await ingest_event(self.db, event)
         
         return {
             "success": True,
-            "event_id": event.id,
+            "event_id": result.event_id,
+            "duplicate": result.duplicate,
             "source": "stripe",
             "event_type": event_type
         }
     
     async def handle_custom(self, request: Request) -> Dict[str, Any]:
         """处理自定义 Webhook"""
-        payload = await request.body()
+        with stage_seconds.time("body_read", "custom"):
+            payload = await request.body()
         signature = request.headers.get('X-Signature', '')
         
         # 验证签名
         signature_valid = False
         if settings.CUSTOM_WEBHOOK_SECRET:
-            signature_valid = WebhookVerifier.verify_custom(
-                payload,
-                signature,
-                settings.CUSTOM_WEBHOOK_SECRET
-            )
+            with stage_seconds.time("verify", "custom"):
+                signature_valid = WebhookVerifier.verify_custom(
+                    payload,
+                    signature,
+                    settings.CUSTOM_WEBHOOK_SECRET
+                )
         else:
             signature_valid = True
         
@@ -142,7 +143,8 @@ class WebhookHandler:
         
         # 解析 payload
         try:
-            payload_json = json.loads(payload)
+            with stage_seconds.time("parse", "custom"):
+                payload_json = json.loads(payload)
             event_type = payload_json.get('event', 'unknown')
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Invalid JSON payload")
@@ -153,19 +155,15 @@ class WebhookHandler:
             event_type=event_type,
             payload=payload.decode('utf-8'),
             headers=json.dumps(dict(request.headers)),
-            signature_valid=signature_valid
+            signature_valid=signature_valid,
+            delivery_id=normalize_delivery_id(request.headers.get(settings.CUSTOM_DELIVERY_ID_HEADER))
         )
-        self.db.add(event)
-        self.db.commit()
-        self.db.refresh(event)
-        
-        # 异步转发
-        if settings.FORWARD_ENABLED and settings.FORWARD_URL:
-            await self.forwarder.forward_event(event, settings.FORWARD_URL)
+        result = await ingest_event(self.db, event)
         
         return {
             "success": True,
-            "event_id": event.id,
+            "event_id": result.event_id,
+            "duplicate": result.duplicate,
             "source": "custom",
             "event_type": event_type
         }
@@ -0,0 +1,418 @@
+"""
+入库压测
+
+启动一个 Event Relay Hub 实例（独立进程、临时 SQLite 库）和一个本地替身转发接收端
+（可配置延迟与错误率），以目标速率发送带正确签名的 GitHub / Stripe / 自定义 Webhook，
+报告入库延迟 p50 / p95 / p99、实际吞吐、转发吞吐与数据库增长，用于版本间对比入库能力。
+
+    python scripts/loadtest.py --rate 200 --duration 30
+    python scripts/loadtest.py --rate 500 --ingest-mode batch --receiver-latency-ms 50 --json result.json
+
+替身接收端也可单独启动：
+    python scripts/loadtest.py receiver --port 9100 --latency-ms 20 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from app.verifiers import WebhookVerifier  # noqa: E402
+
+
+SECRETS = {
+    "github": "loadtest-github-secret",
+    "stripe": "whsec_loadtest",
+    "custom": "loadtest-custom-secret",
+}
+
+
+# ---------------------------------------------------------------------------
+# 替身转发接收端（纯 ASGI，尽量不引入额外开销）
+# ---------------------------------------------------------------------------
+
+class Receiver:
+    """记录收到的转发请求，按配置延迟响应并随机返回 500"""
+
+    def __init__(self, latency_ms: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.received = 0
+        self.failed = 0
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        while True:
+            message = await receive()
+            if not message.get("more_body"):
+                break
+
+        if scope["method"] == "GET":
+            body = json.dumps({
+                "received": self.received,
+                "failed": self.failed,
+                "first": self.first,
+                "last": self.last,
+            }).encode()
+            status = 200
+        else:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            now = time.time()
+            self.first = self.first or now
+            self.last = now
+            if random.random() < self.error_rate:
+                self.failed += 1
+                status, body = 500, b'{"error": "injected"}'
+            else:
+                self.received += 1
+                status, body = 200, b'{"ok": true}'
+
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def run_receiver(port: int, latency_ms: float, error_rate: float):
+    import uvicorn
+    uvicorn.run(Receiver(latency_ms, error_rate), host="127.0.0.1", port=port, log_level="warning")
+
+
+# ---------------------------------------------------------------------------
+# 请求构造
+# ---------------------------------------------------------------------------
+
+def _filler(size: int) -> str:
+    return "x" * max(0, size)
+
+
+def build_request(source: str, payload_bytes: int) -> Tuple[str, bytes, Dict[str, str]]:
+    """构造一条带正确签名的 Webhook 请求：(路径, 请求体, 请求头)"""
+    delivery = uuid.uuid4().hex
+    if source == "github":
+        body = json.dumps({
+            "ref": "refs/heads/main",
+            "repository": {"id": random.randint(1, 50), "full_name": f"octo/repo-{random.randint(1, 50)}"},
+            "padding": _filler(payload_bytes - 120),
+        }).encode()
+        signature = "sha256=" + WebhookVerifier.generate_signature(body, SECRETS["github"])
+        headers = {"X-GitHub-Event": "push", "X-GitHub-Delivery": delivery, "X-Hub-Signature-256": signature}
+        return "/webhook/github", body, headers
+
+    if source == "stripe":
+        body = json.dumps({
+            "id": f"evt_{delivery}",
+            "type": random.choice(["charge.succeeded", "charge.failed", "invoice.paid"]),
+            "data": {"object": {"id": f"ch_{random.randint(1, 1000)}", "customer": f"cus_{random.randint(1, 200)}"}},
+            "padding": _filler(payload_bytes - 160),
+        }).encode()
+        timestamp = str(int(time.time()))
+        signed = WebhookVerifier.generate_signature(f"{timestamp}.".encode() + body, SECRETS["stripe"])
+        return "/webhook/stripe", body, {"Stripe-Signature": f"t={timestamp},v1={signed}"}
+
+    body = json.dumps({"event": "loadtest.tick", "n": random.random(), "padding": _filler(payload_bytes - 60)}).encode()
+    signature = WebhookVerifier.generate_signature(body, SECRETS["custom"])
+    return "/webhook/custom", body, {"X-Signature": signature, "X-Delivery-Id": delivery}
+
+
+def parse_mix(mix: str) -> List[Tuple[str, float]]:
+    weights = []
+    for item in mix.split(","):
+        source, _, weight = item.partition("=")
+        if source not in SECRETS:
+            raise ValueError(f"Unknown source in --mix: {source}")
+        weights.append((source, float(weight or 1)))
+    return weights
+
+
+# ---------------------------------------------------------------------------
+# 进程管理
+# ---------------------------------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not become ready within {timeout:.0f}s")
+
+
+def start_hub(args, port: int, receiver_url: str, db_path: Path) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "INGEST_MODE": args.ingest_mode,
+        "FORWARD_ENABLED": "True" if args.forward else "False",
+        "FORWARD_URL": receiver_url,
+        "FORWARD_WORKERS": str(args.forward_workers),
+        "RATE_LIMIT_ENABLED": "False",
+        "RETENTION_INTERVAL_SECONDS": "0",
+        "GITHUB_WEBHOOK_SECRET": SECRETS["github"],
+        "STRIPE_WEBHOOK_SECRET": SECRETS["stripe"],
+        "CUSTOM_WEBHOOK_SECRET": SECRETS["custom"],
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=str(ROOT), env=env
+    )
+
+
+def start_receiver(args, port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), "receiver", "--port", str(port),
+         "--latency-ms", str(args.receiver_latency_ms), "--error-rate", str(args.receiver_error_rate)],
+        cwd=str(ROOT)
+    )
+
+
+def db_size(db_path: Path) -> int:
+    return sum(
+        path.stat().st_size for path in (db_path, Path(f"{db_path}-wal"), Path(f"{db_path}-shm"))
+        if path.exists()
+    )
+
+
+def stop(process: Optional[subprocess.Popen]):
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# ---------------------------------------------------------------------------
+# 压测驱动
+# ---------------------------------------------------------------------------
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def drive(hub_url: str, rate: float, duration: float, concurrency: int,
+                mix: List[Tuple[str, float]], payload_bytes: int) -> Dict:
+    """
+    开环发压：按固定间隔发出请求，不等待上一个请求完成（并发上限 concurrency），
+    因此服务变慢时延迟如实上升，而不是自动降低发送速率。
+    """
+    sources = [source for source, _ in mix]
+    weights = [weight for _, weight in mix]
+    latencies: Dict[str, List[float]] = {source: [] for source in sources}
+    statuses: Dict[str, int] = {}
+    skipped = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=hub_url, limits=limits, timeout=30.0) as client:
+        async def one(source: str):
+            path, body, headers = build_request(source, payload_bytes)
+            headers["Content-Type"] = "application/json"
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, content=body, headers=headers)
+                key = str(response.status_code)
+            except httpx.HTTPError as e:
+                key = type(e).__name__
+            finally:
+                semaphore.release()
+            latencies[source].append(time.perf_counter() - started)
+            statuses[key] = statuses.get(key, 0) + 1
+
+        tasks = []
+        interval = 1.0 / rate
+        started = time.perf_counter()
+        total = int(rate * duration)
+        for i in range(total):
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if semaphore.locked():
+                skipped += 1  # 并发已满：记为丢弃，保持发送节奏
+                continue
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(one(random.choices(sources, weights)[0])))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "requests": len(all_latencies),
+        "skipped": skipped,
+        "elapsed": elapsed,
+        "statuses": statuses,
+        "latencies": latencies,
+        "all": all_latencies,
+    }
+
+
+def wait_forwarded(receiver_url: str, expected: int, timeout: float) -> Dict:
+    """等待转发排空（收到 expected 条或 timeout 秒内不再增长）"""
+    deadline = time.monotonic() + timeout
+    last_count, last_change = -1, time.monotonic()
+    stats = {}
+    while time.monotonic() < deadline:
+        stats = httpx.get(receiver_url, timeout=5.0).json()
+        count = stats["received"]
+        if count >= expected:
+            break
+        if count != last_count:
+            last_count, last_change = count, time.monotonic()
+        elif time.monotonic() - last_change > 5.0:
+            break
+        time.sleep(0.2)
+    return stats
+
+
+def summarize(result: Dict, forwarded: Optional[Dict], size_before: int, size_after: int) -> Dict:
+    ok = sum(count for status, count in result["statuses"].items() if status.startswith("2"))
+    ms = lambda value: round(value * 1000, 2)  # noqa: E731
+    report = {
+        "requests": result["requests"],
+        "succeeded": ok,
+        "skipped": result["skipped"],
+        "statuses": result["statuses"],
+        "ingest_rps": round(ok / result["elapsed"], 1) if result["elapsed"] else 0.0,
+        "latency_ms": {
+            "p50": ms(percentile(result["all"], 50)),
+            "p95": ms(percentile(result["all"], 95)),
+            "p99": ms(percentile(result["all"], 99)),
+            "max": ms(max(result["all"], default=0.0)),
+        },
+        "latency_ms_by_source": {
+            source: {"p50": ms(percentile(values, 50)), "p99": ms(percentile(values, 99))}
+            for source, values in result["latencies"].items() if values
+        },
+        "db_bytes_before": size_before,
+        "db_bytes_after": size_after,
+        "db_bytes_per_event": round((size_after - size_before) / ok, 1) if ok else 0.0,
+    }
+    if forwarded is not None:
+        span = (forwarded["last"] - forwarded["first"]) if forwarded.get("first") else 0.0
+        report["forwarded"] = forwarded["received"]
+        report["forward_errors_injected"] = forwarded["failed"]
+        report["forward_rps"] = round(forwarded["received"] / span, 1) if span > 0 else 0.0
+    return report
+
+
+def print_report(report: Dict):
+    latency = report["latency_ms"]
+    print(f"requests        {report['requests']} ({report['succeeded']} ok, {report['skipped']} skipped)")
+    print(f"statuses        {report['statuses']}")
+    print(f"ingest          {report['ingest_rps']} req/s")
+    print(f"latency (ms)    p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    for source, values in report["latency_ms_by_source"].items():
+        print(f"  {source:<13} p50 {values['p50']}  p99 {values['p99']}")
+    if "forwarded" in report:
+        print(f"forwarded       {report['forwarded']} ({report['forward_rps']} req/s, "
+              f"{report['forward_errors_injected']} injected errors)")
+    growth = report["db_bytes_after"] - report["db_bytes_before"]
+    print(f"db growth       {growth / 1024:.1f} KiB ({report['db_bytes_per_event']} bytes/event)")
+
+
+def run(args):
+    hub_port, receiver_port = free_port(), free_port()
+    hub_url = f"http://127.0.0.1:{hub_port}"
+    receiver_url = f"http://127.0.0.1:{receiver_port}"
+    workdir = Path(tempfile.mkdtemp(prefix="relay-loadtest-"))
+    db_path = workdir / "event_hub.db"
+    receiver = hub = None
+    try:
+        receiver = start_receiver(args, receiver_port)
+        wait_ready(receiver_url)
+        hub = start_hub(args, hub_port, f"{receiver_url}/hook", db_path)
+        wait_ready(f"{hub_url}/api/health")
+        size_before = db_size(db_path)
+
+        print(f"▶ {args.rate:g} req/s for {args.duration:g}s against {hub_url} "
+              f"(ingest={args.ingest_mode}, forward={'on' if args.forward else 'off'})")
+        result = asyncio.run(drive(
+            hub_url, args.rate, args.duration, args.concurrency, parse_mix(args.mix), args.payload_bytes
+        ))
+
+        forwarded = None
+        if args.forward:
+            ok = sum(count for status, count in result["statuses"].items() if status.startswith("2"))
+            forwarded = wait_forwarded(receiver_url, ok, args.drain_timeout)
+
+        stop(hub)  # 关闭后 WAL 已合并回主库，文件大小反映真实增长
+        report = summarize(result, forwarded, size_before, db_size(db_path))
+        report["config"] = {key: value for key, value in vars(args).items() if key not in ("command", "json")}
+        print_report(report)
+        if args.json:
+            Path(args.json).write_text(json.dumps(report, indent=2))
+            print(f"✓ report written to {args.json}")
+    finally:
+        stop(hub)
+        stop(receiver)
+        if not args.keep_db:
+            for path in workdir.glob("*"):
+                path.unlink()
+            workdir.rmdir()
+        else:
+            print(f"database kept at {db_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event Relay Hub ingest load test")
+    sub = parser.add_subparsers(dest="command")
+
+    receiver = sub.add_parser("receiver", help="run only the stand-in forward receiver")
+    receiver.add_argument("--port", type=int, default=9100)
+    receiver.add_argument("--latency-ms", type=float, default=0.0)
+    receiver.add_argument("--error-rate", type=float, default=0.0)
+
+    parser.add_argument("--rate", type=float, default=100.0, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to send load")
+    parser.add_argument("--concurrency", type=int, default=256, help="max in-flight requests")
+    parser.add_argument("--mix", default="github=1,stripe=1,custom=1", help="source weights")
+    parser.add_argument("--payload-bytes", type=int, default=1024, help="approximate payload size")
+    parser.add_argument("--ingest-mode", choices=["direct", "batch"], default="direct")
+    parser.add_argument("--no-forward", dest="forward", action="store_false", help="disable forwarding")
+    parser.add_argument("--forward-workers", type=int, default=4)
+    parser.add_argument("--receiver-latency-ms", type=float, default=10.0)
+    parser.add_argument("--receiver-error-rate", type=float, default=0.0)
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="seconds to wait for forwards")
+    parser.add_argument("--keep-db", action="store_true", help="keep the temporary database")
+    parser.add_argument("--json", help="write the report as JSON to this path")
+
+    args = parser.parse_args()
+    if args.command == "receiver":
+        run_receiver(args.port, args.latency_ms, args.error_rate)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
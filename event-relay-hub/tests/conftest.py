@@ -0,0 +1,31 @@
+"""
+测试公共夹具
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Base
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """每个测试独立的临时 SQLite 数据库"""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'event_hub.db'}",
+        connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def async_session_factory(tmp_path, session_factory):
+    """与 session_factory 同一个临时库的异步会话（请求处理使用）"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'event_hub.db'}")
+    yield async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    asyncio.run(engine.dispose())
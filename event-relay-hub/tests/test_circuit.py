@@ -0,0 +1,154 @@
+"""
+转发熔断测试
+"""
+import asyncio
+from datetime import datetime
+
+import httpx
+from fastapi.testclient import TestClient
+
+from app import main
+from app.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakerRegistry
+from app.forwarder import EventForwarder, ForwardClientPool, ForwardResult, TargetGates
+from app.models import Event, ForwardOutbox
+from app.outbox import ForwardQueue
+from app.settings import settings
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingPool(ForwardClientPool):
+    def __init__(self, status_code):
+        super().__init__()
+        self.status_code = status_code
+        self.requests = 0
+
+    def _create_client(self):
+        def handler(request):
+            self.requests += 1
+            return httpx.Response(self.status_code)
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def _configure(monkeypatch):
+    monkeypatch.setattr(settings, "CIRCUIT_MIN_REQUESTS", 4)
+    monkeypatch.setattr(settings, "CIRCUIT_FAILURE_RATE", 0.5)
+    monkeypatch.setattr(settings, "CIRCUIT_OPEN_SECONDS", 30)
+    monkeypatch.setattr(settings, "CIRCUIT_SLOW_CALL_SECONDS", 2.0)
+    monkeypatch.setattr(settings, "CIRCUIT_HALF_OPEN_PROBES", 1)
+
+
+def test_breaker_opens_probes_and_recovers(monkeypatch):
+    _configure(monkeypatch)
+    clock = FakeClock()
+    breaker = CircuitBreaker("http://consumer.local", clock)
+
+    for failed, elapsed in [(False, 0.1), (False, 3.0), (True, 0.1)]:
+        assert breaker.allow()
+        breaker.record(failed, elapsed)
+    assert breaker.state == CLOSED  # 请求数不足 CIRCUIT_MIN_REQUESTS
+    breaker.record(False, 2.5)  # 慢调用同样计为失败（3 / 4）
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+    clock.now += 31
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # 只放行一个探测
+    breaker.record(True, 0.1, probe=True)
+    assert breaker.state == OPEN
+
+    clock.now += 31
+    assert breaker.allow()
+    breaker.record(False, 0.1)  # 熔断前发出的请求晚到，不影响状态
+    assert breaker.state == HALF_OPEN
+    breaker.record(False, 0.1, probe=True)
+    assert breaker.state == CLOSED
+
+
+def test_open_circuit_skips_request(session_factory, monkeypatch):
+    """熔断后不再发出请求，结果带 retry_after；4xx 不触发熔断"""
+    _configure(monkeypatch)
+    event = Event(id=1, source="custom", event_type="test", payload="{}")
+    down = CountingPool(503)
+    forwarder = EventForwarder(session_factory, down, TargetGates(), CircuitBreakerRegistry())
+
+    async def run(forwarder):
+        return [await forwarder.send(event, "http://down.local/hook") for _ in range(6)]
+
+    results = asyncio.run(run(forwarder))
+    assert down.requests == 4
+    assert all(29 < result.retry_after <= 30 for result in results[4:])
+    assert results[-1].error_message == "Circuit open"
+
+    rejecting = CountingPool(400)
+    asyncio.run(run(EventForwarder(session_factory, rejecting, TargetGates(), CircuitBreakerRegistry())))
+    assert rejecting.requests == 6
+
+
+def test_queue_defers_without_consuming_attempts(session_factory):
+    """熔断拒绝的记录按 retry_after 延后，不计入重试次数也不写转发日志"""
+    class OpenCircuitForwarder:
+        def __init__(self):
+            self.records = []
+
+        def record(self, results):
+            self.records.extend(results)
+
+        async def send(self, event, target_url):
+            return ForwardResult(success=False, error_message="Circuit open", retry_after=30)
+
+    db = session_factory()
+    try:
+        event = Event(source="custom", event_type="test", payload="{}")
+        db.add(event)
+        db.flush()
+        ForwardQueue.enqueue(db, event, "http://down.local/hook")
+        db.commit()
+    finally:
+        db.close()
+    forwarder = OpenCircuitForwarder()
+    queue = ForwardQueue(workers=1, forwarder=forwarder, session_factory=session_factory)
+
+    async def run():
+        await queue.start()
+        await asyncio.sleep(0.2)
+        await queue.stop()
+
+    asyncio.run(run())
+
+    db = session_factory()
+    try:
+        entry = db.query(ForwardOutbox).one()
+        assert entry.status == "pending"
+        assert entry.attempts == 0
+        assert entry.last_error == "Circuit open"
+        assert (entry.available_at - datetime.utcnow()).total_seconds() > 20
+        assert forwarder.records == []
+    finally:
+        db.close()
+
+
+def test_circuits_api(monkeypatch):
+    _configure(monkeypatch)
+    registry = CircuitBreakerRegistry()
+    for _ in range(4):
+        registry.get("http://down.local/a").record(True, 0.1)
+    registry.get("http://up.local/b").record(False, 0.2)
+    monkeypatch.setattr(main, "circuit_breakers", registry)
+
+    circuits = {item["host"]: item for item in TestClient(main.app).get("/api/forward/circuits").json()}
+
+    assert circuits["http://down.local"]["state"] == "open"
+    assert circuits["http://down.local"]["retry_at"] is not None
+    assert circuits["http://up.local"] == {
+        "host": "http://up.local", "state": "closed", "requests": 1,
+        "failure_rate": 0.0, "avg_latency": 0.2, "retry_at": None,
+    }
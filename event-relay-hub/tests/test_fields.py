@@ -0,0 +1,80 @@
+"""
+payload 字段索引测试
+"""
+import json
+
+from fastapi.testclient import TestClient
+
+from app import fields
+from app.fields import FieldExtractor
+from app.ingest import persist_events
+from app.main import app
+from app.models import Event, EventField, get_async_db
+from app.settings import settings
+
+
+def test_extractor_resolves_dotted_paths():
+    extractor = FieldExtractor({
+        "stripe": {"customer": "data.object.customer", "missing": "data.nope.x"},
+        "*": {"tag": "tags", "first_item": "items.0.sku"},
+    })
+    payload = json.dumps({
+        "data": {"object": {"customer": "cus_123"}},
+        "tags": ["a", "b", {"nested": 1}],
+        "items": [{"sku": 42}],
+    })
+
+    assert sorted(extractor.extract("stripe", payload)) == [
+        ("customer", "cus_123"), ("first_item", "42"), ("tag", "a"), ("tag", "b")
+    ]
+    assert extractor.extract("github", "not json") == []
+    assert extractor.extract("unknown", "{}") == []
+
+
+def test_events_filtered_by_indexed_field(session_factory, async_session_factory, monkeypatch):
+    """入库时写入字段索引，/api/events?field.* 按索引过滤，未配置的字段返回 400"""
+    monkeypatch.setattr(fields, "field_extractor", FieldExtractor(settings.FIELD_EXTRACTORS))
+    db = session_factory()
+    try:
+        persist_events(db, [
+            Event(source="stripe", event_type="charge.succeeded",
+                  payload=json.dumps({"data": {"object": {"customer": f"cus_{i % 3}"}}}))
+            for i in range(9)
+        ] + [Event(source="github", event_type="push",
+                   payload=json.dumps({"repository": {"full_name": "octo/hello"}}))])
+        db.commit()
+        assert db.query(EventField).count() == 10
+    finally:
+        db.close()
+
+    monkeypatch.setitem(app.dependency_overrides, get_async_db, lambda: (yield async_session_factory()))
+    client = TestClient(app)
+
+    customers = client.get("/api/events", params={"field.customer": "cus_1"}).json()
+    assert len(customers) == 3
+    assert {json.loads(event["payload"])["data"]["object"]["customer"] for event in customers} == {"cus_1"}
+
+    repos = client.get("/api/events", params={"field.repo": "octo/hello", "source": "github"}).json()
+    assert [event["source"] for event in repos] == ["github"]
+
+    assert client.get("/api/events", params={"field.nope": "x"}).status_code == 400
+
+
+def test_backfill_rebuilds_fields(session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "FIELD_EXTRACTORS", {})
+    monkeypatch.setattr(fields, "field_extractor", FieldExtractor({}))
+    db = session_factory()
+    try:
+        persist_events(db, [Event(source="github", payload=json.dumps({"repository": {"full_name": "a/b"}}))])
+        db.commit()
+        assert db.query(EventField).count() == 0
+    finally:
+        db.close()
+
+    monkeypatch.setattr(settings, "FIELD_EXTRACTORS", {"github": {"repo": "repository.full_name"}})
+    assert fields.backfill(session_factory=session_factory) == 1
+    db = session_factory()
+    try:
+        assert [(row.field, row.value) for row in db.query(EventField)] == [("repo", "a/b")]
+    finally:
+        db.close()
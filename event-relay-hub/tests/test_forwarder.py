@@ -0,0 +1,99 @@
+"""
+转发器测试
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.forwarder import EventForwarder, ForwardClientPool
+from app.models import BulkReplayRequest, Event, ForwardLog
+from app.replay import BulkReplayer
+
+
+class MockPool(ForwardClientPool):
+    """使用 MockTransport 的客户端池，记录收到的请求"""
+
+    def __init__(self, status_code=200):
+        super().__init__()
+        self.status_code = status_code
+        self.requests = []
+
+    def _create_client(self):
+        def handler(request):
+            self.requests.append(request)
+            return httpx.Response(self.status_code)
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_client_pool_reuses_client_per_host():
+    """同一目标主机复用客户端，不同主机各自独立"""
+    pool = ForwardClientPool()
+
+    async def run():
+        first = pool.get("https://consumer.example.com/hooks/a")
+        second = pool.get("https://consumer.example.com/hooks/b")
+        other = pool.get("https://other.example.com/hook")
+        assert first is second
+        assert first is not other
+        assert len(pool.hosts()) == 2
+
+        await pool.close()
+        assert first.is_closed
+        assert pool.hosts() == []
+
+    asyncio.run(run())
+
+
+def test_client_pool_recreates_client_for_new_loop():
+    """事件循环变化后不复用旧循环上的客户端，旧客户端被关闭"""
+    pool = ForwardClientPool()
+
+    async def get_client():
+        client = pool.get("http://localhost:9000/hook")
+        await asyncio.sleep(0.01)
+        return client
+
+    first = asyncio.run(get_client())
+    second = asyncio.run(get_client())
+    assert first is not second
+    assert first.is_closed
+    assert not second.is_closed
+
+
+def test_bulk_replay_filters_and_logs(session_factory):
+    """批量重放只转发命中过滤条件的事件，并批量写入转发日志"""
+    db = session_factory()
+    for i in range(30):
+        db.add(Event(
+            source="stripe" if i % 3 else "github",
+            event_type="charge.succeeded",
+            payload=f'{{"n": {i}}}'
+        ))
+    db.commit()
+    db.close()
+
+    pool = MockPool()
+    replayer = BulkReplayer(EventForwarder(session_factory, pool), session_factory)
+    request = BulkReplayRequest(
+        source="stripe", target_url="http://consumer.local/hook", concurrency=4, chunk_size=7
+    )
+
+    async def run():
+        items = [item async for item in replayer.run(request)]
+        await pool.close()
+        return items
+
+    items = asyncio.run(run())
+
+    assert items[0]["type"] == "start" and items[0]["total"] == 20
+    assert items[-1]["type"] == "done"
+    assert items[-1]["sent"] == 20 and items[-1]["succeeded"] == 20
+    assert len(pool.requests) == 20
+
+    db = session_factory()
+    try:
+        assert db.query(ForwardLog).filter(ForwardLog.success == True).count() == 20
+        assert db.query(Event).filter(Event.forwarded == True).count() == 20
+    finally:
+        db.close()
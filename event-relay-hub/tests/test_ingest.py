@@ -0,0 +1,218 @@
+"""
+事件入库测试
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import ingest, stats
+from app.dedup import RecentDeliveryCache, delivery_cache
+from app.ingest import BatchWriter, ingest_event, persist_events
+from app.main import app
+from app.models import Event, EventStatsBucket, ForwardOutbox, get_async_db
+from app.settings import settings
+
+
+def test_batch_writer_groups_commits(session_factory):
+    """并发提交的事件被合并为少量事务，每个调用方拿到各自的 ID"""
+    writer = BatchWriter(max_events=50, interval_ms=20, session_factory=session_factory)
+
+    async def run():
+        await writer.start()
+        try:
+            return await asyncio.gather(*[
+                writer.submit(Event(source="custom", event_type="bulk", payload=f'{{"n": {i}}}'))
+                for i in range(200)
+            ])
+        finally:
+            await writer.stop()
+
+    results = asyncio.run(run())
+    ids = [result.event_id for result in results]
+
+    assert len(set(ids)) == 200
+    assert writer.events_committed == 200
+    assert writer.batches_committed <= 10
+
+    db = session_factory()
+    try:
+        assert db.query(Event).count() == 200
+    finally:
+        db.close()
+
+
+def test_batch_writer_isolates_bad_event(session_factory):
+    """单条坏数据只让自己的调用方失败"""
+    writer = BatchWriter(max_events=10, interval_ms=50, session_factory=session_factory)
+
+    async def run():
+        await writer.start()
+        try:
+            return await asyncio.gather(
+                writer.submit(Event(source="custom", payload='{"ok": 1}')),
+                writer.submit(Event(source=None, payload='{"bad": 1}')),
+                writer.submit(Event(source="custom", payload='{"ok": 2}')),
+                return_exceptions=True
+            )
+        finally:
+            await writer.stop()
+
+    first, bad, last = asyncio.run(run())
+
+    assert isinstance(first.event_id, int) and isinstance(last.event_id, int)
+    assert isinstance(bad, Exception)
+
+
+def test_batch_writer_stop_drains_queue(session_factory):
+    """停止标记之后入队的事件也会写完，停止后提交直接失败"""
+    writer = BatchWriter(max_events=10, interval_ms=50, session_factory=session_factory)
+
+    async def run():
+        await writer.start()
+        first = asyncio.ensure_future(writer.submit(Event(source="custom", payload='{"n": 1}')))
+        await asyncio.sleep(0)
+        await writer._queue.put(None)  # 模拟停止标记先于后续提交入队
+        late = asyncio.ensure_future(writer.submit(Event(source="custom", payload='{"n": 2}')))
+        await asyncio.sleep(0)
+        await writer.stop()
+        with pytest.raises(RuntimeError):
+            await writer.submit(Event(source="custom", payload='{"n": 3}'))
+        return await first, await late
+
+    first, late = asyncio.run(run())
+
+    assert first.event_id != late.event_id
+    db = session_factory()
+    try:
+        assert db.query(Event).count() == 2
+    finally:
+        db.close()
+
+
+def test_stats_rollup_matches_events(session_factory):
+    """入库时维护的汇总与全表统计一致，重建结果相同"""
+    now = datetime.utcnow()
+    db = session_factory()
+    try:
+        persist_events(db, [
+            Event(source="github", event_type="push", payload="{}", signature_valid=True,
+                  created_at=now - timedelta(hours=30)),
+            Event(source="github", event_type="push", payload="{}", signature_valid=True,
+                  created_at=now - timedelta(hours=2)),
+            Event(source="stripe", event_type="charge.succeeded", payload="{}", signature_valid=True,
+                  created_at=now - timedelta(minutes=5)),
+            Event(source="custom", event_type=None, payload="{}", signature_valid=False,
+                  created_at=now),
+        ])
+        db.commit()
+
+        result = stats.compute_stats(db)
+        assert result.total_events == 4
+        assert result.by_source == {"github": 2, "stripe": 1, "custom": 1}
+        assert result.by_event_type == {"push": 2, "charge.succeeded": 1}
+        assert result.recent_24h == 3
+        assert result.signature_success_rate == 75.0
+
+        rows_before = db.query(EventStatsBucket).count()
+        assert stats.rebuild(db) == 4
+        assert db.query(EventStatsBucket).count() == rows_before
+        assert stats.compute_stats(db) == result
+    finally:
+        db.close()
+
+
+def test_github_redelivery_is_acknowledged_once(session_factory, async_session_factory, monkeypatch):
+    """相同 X-GitHub-Delivery 的重投只确认，不再入库也不再转发"""
+    monkeypatch.setattr(settings, "GITHUB_WEBHOOK_SECRET", None)
+    monkeypatch.setattr(settings, "FORWARD_ENABLED", True)
+    monkeypatch.setattr(settings, "FORWARD_URL", "http://target.test/hook")
+    monkeypatch.setitem(app.dependency_overrides, get_async_db, lambda: (yield async_session_factory()))
+    delivery_cache.clear()
+    client = TestClient(app)
+    headers = {"X-GitHub-Event": "push", "X-GitHub-Delivery": "d-42"}
+
+    first = client.post("/webhook/github", json={"n": 1}, headers=headers).json()
+    delivery_cache.clear()  # 绕过内存缓存，走数据库判重
+    second = client.post("/webhook/github", json={"n": 1}, headers=headers).json()
+    third = client.post("/webhook/github", json={"n": 1}, headers=headers).json()
+
+    assert first["duplicate"] is False
+    assert second == {**first, "duplicate": True}
+    assert third == {**first, "duplicate": True}
+
+    db = session_factory()
+    try:
+        assert db.query(Event).count() == 1
+        assert db.query(ForwardOutbox).count() == 1
+    finally:
+        db.close()
+        delivery_cache.clear()
+
+
+def test_duplicate_within_batch_resolves_to_first(session_factory):
+    """同一批次内重复的投递 ID 指向第一次出现的事件"""
+    db = session_factory()
+    try:
+        results = persist_events(db, [
+            Event(source="stripe", payload="{}", delivery_id="evt_1"),
+            Event(source="stripe", payload="{}", delivery_id="evt_1"),
+            Event(source="github", payload="{}", delivery_id="evt_1"),
+        ])
+        db.commit()
+
+        assert [result.duplicate for result in results] == [False, True, False]
+        assert results[1].event_id == results[0].event_id
+        assert results[2].event_id != results[0].event_id
+        assert db.query(Event).count() == 2
+    finally:
+        db.close()
+
+
+async def _ingest(async_session_factory, event):
+    async with async_session_factory() as db:
+        return await ingest_event(db, event)
+
+
+def test_ingest_event_recovers_from_unique_race(session_factory, async_session_factory, monkeypatch):
+    """查重后被并发写入抢先时，唯一索引冲突回退为重复确认"""
+    db = session_factory()
+    try:
+        persist_events(db, [Event(source="custom", payload="{}", delivery_id="race")])
+        db.commit()
+        winner = db.query(Event.id).scalar()
+
+        real_existing = ingest._existing_deliveries
+        calls = []
+
+        def stale_first_lookup(session, events):
+            calls.append(1)
+            return {} if len(calls) == 1 else real_existing(session, events)
+
+        monkeypatch.setattr(ingest, "_existing_deliveries", stale_first_lookup)
+        delivery_cache.clear()
+        result = asyncio.run(_ingest(async_session_factory, Event(source="custom", payload="{}", delivery_id="race")))
+
+        assert result.duplicate is True
+        assert result.event_id == winner
+        assert db.query(Event).count() == 1
+        assert delivery_cache.get("custom", "race") == winner
+    finally:
+        db.close()
+        delivery_cache.clear()
+
+
+def test_recent_delivery_cache_evicts_least_recent():
+    """缓存满时淘汰最久未访问的投递 ID"""
+    cache = RecentDeliveryCache(max_size=2)
+    cache.remember("github", "a", 1)
+    cache.remember("github", "b", 2)
+    assert cache.get("github", "a") == 1
+    cache.remember("github", "c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("github", "b") is None
+    assert cache.get("github", "a") == 1
+    assert cache.get("github", "c") == 3
+    assert cache.get("github", None) is None
@@ -0,0 +1,61 @@
+"""
+实时推送测试
+"""
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from app.live import EventBroadcaster
+from app.main import app
+from app.models import get_async_db
+from app.settings import settings
+
+
+def _item(event_id, source="github", event_type="push"):
+    return {"id": event_id, "source": source, "event_type": event_type}
+
+
+def test_subscribers_receive_only_matching_events():
+    hub = EventBroadcaster(max_subscribers=2)
+
+    async def run():
+        github = hub.subscribe(source="github")
+        charges = hub.subscribe(event_type="charge.succeeded")
+        hub.publish([_item(1), _item(2, "stripe", "charge.succeeded"), _item(3, "stripe", "refund")])
+        return await github.next_batch(0.1), await charges.next_batch(0.1)
+
+    github_items, charge_items = asyncio.run(run())
+    assert [item["id"] for item in github_items] == [1]
+    assert [item["id"] for item in charge_items] == [2]
+
+
+def test_slow_subscriber_buffer_is_bounded():
+    """缓冲满后丢弃最旧的消息并计数，不会无限增长"""
+    hub = EventBroadcaster()
+
+    async def run():
+        subscription = hub.subscribe(buffer_size=3)
+        hub.publish([_item(i) for i in range(10)])
+        return await subscription.next_batch(0.1), subscription.take_dropped()
+
+    items, dropped = asyncio.run(run())
+    assert [item["id"] for item in items] == [7, 8, 9]
+    assert dropped == 7
+
+
+def test_websocket_receives_ingested_events(session_factory, async_session_factory, monkeypatch):
+    """入库后的新事件按订阅过滤推送到 WebSocket（不含 payload）"""
+    monkeypatch.setattr(settings, "GITHUB_WEBHOOK_SECRET", None)
+    monkeypatch.setattr(settings, "STRIPE_WEBHOOK_SECRET", None)
+    monkeypatch.setitem(app.dependency_overrides, get_async_db, lambda: (yield async_session_factory()))
+    client = TestClient(app)
+
+    with client.websocket_connect("/ws/events?source=github") as websocket:
+        client.post("/webhook/stripe", json={"id": "evt_live", "type": "charge.succeeded"})
+        created = client.post("/webhook/github", json={"n": 1}, headers={"X-GitHub-Event": "push"}).json()
+        message = websocket.receive_json()
+
+    assert message["type"] == "event"
+    assert message["event"]["id"] == created["event_id"]
+    assert message["event"]["source"] == "github"
+    assert "payload" not in message["event"]
@@ -0,0 +1,41 @@
+"""
+压测脚本测试：构造的请求能通过签名校验
+"""
+import importlib.util
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models import get_async_db
+from app.settings import settings
+
+
+spec = importlib.util.spec_from_file_location(
+    "loadtest", Path(__file__).resolve().parent.parent / "scripts" / "loadtest.py"
+)
+loadtest = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(loadtest)
+
+
+@pytest.mark.parametrize("source", ["github", "stripe", "custom"])
+def test_generated_webhooks_are_signed(source, async_session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "GITHUB_WEBHOOK_SECRET", loadtest.SECRETS["github"])
+    monkeypatch.setattr(settings, "STRIPE_WEBHOOK_SECRET", loadtest.SECRETS["stripe"])
+    monkeypatch.setattr(settings, "CUSTOM_WEBHOOK_SECRET", loadtest.SECRETS["custom"])
+    monkeypatch.setitem(app.dependency_overrides, get_async_db, lambda: (yield async_session_factory()))
+
+    path, body, headers = loadtest.build_request(source, 512)
+    response = TestClient(app).post(path, content=body, headers={**headers, "Content-Type": "application/json"})
+
+    assert response.status_code == 200
+    assert response.json()["source"] == source
+    assert 400 < len(body) < 700
+
+
+def test_percentile():
+    values = [i / 100 for i in range(1, 101)]
+    assert loadtest.percentile(values, 50) == 0.5
+    assert loadtest.percentile(values, 99) == 0.99
+    assert loadtest.percentile([], 99) == 0.0
@@ -0,0 +1,72 @@
+"""
+Prometheus 指标测试
+"""
+from fastapi.testclient import TestClient
+
+from app import main
+from app.metrics import MetricsRegistry, forwards_total, stage_seconds, webhook_requests_total
+from app.models import Event, get_async_db
+from app.outbox import ForwardQueue
+from app.settings import settings
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("demo_seconds", "Demo", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "parse")
+    counter = registry.counter("demo_total", "Demo", ("source",))
+    counter.inc('we"ird')
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE demo_seconds histogram" in lines
+    assert 'demo_seconds_bucket{stage="parse",le="0.1"} 2' in lines
+    assert 'demo_seconds_bucket{stage="parse",le="1.0"} 3' in lines
+    assert 'demo_seconds_bucket{stage="parse",le="+Inf"} 4' in lines
+    assert 'demo_seconds_sum{stage="parse"} 3.65' in lines
+    assert 'demo_seconds_count{stage="parse"} 4' in lines
+    assert 'demo_total{source="we\\"ird"} 1' in lines
+
+
+def test_webhook_requests_are_measured(async_session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "CUSTOM_WEBHOOK_SECRET", "")
+    monkeypatch.setitem(main.app.dependency_overrides, get_async_db, lambda: (yield async_session_factory()))
+    client = TestClient(main.app)
+    ok_before = webhook_requests_total.value("custom", "200")
+    bad_before = webhook_requests_total.value("custom", "400")
+    parsed_before = stage_seconds.count("parse", "custom")
+
+    assert client.post("/webhook/custom", content=b'{"event": "ping"}').status_code == 200
+    assert client.post("/webhook/custom", content=b"not json").status_code == 400
+
+    assert webhook_requests_total.value("custom", "200") == ok_before + 1
+    assert webhook_requests_total.value("custom", "400") == bad_before + 1
+    assert stage_seconds.count("parse", "custom") == parsed_before + 2  # 解析失败同样计时
+
+
+def test_metrics_endpoint_reports_queue_depth(session_factory, monkeypatch):
+    db = session_factory()
+    try:
+        for _ in range(3):
+            event = Event(source="custom", event_type="test", payload="{}")
+            db.add(event)
+            db.flush()
+            ForwardQueue.enqueue(db, event, "http://consumer.local/hook")
+        db.commit()
+    finally:
+        db.close()
+    monkeypatch.setattr(main, "forward_queue", ForwardQueue(workers=1, session_factory=session_factory))
+    forwards_total.inc("consumer", "success")
+
+    response = TestClient(main.app).get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert 'relay_forward_outbox_depth{status="pending"} 3' in lines
+    assert "relay_ingest_queue_depth 0" in lines
+    assert any(line.startswith('relay_forwards_total{target="consumer",outcome="success"}') for line in lines)
+
+    monkeypatch.setattr(settings, "METRICS_ENABLED", False)
+    assert TestClient(main.app).get("/metrics").status_code == 404
@@ -0,0 +1,191 @@
+"""
+转发队列测试
+"""
+import asyncio
+
+import pytest
+
+from app.forwarder import ForwardResult
+from app.models import DeadLetter, Event, ForwardOutbox
+from app.outbox import ForwardQueue
+from app.retry import RetryPolicy, redrive_dead_letters
+from app.settings import settings
+
+
+class FakeForwarder:
+    """记录转发调用的假转发器"""
+
+    def __init__(self, result=True, delay=0.0):
+        self.result = result
+        self.delay = delay
+        self.calls = []
+
+    def record(self, results):
+        pass
+
+    async def send(self, event, target_url):
+        await asyncio.sleep(self.delay)
+        self.calls.append((event.id, target_url))
+        if self.result:
+            return ForwardResult(success=True, status_code=200)
+        return ForwardResult(success=False, status_code=503, error_message="HTTP 503")
+
+
+def _enqueue_events(session_factory, count, target_url="http://target.local/hook"):
+    db = session_factory()
+    try:
+        for i in range(count):
+            event = Event(source="custom", event_type="test", payload=f'{{"n": {i}}}')
+            db.add(event)
+            db.flush()
+            ForwardQueue.enqueue(db, event, target_url)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _drain(queue, session_factory, timeout=5.0):
+    await queue.start()
+    try:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            db = session_factory()
+            try:
+                remaining = db.query(ForwardOutbox).count()
+            finally:
+                db.close()
+            if remaining == 0:
+                return
+            await asyncio.sleep(0.05)
+    finally:
+        await queue.stop()
+
+
+def test_queue_forwards_all_entries(session_factory):
+    """所有入队事件都会被转发并移出队列"""
+    _enqueue_events(session_factory, 10)
+    forwarder = FakeForwarder()
+    queue = ForwardQueue(workers=3, forwarder=forwarder, session_factory=session_factory)
+
+    asyncio.run(_drain(queue, session_factory))
+
+    assert len(forwarder.calls) == 10
+    assert {url for _, url in forwarder.calls} == {"http://target.local/hook"}
+
+
+def test_stop_releases_claimed_entries(session_factory):
+    """停止时未完成的领取会回到 pending，重启后继续投递"""
+    _enqueue_events(session_factory, 5)
+    forwarder = FakeForwarder(delay=10)
+    queue = ForwardQueue(workers=1, forwarder=forwarder, session_factory=session_factory)
+
+    async def run():
+        await queue.start()
+        await asyncio.sleep(0.2)
+        await queue.stop()
+
+    asyncio.run(run())
+
+    db = session_factory()
+    try:
+        statuses = [entry.status for entry in db.query(ForwardOutbox).all()]
+    finally:
+        db.close()
+    assert len(statuses) == 5
+    assert set(statuses) == {"pending"}
+
+
+def test_queue_claims_only_for_free_workers(session_factory, monkeypatch):
+    """只领取空闲 worker 数量的记录，回收超时领取时跳过本进程正在处理的记录"""
+    _enqueue_events(session_factory, 10)
+    forwarder = FakeForwarder(delay=10)
+    queue = ForwardQueue(workers=2, forwarder=forwarder, session_factory=session_factory)
+
+    async def run():
+        await queue.start()
+        try:
+            await asyncio.sleep(0.2)
+            monkeypatch.setattr(settings, "FORWARD_QUEUE_LOCK_TIMEOUT", -1)
+            await asyncio.to_thread(queue._release_stale, list(queue._claimed))
+            db = session_factory()
+            try:
+                return db.query(ForwardOutbox).filter(ForwardOutbox.status == "processing").count()
+            finally:
+                db.close()
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(run()) == 2
+
+
+def test_retries_do_not_occupy_every_worker(session_factory, monkeypatch):
+    """到期重试再多，也只占 FORWARD_RETRY_CONCURRENCY 个 worker，其余留给首次投递"""
+    monkeypatch.setattr(settings, "FORWARD_RETRY_CONCURRENCY", 2)
+    _enqueue_events(session_factory, 6)
+    db = session_factory()
+    try:
+        db.query(ForwardOutbox).filter(ForwardOutbox.id <= 4).update({"attempts": 3})
+        db.commit()
+    finally:
+        db.close()
+    forwarder = FakeForwarder(delay=10)
+    queue = ForwardQueue(workers=4, forwarder=forwarder, session_factory=session_factory)
+
+    async def run():
+        await queue.start()
+        try:
+            await asyncio.sleep(0.2)
+            db = session_factory()
+            try:
+                return sorted(
+                    entry.attempts for entry in
+                    db.query(ForwardOutbox).filter(ForwardOutbox.status == "processing")
+                )
+            finally:
+                db.close()
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(run()) == [0, 0, 3, 3]
+
+
+def test_retry_policy_backoff_is_bounded():
+    """退避时间随次数增长，带抖动且不超过上限"""
+    policy = RetryPolicy(max_attempts=5, base_delay=2, max_delay=10)
+
+    for _ in range(100):
+        assert 1 <= policy.next_delay(1) <= 2
+        assert 4 <= policy.next_delay(3) <= 8
+        assert 5 <= policy.next_delay(10) <= 10
+    assert not policy.exhausted(4)
+    assert policy.exhausted(5)
+
+
+def test_failed_forwards_end_in_dead_letters(session_factory):
+    """重试耗尽后移入死信，重投后重新进入队列"""
+    _enqueue_events(session_factory, 3)
+    forwarder = FakeForwarder(result=False)
+    policy = RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+    queue = ForwardQueue(
+        workers=2, forwarder=forwarder, session_factory=session_factory, retry_policy=policy
+    )
+
+    asyncio.run(_drain(queue, session_factory))
+
+    assert len(forwarder.calls) == 9
+    db = session_factory()
+    try:
+        letters = db.query(DeadLetter).all()
+        assert len(letters) == 3
+        assert {letter.attempts for letter in letters} == {3}
+        assert {letter.last_error for letter in letters} == {"HTTP 503"}
+
+        requeued = redrive_dead_letters(db, ids=[letters[0].id], override_url="http://backup.local/hook")
+        assert requeued == 1
+        assert db.query(DeadLetter).count() == 2
+        entry = db.query(ForwardOutbox).one()
+        assert entry.target_url == "http://backup.local/hook"
+        assert entry.attempts == 0
+    finally:
+        db.close()
@@ -0,0 +1,98 @@
+"""
+分页与导出测试
+"""
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.models import Event, get_async_db
+from app.paging import apply_cursor, decode_cursor, encode_cursor, iter_export
+
+
+@pytest.fixture
+def seeded_factory(session_factory):
+    db = session_factory()
+    base = datetime(2024, 1, 1)
+    for i in range(25):
+        # 每两条共用一个时间戳，验证 id 作为第二排序键
+        db.add(Event(
+            source="github" if i % 5 else "stripe",
+            event_type="push",
+            payload=json.dumps({"n": i}),
+            created_at=base + timedelta(minutes=i // 2)
+        ))
+    db.commit()
+    db.close()
+    return session_factory
+
+
+def test_cursor_roundtrip():
+    moment = datetime(2024, 5, 6, 7, 8, 9, 123456)
+    assert decode_cursor(encode_cursor(moment, 42)) == (moment, 42)
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_keyset_pages_cover_all_events_once(seeded_factory):
+    db = seeded_factory()
+    try:
+        expected = [event.id for event in apply_cursor(db.query(Event), None).all()]
+
+        seen, cursor = [], None
+        while True:
+            page = apply_cursor(db.query(Event), cursor).limit(4).all()
+            if not page:
+                break
+            seen.extend(event.id for event in page)
+            cursor = encode_cursor(page[-1].created_at, page[-1].id)
+
+        assert seen == expected
+        assert len(seen) == 25
+    finally:
+        db.close()
+
+
+def test_export_ndjson_and_gzip(seeded_factory):
+    plain = b"".join(iter_export(source="github", session_factory=seeded_factory))
+    rows = [json.loads(line) for line in plain.decode().splitlines()]
+    assert len(rows) == 20
+    assert [row["id"] for row in rows] == sorted(row["id"] for row in rows)
+    assert {row["source"] for row in rows} == {"github"}
+
+    compressed = b"".join(iter_export(source="github", compress=True, session_factory=seeded_factory))
+    assert gzip.decompress(compressed) == plain
+
+
+def test_events_endpoint_pages_within_days_window(session_factory, async_session_factory, monkeypatch):
+    """/api/events 通过 X-Next-Cursor 翻页，游标与 days 窗口同时生效"""
+    now = datetime.utcnow()
+    db = session_factory()
+    for i in range(7):
+        db.add(Event(source="github", event_type="push", payload="{}",
+                     created_at=now - timedelta(hours=i)))
+    db.add(Event(source="github", event_type="push", payload="{}",
+                 created_at=now - timedelta(days=3)))
+    db.commit()
+    db.close()
+    monkeypatch.setitem(app.dependency_overrides, get_async_db, lambda: (yield async_session_factory()))
+    client = TestClient(app)
+
+    seen, cursor = [], None
+    while True:
+        params = {"days": 1, "limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/api/events", params=params)
+        assert response.status_code == 200
+        seen.extend(event["id"] for event in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert len(seen) == 7
+    assert len(set(seen)) == 7
+
+    response = client.get("/api/events", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
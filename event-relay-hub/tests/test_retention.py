@@ -0,0 +1,92 @@
+"""
+保留期清理测试
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from app import stats
+from app.main import app
+from app.models import Event, ForwardLog, ForwardOutbox, get_async_db
+from app.ingest import persist_events
+from app.retention import ArchiveStore, RetentionJob, archive_store
+from app.settings import settings
+
+
+def _seed(session_factory, now):
+    db = session_factory()
+    try:
+        events = [
+            Event(source="github" if i % 2 else "stripe", event_type="push", payload=f'{{"n": {i}}}',
+                  signature_valid=True, created_at=now - timedelta(days=40, hours=i))
+            for i in range(7)
+        ]
+        events.append(Event(source="github", event_type="push", payload='{"fresh": true}',
+                            signature_valid=True, created_at=now - timedelta(hours=1)))
+        persist_events(db, events)
+        db.add(ForwardOutbox(event_id=events[0].id, target_url="http://target.local/hook"))
+        db.add(ForwardLog(event_id=events[0].id, target_url="http://target.local/hook",
+                          success=True, created_at=now - timedelta(days=40)))
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_retention_archives_then_deletes_in_batches(session_factory, tmp_path, monkeypatch):
+    """过期事件与转发日志先归档再分批删除，统计同步扣减"""
+    monkeypatch.setattr(settings, "RETENTION_DAYS", 30)
+    monkeypatch.setattr(settings, "RETENTION_BATCH_PAUSE_MS", 0)
+    now = datetime.utcnow()
+    _seed(session_factory, now)
+    archive = ArchiveStore(str(tmp_path / "archive"))
+    job = RetentionJob(session_factory=session_factory, archive=archive, batch_size=3)
+
+    result = asyncio.run(job.run_once(now))
+
+    assert result["events"] == 7
+    assert result["forward_logs"] == 1
+    db = session_factory()
+    try:
+        assert db.query(Event).count() == 1
+        assert db.query(ForwardOutbox).count() == 0
+        assert db.query(ForwardLog).count() == 0
+        assert stats.compute_stats(db).total_events == 1
+    finally:
+        db.close()
+
+    archived = archive.query_events(limit=100)
+    assert len(archived) == 7
+    assert [event.created_at for event in archived] == sorted(
+        (event.created_at for event in archived), reverse=True
+    )
+    assert sorted(event.payload for event in archived) == sorted(f'{{"n": {i}}}' for i in range(7))
+    assert list((tmp_path / "archive" / "forward_logs").glob("*.jsonl.gz"))
+
+
+def test_events_api_pages_into_archive(session_factory, async_session_factory, tmp_path, monkeypatch):
+    """include_archive=true 时数据库记录之后继续返回归档记录，游标可跨越两者"""
+    monkeypatch.setattr(settings, "RETENTION_BATCH_PAUSE_MS", 0)
+    monkeypatch.setattr(archive_store, "root", tmp_path / "archive")
+    now = datetime.utcnow()
+    _seed(session_factory, now)
+    asyncio.run(RetentionJob(session_factory=session_factory, archive=archive_store).run_once(now))
+
+    monkeypatch.setitem(app.dependency_overrides, get_async_db, lambda: (yield async_session_factory()))
+    client = TestClient(app)
+
+    assert len(client.get("/api/events", params={"days": 60}).json()) == 1
+
+    seen, cursor = [], None
+    while True:
+        params = {"days": 60, "limit": 3, "include_archive": True, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/api/events", params=params)
+        assert response.status_code == 200
+        seen.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+
+    assert len(seen) == 8
+    assert seen[0]["payload"] == '{"fresh": true}'
+    assert len({event["id"] for event in seen}) == 8
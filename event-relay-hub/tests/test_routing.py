@@ -0,0 +1,157 @@
+"""
+转发路由测试
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app import ingest
+from app.forwarder import EventForwarder, ForwardClientPool, ForwardResult, TargetGates
+from app.ingest import persist_events
+from app.models import Event, ForwardLog, ForwardOutbox
+from app.outbox import ForwardQueue
+from app.routing import RoutingTable
+from app.settings import settings
+
+
+TARGETS = {
+    "billing": {"url": "http://billing.local/hook", "timeout": 2, "max_in_flight": 1},
+    "audit": {"url": "http://audit.local/hook", "rate_limit": 50},
+    "ci": {"url": "http://ci.local/hook"},
+}
+ROUTES = [
+    {"source": "stripe", "event_type": "charge.*", "targets": ["billing", "audit"]},
+    {"source": "*", "targets": ["audit"]},
+    {"source": "github", "event_type": "push", "targets": ["ci"]},
+]
+
+
+class SlowPool(ForwardClientPool):
+    """按目标主机记录并发数的 MockTransport 客户端池"""
+
+    def __init__(self, delay=0.05):
+        super().__init__()
+        self.delay = delay
+        self.active = {}
+        self.peak = {}
+
+    def _create_client(self):
+        async def handler(request):
+            host = request.url.host
+            self.active[host] = self.active.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0), self.active[host])
+            await asyncio.sleep(self.delay)
+            self.active[host] -= 1
+            return httpx.Response(200)
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class RecordingForwarder:
+    """记录各目标并发领取情况的假转发器"""
+
+    def __init__(self, delay=10.0):
+        self.delay = delay
+
+    def record(self, results):
+        pass
+
+    async def send(self, event, target_url):
+        await asyncio.sleep(self.delay)
+        return ForwardResult(success=True, status_code=200)
+
+
+def test_routing_table_matches_globs_in_rule_order():
+    table = RoutingTable(TARGETS, ROUTES, default_url="")
+
+    assert [t.name for t in table.match("stripe", "charge.succeeded")] == ["billing", "audit"]
+    assert [t.name for t in table.match("stripe", "invoice.paid")] == ["audit"]
+    assert [t.name for t in table.match("github", "push")] == ["audit", "ci"]
+    assert table.target_for("http://billing.local/hook").timeout == 2
+    assert table.target_for("http://unknown.local/hook").max_in_flight == 0
+
+    with_default = RoutingTable(TARGETS, ROUTES, default_url="http://legacy.local/hook")
+    assert [t.name for t in with_default.match("custom", None)] == ["audit", "default"]
+
+    with pytest.raises(ValueError):
+        RoutingTable({}, [{"targets": ["missing"]}], default_url="").targets
+
+
+def test_ingest_enqueues_one_entry_per_target(session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "FORWARD_ENABLED", True)
+    monkeypatch.setattr(ingest, "router", RoutingTable(TARGETS, ROUTES, default_url=""))
+    db = session_factory()
+    try:
+        persist_events(db, [
+            Event(source="stripe", event_type="charge.failed", payload="{}"),
+            Event(source="github", event_type="issues", payload="{}"),
+        ])
+        db.commit()
+        assert sorted(entry.target_url for entry in db.query(ForwardOutbox)) == [
+            "http://audit.local/hook", "http://audit.local/hook", "http://billing.local/hook"
+        ]
+    finally:
+        db.close()
+
+
+def test_fan_out_is_concurrent_and_logs_per_target(session_factory, monkeypatch):
+    """多目标并发投递，每个目标一条 ForwardLog，max_in_flight 限制单目标并发"""
+    monkeypatch.setattr("app.forwarder.router", RoutingTable(TARGETS, ROUTES, default_url=""))
+    db = session_factory()
+    events = [Event(source="stripe", event_type="charge.succeeded", payload=f'{{"n": {i}}}') for i in range(3)]
+    db.add_all(events)
+    db.commit()
+    pool = SlowPool(delay=0.1)
+    forwarder = EventForwarder(session_factory, pool, TargetGates())
+    urls = ["http://billing.local/hook", "http://audit.local/hook", "http://ci.local/hook"]
+
+    async def run():
+        started = asyncio.get_running_loop().time()
+        results = await asyncio.gather(*(forwarder.fan_out(event, urls) for event in events))
+        return results, asyncio.get_running_loop().time() - started
+
+    results, elapsed = asyncio.run(run())
+    db.close()
+
+    assert all(result.success for batch in results for result in batch)
+    assert pool.peak["billing.local"] == 1
+    assert pool.peak["ci.local"] == 3
+    assert elapsed < 0.5  # billing 串行 3 次，其余目标与之并行
+    db = session_factory()
+    try:
+        assert db.query(ForwardLog).count() == 9
+    finally:
+        db.close()
+
+
+def test_queue_limits_in_flight_per_target(session_factory, monkeypatch):
+    """max_in_flight 的目标在领取时限量，空闲 worker 留给其他目标"""
+    monkeypatch.setattr("app.outbox.router", RoutingTable(TARGETS, ROUTES, default_url=""))
+    db = session_factory()
+    try:
+        for i in range(8):
+            event = Event(source="custom", event_type="test", payload="{}")
+            db.add(event)
+            db.flush()
+            ForwardQueue.enqueue(db, event, "http://billing.local/hook" if i < 4 else "http://ci.local/hook")
+        db.commit()
+    finally:
+        db.close()
+    queue = ForwardQueue(workers=4, forwarder=RecordingForwarder(), session_factory=session_factory)
+
+    async def run():
+        await queue.start()
+        try:
+            await asyncio.sleep(0.2)
+            db = session_factory()
+            try:
+                return sorted(
+                    entry.target_url for entry in
+                    db.query(ForwardOutbox).filter(ForwardOutbox.status == "processing")
+                )
+            finally:
+                db.close()
+        finally:
+            await queue.stop()
+
+    assert asyncio.run(run()) == ["http://billing.local/hook"] + ["http://ci.local/hook"] * 3
@@ -0,0 +1,109 @@
+"""
+payload 全文检索测试
+"""
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from app import codecs, search
+from app.ingest import persist_events
+from app.main import app
+from app.models import Event, get_async_db
+from app.retention import ArchiveStore, RetentionJob
+from app.settings import settings
+
+
+def _seed(session_factory, now):
+    db = session_factory()
+    try:
+        persist_events(db, [
+            Event(source="stripe", event_type="charge.failed", created_at=now - timedelta(days=2),
+                  payload=json.dumps({"customer": "cus_123", "error": "card declined"})),
+            Event(source="stripe", event_type="charge.succeeded", created_at=now - timedelta(hours=1),
+                  payload=json.dumps({"customer": "cus_123", "note": "declined declined then retried"})),
+            Event(source="github", event_type="push", created_at=now - timedelta(hours=2),
+                  payload=json.dumps({"message": "declined review", "repo": "octo/hello"})),
+            Event(source="github", event_type="push", created_at=now - timedelta(days=40),
+                  payload=json.dumps({"message": "ancient declined push"})),
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_parse_query_quotes_terms():
+    match, terms = search.parse_query('card "cus_123" retr* OR')
+    assert match == 'payload : ("card" "cus_123" "retr"* "OR")'
+    assert terms == [("card", False), ("cus_123", False), ("retr", True), ("OR", False)]
+
+
+def test_build_snippet_marks_terms():
+    payload = "x" * 200 + " the card was Declined by issuer " + "y" * 200
+    snippet = search.build_snippet(payload, [("declined", False), ("iss", True)], width=60)
+    assert snippet.startswith("…") and snippet.endswith("…")
+    assert "<mark>Declined</mark>" in snippet
+    assert "<mark>issuer</mark>" in snippet
+
+
+def test_search_ranks_and_filters(session_factory, async_session_factory, monkeypatch):
+    """按 bm25 排序，source / 时间过滤，压缩存储的 payload 也能检索与生成片段"""
+    monkeypatch.setattr(settings, "STORAGE_COMPRESSION", "zlib")
+    monkeypatch.setattr(settings, "STORAGE_COMPRESSION_MIN_BYTES", 0)
+    monkeypatch.setattr(codecs, "_active_dicts", {})
+    now = datetime.utcnow()
+    _seed(session_factory, now)
+
+    monkeypatch.setitem(app.dependency_overrides, get_async_db, lambda: (yield async_session_factory()))
+    client = TestClient(app)
+
+    response = client.get("/api/events/search", params={"q": "declined"})
+    assert response.status_code == 200
+    hits = response.json()
+    assert len(hits) == 4
+    assert hits[0]["event_type"] == "charge.succeeded"
+    assert [hit["score"] for hit in hits] == sorted((hit["score"] for hit in hits), reverse=True)
+    assert "<mark>declined</mark>" in hits[0]["snippet"]
+
+    hits = client.get("/api/events/search", params={"q": "declined", "source": "stripe"}).json()
+    assert {hit["source"] for hit in hits} == {"stripe"}
+    assert len(hits) == 2
+
+    since = (now - timedelta(days=1)).isoformat()
+    hits = client.get("/api/events/search", params={"q": "declined", "since": since}).json()
+    assert sorted(hit["event_type"] for hit in hits) == ["charge.succeeded", "push"]
+
+    until = (now - timedelta(days=30)).isoformat()
+    hits = client.get("/api/events/search", params={"q": "declined", "until": until}).json()
+    assert [hit["event_type"] for hit in hits] == ["push"]
+
+    hits = client.get("/api/events/search", params={"q": "cus_123 card"}).json()
+    assert [hit["event_type"] for hit in hits] == ["charge.failed"]
+
+    assert client.get("/api/events/search", params={"q": '""'}).status_code == 400
+
+
+def test_retention_removes_index_entries(session_factory, tmp_path, monkeypatch):
+    """保留期清理删除事件时同步移除全文索引"""
+    monkeypatch.setattr(settings, "RETENTION_DAYS", 30)
+    monkeypatch.setattr(settings, "RETENTION_BATCH_PAUSE_MS", 0)
+    now = datetime.utcnow()
+    _seed(session_factory, now)
+
+    job = RetentionJob(session_factory=session_factory, archive=ArchiveStore(str(tmp_path / "archive")))
+    assert asyncio.run(job.run_once(now))["events"] == 1
+
+    db = session_factory()
+    try:
+        assert len(search.search_events(db, "ancient")) == 0
+        assert len(search.search_events(db, "declined")) == 3
+    finally:
+        db.close()
+
+    assert search.rebuild(session_factory=session_factory) == 3
+    db = session_factory()
+    try:
+        assert len(search.search_events(db, "declined")) == 3
+    finally:
+        db.close()
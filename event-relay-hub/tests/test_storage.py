@@ -0,0 +1,114 @@
+"""
+压缩存储测试
+"""
+import json
+
+import pytest
+from sqlalchemy import inspect, text
+
+from app import codecs, storage
+from app.models import Event
+from app.settings import settings
+
+
+def _github_payload(n):
+    return json.dumps({
+        "ref": "refs/heads/main",
+        "repository": {"id": 1296269, "full_name": "octocat/Hello-World", "private": False},
+        "pusher": {"name": f"user{n}", "email": f"user{n}@example.com"},
+        "commits": [{"id": f"{n:040d}", "message": "Update README.md", "distinct": True}] * 5
+    })
+
+
+def test_payload_compressed_on_insert_and_read_back(session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "STORAGE_COMPRESSION", "zlib")
+    payload = _github_payload(1)
+    headers = json.dumps({"x-github-event": "push", "content-type": "application/json"})
+
+    db = session_factory()
+    event = Event(source="github", event_type="push", payload=payload, headers=headers)
+    db.add(event)
+    db.commit()
+    event_id = event.id
+    db.close()
+
+    db = session_factory()
+    try:
+        raw_payload, codec, blob = db.execute(
+            text("SELECT payload, codec, payload_blob FROM events WHERE id = :id"), {"id": event_id}
+        ).one()
+        assert raw_payload == ""
+        assert codec == "zlib"
+        assert len(blob) < len(payload)
+
+        loaded = db.query(Event).filter(Event.id == event_id).one()
+        assert "payload_blob" in inspect(loaded).unloaded  # 列表查询不读取压缩正文
+        assert loaded.payload == payload
+        assert loaded.headers == headers
+    finally:
+        db.close()
+
+
+def test_small_payload_stays_plain(session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "STORAGE_COMPRESSION", "zlib")
+    db = session_factory()
+    try:
+        event = Event(source="custom", payload='{"a": 1}')
+        db.add(event)
+        db.commit()
+        assert event.codec is None
+        assert event.payload == '{"a": 1}'
+    finally:
+        db.close()
+
+
+def test_backfill_compresses_plain_rows(session_factory, monkeypatch):
+    monkeypatch.setattr(settings, "STORAGE_COMPRESSION", "none")
+    db = session_factory()
+    db.add_all([Event(source="github", payload=_github_payload(i)) for i in range(20)])
+    db.commit()
+    db.close()
+
+    monkeypatch.setattr(settings, "STORAGE_COMPRESSION", "zlib")
+    result = storage.backfill(batch_size=7, session_factory=session_factory)
+
+    assert result["events"] == 20
+    assert result["compressed"] == 20
+    assert result["bytes_after"] < result["bytes_before"]
+
+    db = session_factory()
+    try:
+        events = db.query(Event).order_by(Event.id).all()
+        assert {event.codec for event in events} == {"zlib"}
+        assert [event.payload for event in events] == [_github_payload(i) for i in range(20)]
+    finally:
+        db.close()
+
+
+def test_zstd_dictionary_per_source(session_factory, monkeypatch):
+    pytest.importorskip("zstandard")
+    monkeypatch.setattr(settings, "STORAGE_COMPRESSION", "zstd")
+    monkeypatch.setattr(codecs, "_active_dicts", None)
+
+    db = session_factory()
+    db.add_all([Event(source="github", payload=_github_payload(i)) for i in range(200)])
+    db.commit()
+    db.close()
+
+    trained = storage.train_dictionaries(["github"], dict_size=4096, session_factory=session_factory)
+    dict_id, samples = trained["github"]
+    assert samples == 200
+
+    db = session_factory()
+    try:
+        event = Event(source="github", payload=_github_payload(999))
+        db.add(event)
+        db.commit()
+        assert event.codec == f"zstd:{dict_id}"
+
+        loaded = db.query(Event).filter(Event.id == event.id).one()
+        loaded._payload_cache = None
+        assert loaded.payload == _github_payload(999)
+    finally:
+        db.close()
+        monkeypatch.setattr(codecs, "_active_dicts", None)